@@ -0,0 +1,88 @@
+"""流式 ASR 客户端耗时：对本地模拟讯飞服务（fake_xfyun.py）识别同一段 PCM，对比
+旧实现（每次重新签名与握手、每帧固定 sleep 20ms、最终结果后等 5 秒无消息才结束）
+与 ASRSessionManager（预签名地址、共享 SSL 上下文、预热连接、FramePacer 批量限速、收到 status=2 即返回）。
+
+用法：python benchmarks/bench_asr.py [--seconds 30] [--repeat 3] [--speedup 8] [--linger-ms 5000]
+--linger-ms 为模拟服务发完最终结果后保持连接的时间；需要安装 websockets。
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.fake_xfyun import serve  # noqa: E402
+from travel_planner_agent import asr  # noqa: E402
+
+
+async def _legacy(url: str, pcm: bytes) -> str:
+    # 旧 providers.transcribe_wav16_xfyun_ws 的发送/接收方式
+    import websockets
+    parts = []
+    async with websockets.connect(url, ssl=asr._ssl_context(url)) as ws:
+        await ws.send(asr.make_frame("bench", pcm[:asr.FRAME_BYTES], asr.STATUS_FIRST))
+        offset = asr.FRAME_BYTES
+        while offset < len(pcm):
+            end = min(offset + asr.FRAME_BYTES, len(pcm))
+            status = asr.STATUS_CONTINUE if end < len(pcm) else asr.STATUS_LAST
+            await ws.send(asr.make_frame("bench", pcm[offset:end], status))
+            offset = end
+            await asyncio.sleep(0.02)
+        try:
+            while True:
+                data = json.loads(await asyncio.wait_for(ws.recv(), timeout=5.0))
+                for item in ((data.get("data") or {}).get("result") or {}).get("ws") or []:
+                    parts.extend(cw.get("w") or "" for cw in item.get("cw") or [])
+        except (asyncio.TimeoutError, websockets.exceptions.ConnectionClosed):
+            pass
+    return "".join(parts)
+
+
+async def _run(args):
+    server, fake = await serve(port=0, linger_ms=args.linger_ms)
+    port = server.sockets[0].getsockname()[1]
+    os.environ["XFYUN_ASR_URL"] = f"ws://127.0.0.1:{port}/v2/iat"
+    pcm = bytes(asr.SAMPLE_RATE * 2 * args.seconds)
+    try:
+        if not args.skip_legacy:
+            t = time.perf_counter()
+            for _ in range(args.repeat):
+                text = await _legacy(os.environ["XFYUN_ASR_URL"], pcm)
+            legacy_ms = (time.perf_counter() - t) * 1000 / args.repeat
+            print(f"旧实现：平均 {legacy_ms:.0f}ms/次，结果 {text!r}")
+
+        manager = asr.ASRSessionManager("bench", "key", "secret", speedup=args.speedup,
+                                        burst_ms=args.burst_ms, prewarm=not args.no_prewarm)
+        totals = {}
+        for _ in range(args.repeat):
+            text, timings = await manager.transcribe(pcm)
+            for k, v in timings.items():
+                totals[k] = totals.get(k, 0.0) + v
+            # 两次请求之间留出后台预热的时间，接近真实使用的间隔
+            await asyncio.sleep(0.05)
+        await manager.close()
+        stages = "，".join(f"{k} {v / args.repeat:.0f}ms" for k, v in totals.items())
+        print(f"会话管理器：{stages}，结果 {text!r}")
+        print(f"统计：{manager.stats()}；模拟服务收到 {fake.sessions} 个会话 / {fake.frames} 帧")
+    finally:
+        server.close()
+        await server.wait_closed()
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--seconds", type=int, default=30)
+    ap.add_argument("--repeat", type=int, default=3)
+    ap.add_argument("--speedup", type=float, default=8.0)
+    ap.add_argument("--burst-ms", type=float, default=1000.0)
+    ap.add_argument("--linger-ms", type=float, default=5000.0)
+    ap.add_argument("--no-prewarm", action="store_true")
+    ap.add_argument("--skip-legacy", action="store_true")
+    asyncio.run(_run(ap.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+"""长行程分段并发生成的耗时对比（本地桩 LLM，按天数模拟输出耗时）：
+
+- single：一次性生成全部天数
+- chunked：骨架 + 按天数区间并发展开
+
+用法：python benchmarks/bench_chunked.py [--latency 0.2] [--per-day 0.4] [--chunk-days 3]
+"""
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DEEPSEEK_API_KEY", "stub-key")
+
+from benchmarks.stub_llm import start_stub  # noqa: E402
+from travel_planner_agent import llm, parse_form  # noqa: E402
+from travel_planner_agent import planner  # noqa: E402
+
+
+def _time(fn) -> float:
+    t0 = time.perf_counter()
+    fn()
+    return (time.perf_counter() - t0) * 1000
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--latency", type=float, default=0.2)
+    ap.add_argument("--per-day", type=float, default=0.4)
+    ap.add_argument("--chunk-days", type=int, default=3)
+    ap.add_argument("--concurrency", type=int, default=4)
+    args = ap.parse_args()
+    os.environ["LLM_CHUNK_DAYS"] = str(args.chunk_days)
+    os.environ["LLM_CHUNK_CONCURRENCY"] = str(args.concurrency)
+
+    server, base_url = start_stub(args.latency, per_day=args.per_day)
+    llm.DEEPSEEK_API_BASE = base_url
+    llm.set_cache(None)
+    try:
+        print(f"{'days':>4}  {'single(ms)':>11}  {'chunked(ms)':>12}")
+        for days in (3, 7, 14):
+            parsed = parse_form(destination="日本", days=days, cities=["东京"])
+            single = _time(lambda: planner.generate_itinerary_llm(parsed))
+            chunked = _time(lambda: planner.generate_itinerary_chunked(parsed))
+            print(f"{days:>4}  {single:>11.1f}  {chunked:>12.1f}")
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
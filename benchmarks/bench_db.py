@@ -0,0 +1,133 @@
+"""SQLite 访问吞吐对比：每次调用新建连接（旧实现） vs 连接池 + WAL（当前 db.py）。
+
+在临时数据库上用多个线程并发执行 create_plan / list_plans / get_plan，
+统计总吞吐与 database is locked 错误数。不会修改项目中的 app.db。
+
+用法：python benchmarks/bench_db.py [--threads 8] [--ops 300]
+"""
+import os
+import sys
+import json
+import time
+import sqlite3
+import tempfile
+import argparse
+import datetime
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from travel_planner_agent import db  # noqa: E402
+
+
+DATA = json.dumps({"行程概览": {"目的地": "日本"}, "详细日程": [{"日期": f"第{i}天"} for i in range(7)]}, ensure_ascii=False)
+
+
+# ---------- 旧实现：每次调用 connect/close ----------
+def naive_create_plan(path, user_id, title):
+    conn = sqlite3.connect(path)
+    try:
+        now = datetime.datetime.utcnow().isoformat()
+        cur = conn.execute(
+            "INSERT INTO plans(user_id, title, data_json, params_json, created_at, updated_at) VALUES(?,?,?,?,?,?)",
+            (user_id, title, DATA, None, now, now),
+        )
+        conn.commit()
+        return str(cur.lastrowid)
+    finally:
+        conn.close()
+
+
+def naive_list_plans(path, user_id):
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute(
+            "SELECT id, title, created_at, updated_at FROM plans WHERE user_id=? ORDER BY updated_at DESC",
+            (user_id,),
+        ).fetchall()
+    finally:
+        conn.close()
+
+
+def naive_get_plan(path, plan_id, user_id):
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute(
+            "SELECT id, title, data_json, params_json, created_at, updated_at FROM plans WHERE id=? AND user_id=?",
+            (plan_id, user_id),
+        ).fetchone()
+    finally:
+        conn.close()
+
+
+def _run(label, threads, ops, create, list_, get):
+    errors = [0]
+    lock = threading.Lock()
+
+    def worker(tid):
+        uid = str(tid % 4)
+        last = None
+        for i in range(ops):
+            try:
+                if i % 5 == 0:
+                    last = create(uid, f"plan-{tid}-{i}")
+                elif i % 5 in (1, 2):
+                    list_(uid)
+                elif last:
+                    get(last, uid)
+            except sqlite3.OperationalError:
+                with lock:
+                    errors[0] += 1
+
+    ts = [threading.Thread(target=worker, args=(t,)) for t in range(threads)]
+    t0 = time.perf_counter()
+    for t in ts:
+        t.start()
+    for t in ts:
+        t.join()
+    elapsed = time.perf_counter() - t0
+    total = threads * ops
+    print(f"{label:<8} {total / elapsed:10.0f} ops/s  耗时 {elapsed * 1000:8.1f}ms  locked 错误 {errors[0]}")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--threads", type=int, default=8)
+    ap.add_argument("--ops", type=int, default=300)
+    args = ap.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    before_path = os.path.join(tmp, "before.db")
+    after_path = os.path.join(tmp, "after.db")
+
+    db._db_path = lambda: after_path
+    db.init_db()
+    # 旧实现使用默认 rollback journal，表结构与 after 相同
+    conn = sqlite3.connect(before_path)
+    for (sql,) in sqlite3.connect(after_path).execute(
+        "SELECT sql FROM sqlite_master WHERE type='table' AND name='plans'"
+    ):
+        conn.execute(sql)
+    conn.commit()
+    conn.close()
+
+    _run(
+        "before",
+        args.threads,
+        args.ops,
+        lambda uid, t: naive_create_plan(before_path, uid, t),
+        lambda uid: naive_list_plans(before_path, uid),
+        lambda pid, uid: naive_get_plan(before_path, pid, uid),
+    )
+    _run(
+        "after",
+        args.threads,
+        args.ops,
+        lambda uid, t: db.create_plan(uid, t, DATA, None),
+        db.list_plans,
+        db.get_plan,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""登录吞吐与对其它请求的影响：线程内哈希（旧实现） vs 进程池哈希（当前 passwords.PasswordHasher）。
+
+模拟登录风暴：--logins 个并发登录与一组轻量请求同时进行。轻量请求与同步路由一样
+在线程池（大小 --threads，对应 Starlette 默认线程池）中执行，统计其延迟，
+用来观察登录是否把线程池占满。不会修改项目中的 app.db。
+
+用法：python benchmarks/bench_login.py [--logins 64] [--light 200] [--threads 8] [--workers 2]
+"""
+import os
+import sys
+import time
+import asyncio
+import tempfile
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from travel_planner_agent import db, db_async, passwords  # noqa: E402
+
+
+def _pct(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))] if values else 0.0
+
+
+async def _storm(label, login, args, pool):
+    loop = asyncio.get_running_loop()
+    light_lat = []
+
+    async def one_login(i):
+        return await login(f"user{i % 8}", "secret-pass")
+
+    async def one_light():
+        t = time.perf_counter()
+        await loop.run_in_executor(pool, db.get_user_by_id, "1")
+        light_lat.append((time.perf_counter() - t) * 1000)
+
+    async def light():
+        # 每 5ms 到达一个轻量请求，彼此独立，不等待前一个完成
+        tasks = []
+        for _ in range(args.light):
+            tasks.append(asyncio.create_task(one_light()))
+            await asyncio.sleep(0.005)
+        await asyncio.gather(*tasks)
+
+    t0 = time.perf_counter()
+    results = await asyncio.gather(light(), *[one_login(i) for i in range(args.logins)])
+    elapsed = time.perf_counter() - t0
+    ok = sum(1 for r in results[1:] if r)
+    print(
+        f"{label:<8} 登录 {ok}/{args.logins}  {args.logins / elapsed:6.1f} 次/s  "
+        f"轻量请求 p50 {_pct(light_lat, 0.5):7.2f}ms  p95 {_pct(light_lat, 0.95):7.2f}ms"
+    )
+
+
+async def main_async(args):
+    pool = ThreadPoolExecutor(max_workers=args.threads)
+    loop = asyncio.get_running_loop()
+
+    # 旧实现：同步路由在线程池中完成查库与哈希
+    passwords._hasher = passwords.PasswordHasher(workers=0, max_queue=10 ** 6)
+
+    async def before(u, p):
+        return await loop.run_in_executor(pool, db.verify_user, u, p)
+
+    await _storm("before", before, args, pool)
+
+    # 当前实现：async 路由，哈希在进程池中 await
+    passwords._hasher = passwords.PasswordHasher(workers=args.workers, max_queue=10 ** 6)
+    await db_async.verify_user("user0", "warm-up")  # 启动进程池
+    await _storm("after", db_async.verify_user, args, pool)
+    passwords._hasher.shutdown()
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--logins", type=int, default=64)
+    ap.add_argument("--light", type=int, default=200)
+    ap.add_argument("--threads", type=int, default=8)
+    ap.add_argument("--workers", type=int, default=2)
+    args = ap.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), "login.db")
+    db._db_path = lambda: path
+    db.init_db()
+    passwords._hasher = passwords.PasswordHasher(workers=0)
+    for i in range(8):
+        db.create_user(f"user{i}", "secret-pass")
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
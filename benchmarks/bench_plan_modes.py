@@ -0,0 +1,68 @@
+"""对比两种规划模式的端到端耗时（本地桩 LLM，无外网）：
+
+- text：表单拼接为文本 → LLM 解析 → LLM 生成行程（两次往返）
+- form：表单字段直接作为参数 → LLM 生成行程（一次往返）
+
+用法：python benchmarks/bench_plan_modes.py [--latency 0.3] [--rounds 10]
+"""
+import os
+import sys
+import time
+import argparse
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DEEPSEEK_API_KEY", "stub-key")
+
+from benchmarks.stub_llm import start_stub  # noqa: E402
+from travel_planner_agent import llm, plan_trip, plan_trip_form, compose_form_text  # noqa: E402
+
+
+FIELDS = {
+    "destination": "日本",
+    "days": 5,
+    "budget_cny": 10000,
+    "adults": 2,
+    "children": 1,
+    "preferences": ["美食", "动漫"],
+    "cities": ["东京"],
+    "extra_info": "",
+}
+
+
+def _run(label: str, fn, rounds: int) -> list:
+    samples = []
+    for _ in range(rounds):
+        t0 = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - t0) * 1000)
+    print(f"{label:<6} p50={statistics.median(samples):8.1f}ms  mean={statistics.mean(samples):8.1f}ms  "
+          f"max={max(samples):8.1f}ms")
+    return samples
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--latency", type=float, default=0.3, help="桩服务每次调用的模拟延迟（秒）")
+    ap.add_argument("--rounds", type=int, default=10)
+    args = ap.parse_args()
+
+    server, base_url = start_stub(args.latency)
+    llm.DEEPSEEK_API_BASE = base_url
+    llm.set_cache(None)  # 关闭缓存，只比较往返次数
+    try:
+        text = compose_form_text(**FIELDS)
+        handler = server.RequestHandlerClass
+        handler.calls = 0
+        t = _run("text", lambda: plan_trip(text), args.rounds)
+        text_calls, handler.calls = handler.calls, 0
+        f = _run("form", lambda: plan_trip_form(**FIELDS), args.rounds)
+        form_calls = handler.calls
+        print(f"LLM 调用次数/计划：text={text_calls / args.rounds:.1f}  form={form_calls / args.rounds:.1f}")
+        print(f"p50 加速比：{statistics.median(t) / statistics.median(f):.2f}x")
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+"""行程生成调用的 token 对比（离线，不调用 LLM）：旧提示词（散文式字段说明 + 完整 parsed，含 raw_text）
+与精简提示词（由 schema 生成的紧凑结构说明 + 去掉冗余字段的参数）的输入 token，
+以及模型按旧格式回写 destination/people 等字段并附带说明字段时与按 schema 输出时的输出 token。
+最后用几类常见的损坏 JSON 对比旧解析（直接退回空行程）与本地修复后保留的天数。
+
+用法：python benchmarks/bench_prompt_tokens.py [--days 3 5 7]
+安装 tiktoken 时用 cl100k_base 计数，否则按 DeepSeek 文档的换算估算（中文字符约 0.6 token，其它字符约 0.3 token）；
+两者与 DeepSeek 实际计费会有出入，但比例可信。
+"""
+import os
+import re
+import sys
+import json
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.stub_llm import _itinerary  # noqa: E402
+from travel_planner_agent import llm, parse_form  # noqa: E402
+from travel_planner_agent.schema import ITINERARY_SCHEMA, conform, loads_json  # noqa: E402
+from travel_planner_agent.usage import get_usage_recorder  # noqa: E402
+
+try:
+    import tiktoken
+    _enc = tiktoken.get_encoding("cl100k_base")
+except Exception:
+    _enc = None
+
+_CJK = re.compile(r"[\u3000-\u303f\u4e00-\u9fff\uff00-\uffef]")
+
+
+def count_tokens(text: str) -> int:
+    if _enc is not None:
+        return len(_enc.encode(text))
+    cjk = len(_CJK.findall(text))
+    return round(cjk * 0.6 + (len(text) - cjk) * 0.3)
+
+
+def _messages_tokens(messages) -> int:
+    # 每条消息另计约 4 个 token 的角色与分隔符开销
+    return sum(count_tokens(m["content"]) + 4 for m in messages)
+
+
+def _legacy_messages(parsed):
+    # 改动前 llm._itinerary_messages 的提示词
+    system = {
+        "role": "system",
+        "content": (
+            "作为专业旅行顾问，根据输入参数生成可执行的多日行程。"
+            "仅返回一个JSON对象，字段：destination, city, hotel{name, area, price_range_cny:[low,high]},"
+            "transport{airport_city:[{route,mode,cost_cny,duration_min}], local:[{card,pass?,benefit,cost_cny?}]},"
+            "days, plan:[{day, theme, morning:{name,type,open_time,ticket_cny,duration_hours,suitable,area},"
+            "afternoon:{...同结构}, evening_meal:{name,cuisine,avg_spend_cny,area,features}, notes}],"
+            "people{adults,children}, preferences[]。时间安排应避免重复与不合理折返，兼顾亲子与偏好。"
+        ),
+    }
+    user = {"role": "user", "content": json.dumps(parsed, ensure_ascii=False)}
+    return [system, user]
+
+
+def _samples(days: int):
+    text = (f"我们一家三口（两个大人一个6岁孩子）打算{days}天去日本东京玩，预算一万五左右，"
+            "喜欢美食和动漫，孩子想去迪士尼，尽量不要太赶，酒店最好在地铁站附近。")
+    text_parsed = {
+        "raw_text": text, "destination": "日本", "city": "东京", "days": days, "budget_cny": 15000,
+        "people": {"adults": 2, "children": 1}, "preferences": ["美食", "动漫"], "special_needs": ["亲子"],
+        "extra_info": "孩子想去迪士尼，尽量不要太赶，酒店最好在地铁站附近",
+    }
+    form_parsed = parse_form(destination="日本", start_date="2025-04-01", days=days, budget_cny=15000, adults=2,
+                             children=1, preferences=["美食", "动漫"], cities=["东京", "大阪"],
+                             extra_info="孩子想去迪士尼，尽量不要太赶")
+    return [("文本模式", text_parsed), ("表单模式", form_parsed)]
+
+
+def _legacy_reply(days: int) -> dict:
+    # 模型按旧提示词的典型输出：回写输入参数，并附带下游不读取的说明字段
+    data = _itinerary(days)
+    data["summary"] = "本行程以东京市区为主，兼顾美食与动漫主题，节奏适中，适合亲子出行。"
+    data["tips"] = ["提前预约热门景点", "随身携带交通卡"]
+    for d in data["plan"]:
+        d["morning"]["description"] = "东京最古老的寺庙，雷门与仲见世商店街值得一逛。"
+        d["afternoon"]["description"] = "适合拍照与购物，周边小吃丰富。"
+        d["transport_tips"] = "景点之间乘地铁约 20 分钟。"
+    return data
+
+
+def _reply_text(data: dict) -> str:
+    return json.dumps(data, ensure_ascii=False, indent=2)
+
+
+def _damaged(text: str):
+    return {
+        "尾逗号": text.replace('"notes": "避免折返"', '"notes": "避免折返",'),
+        "代码块与说明": "以下是为您规划的行程：\n```json\n" + text + "\n```\n祝旅途愉快！",
+        "输出截断": text[:int(len(text) * 0.85)],
+        "字符串内换行": text.replace("避免折返", "避免折返\n注意安全"),
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--days", type=int, nargs="+", default=[3, 5, 7])
+    args = ap.parse_args()
+    print(f"计数方式：{'tiktoken cl100k_base' if _enc is not None else '字符估算'}")
+    recorder = get_usage_recorder()
+
+    print("\n输入 token（行程生成调用，与天数无关）：")
+    for label, parsed in _samples(args.days[0]):
+        old = _messages_tokens(_legacy_messages(parsed))
+        new = _messages_tokens(llm._itinerary_messages(parsed))
+        # json_schema / tool 模式下 schema 随请求发送，同样计入输入
+        llm.LLM_SCHEMA_MODE = "json_schema"
+        strict = _messages_tokens(llm._itinerary_messages(parsed)) + count_tokens(json.dumps(ITINERARY_SCHEMA))
+        llm.LLM_SCHEMA_MODE = "json_object"
+        print(f"  {label}：旧 {old}，精简 {new}（-{(old - new) / old:.0%}），严格 schema 模式约 {strict}")
+
+    print("\n输出 token（行程 JSON）：")
+    for days in args.days:
+        legacy = _legacy_reply(days)
+        old = count_tokens(_reply_text(legacy))
+        new = count_tokens(_reply_text(conform(legacy, ITINERARY_SCHEMA)))
+        print(f"  {days} 天：旧格式 {old}，按 schema {new}（-{(old - new) / old:.0%}）")
+
+    days = args.days[0]
+    parsed = _samples(days)[1][1]
+    old_total = _messages_tokens(_legacy_messages(parsed)), count_tokens(_reply_text(_legacy_reply(days)))
+    new_total = (_messages_tokens(llm._itinerary_messages(parsed)),
+                 count_tokens(_reply_text(conform(_legacy_reply(days), ITINERARY_SCHEMA))))
+    print(f"\n每千个 {days} 天计划（表单模式）的估算费用：旧 ¥{recorder.cost(*old_total) * 1000:.2f}，"
+          f"精简 ¥{recorder.cost(*new_total) * 1000:.2f}")
+
+    print("\n损坏 JSON 的解析结果（计划天数）：")
+    text = _reply_text(_legacy_reply(days))
+    for label, bad in _damaged(text).items():
+        try:
+            old_days = len(json.loads(bad).get("plan") or [])
+        except ValueError:
+            old_days = 0
+        new_days = len(llm._normalize_itinerary(parsed, bad)["plan"])
+        fixed = loads_json(bad) is not None
+        print(f"  {label}：旧解析 {old_days} 天，修复后 {new_days} 天{'' if fixed else '（修复失败）'}")
+
+
+if __name__ == "__main__":
+    main()
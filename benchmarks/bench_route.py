@@ -0,0 +1,72 @@
+"""路线优化器耗时与效果：随机生成 N 个带坐标/开放时间/游玩时长的候选景点，
+分配到若干天并排序，统计耗时与总里程（对比按候选原顺序逐天排入的朴素方案）。
+
+用法：python benchmarks/bench_route.py [--pois 240] [--days 5] [--stops 0] [--repeat 20]
+--stops 为每天最多景点数，0 表示只受当天时间限制。
+"""
+import os
+import sys
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from travel_planner_agent import optimizer  # noqa: E402
+
+
+def _make_pois(n, seed=7):
+    rnd = random.Random(seed)
+    areas = [(139.70 + rnd.random() * 0.2, 35.60 + rnd.random() * 0.15) for _ in range(12)]
+    hours = ["09:00-17:00", "10:00-20:00", "全天", "09:30-17:00(周一闭馆)", "11:00-22:00"]
+    pois = []
+    for i in range(n):
+        a = rnd.randrange(len(areas))
+        lng, lat = areas[a]
+        pois.append({
+            "name": f"景点{i}",
+            "area": f"区域{a}",
+            "lng": lng + rnd.gauss(0, 0.01),
+            "lat": lat + rnd.gauss(0, 0.01),
+            "open_time": rnd.choice(hours),
+            "duration_hours": rnd.choice([1, 1.5, 2, 3]),
+        })
+    return pois
+
+
+def _naive_km(result, start):
+    # 同样的每日景点集合，按候选原顺序游览的里程
+    total = 0.0
+    for legs in result["days"]:
+        pts = [start] + [(leg["poi"]["lng"], leg["poi"]["lat"]) for leg in sorted(legs, key=lambda g: int(g["poi"]["name"][2:]))]
+        m = optimizer.distance_matrix(pts)
+        total += sum(m[i][i + 1] for i in range(len(pts) - 1))
+    return total
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--pois", type=int, default=240)
+    ap.add_argument("--days", type=int, default=5)
+    ap.add_argument("--stops", type=int, default=0)
+    ap.add_argument("--repeat", type=int, default=20)
+    args = ap.parse_args()
+
+    pois = _make_pois(args.pois)
+    start = (139.7946, 35.7119)
+    timings = []
+    result = None
+    for _ in range(args.repeat):
+        t = time.perf_counter()
+        result = optimizer.optimize_days(pois, args.days, start=start, max_stops=args.stops or None)
+        timings.append((time.perf_counter() - t) * 1000)
+    timings.sort()
+    visited = sum(len(d) for d in result["days"])
+    print(f"numpy: {'yes' if optimizer.np is not None else 'no (纯 Python 回退)'}")
+    print(f"候选 {args.pois}  天数 {args.days}  安排 {visited}  舍弃 {len(result['dropped'])}")
+    print(f"耗时 p50 {timings[len(timings) // 2]:.1f}ms  max {timings[-1]:.1f}ms")
+    print(f"总里程 {result['distance_km']:.1f}km  （同一分组按原顺序 {_naive_km(result, start):.1f}km）")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""计划全文检索耗时：在临时数据库上写入 N 个计划（默认 10 万），统计 search_plans 的延迟分布。
+
+计划分属 --users 个用户，目的地、景点、餐厅、酒店从固定词表中随机组合。
+不会修改项目中的 app.db。
+
+用法：python benchmarks/bench_search.py [--plans 100000] [--users 200] [--queries 200]
+"""
+import os
+import sys
+import json
+import time
+import random
+import tempfile
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from travel_planner_agent import db  # noqa: E402
+
+
+CITIES = ["杭州", "北京", "上海", "成都", "西安", "厦门", "重庆", "南京", "苏州", "桂林", "大理", "青岛"]
+PLACES = ["西湖", "故宫", "外滩", "宽窄巷子", "兵马俑", "鼓浪屿", "洪崖洞", "夫子庙", "拙政园", "漓江",
+          "洱海", "栈桥", "灵隐寺", "长城", "豫园", "大熊猫基地", "大雁塔", "南普陀寺", "解放碑", "中山陵"]
+FOODS = ["楼外楼", "全聚德", "南翔馒头店", "陈麻婆豆腐", "老孙家泡馍", "沙茶面", "火锅", "鸭血粉丝汤", "松鼠鳜鱼", "啤酒屋"]
+HOTELS = ["国宾馆", "快捷酒店", "民宿", "度假酒店", "青年旅舍"]
+QUERIES = ["西湖", "杭州 楼外楼", "故宫", "火锅", "民宿", "大熊猫", "鼓浪屿 沙茶面", "长城", "酒店", "不存在的地方"]
+
+
+def make_plan(rng):
+    city = rng.choice(CITIES)
+    days = rng.randint(2, 7)
+    detail = []
+    for d in range(days):
+        detail.append({
+            "日期": f"第{d + 1}天",
+            "安排": [{"地点": rng.choice(PLACES)}, {"地点": rng.choice(PLACES)}, {"餐厅": rng.choice(FOODS)}],
+        })
+    data = {
+        "行程概览": {"目的地": city, "城市": city, "天数": days, "总预算": rng.randint(1, 20) * 1000},
+        "详细日程": detail,
+        "住宿推荐": {"name": city + rng.choice(HOTELS), "area": "市中心"},
+    }
+    return f"{city}{days}日游", json.dumps(data, ensure_ascii=False)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--plans", type=int, default=100000)
+    ap.add_argument("--users", type=int, default=200)
+    ap.add_argument("--queries", type=int, default=200)
+    args = ap.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), "search.db")
+    db._db_path = lambda: path
+    db.init_db()
+    rng = random.Random(42)
+
+    t0 = time.perf_counter()
+    for i in range(args.plans):
+        title, data = make_plan(rng)
+        db.create_plan(str(i % args.users), title, data, None)
+    print(f"写入 {args.plans} 个计划：{time.perf_counter() - t0:.1f}s")
+
+    lat = []
+    for i in range(args.queries):
+        uid = str(rng.randrange(args.users))
+        q = QUERIES[i % len(QUERIES)]
+        t = time.perf_counter()
+        db.search_plans(uid, q, limit=20)
+        lat.append((time.perf_counter() - t) * 1000)
+    lat.sort()
+    p50 = lat[len(lat) // 2]
+    p95 = lat[int(len(lat) * 0.95) - 1]
+    print(f"search_plans  p50 {p50:6.2f}ms  p95 {p95:6.2f}ms  max {lat[-1]:6.2f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""本地模拟的讯飞语音听写（流式版）WebSocket 服务，用于离线调试 /ws/asr 与 ASR 基准测试。
+
+协议与真实服务一致：首帧带 common/business，data.status 0/1/2，音频为 base64 的 16k PCM。
+每收到 --chars-every 帧音频产出一个字的中间结果（开启 dwa=wpgs 时以 rpl 方式整体替换），
+收到 status=2 后等待 --final-ms 毫秒返回 status=2 的最终结果，再过 --linger-ms 毫秒关闭连接
+（linger 用于模拟发完最终结果后不立即断开的情况，客户端应以 status=2 为结束而不是等连接关闭）。
+
+用法：
+    python benchmarks/fake_xfyun.py [--port 8765] [--text 我想去东京玩五天]
+    XFYUN_ASR_URL=ws://127.0.0.1:8765/v2/iat XFYUN_APPID=x XFYUN_API_KEY=x XFYUN_API_SECRET=x uvicorn web_app:app
+"""
+import json
+import base64
+import asyncio
+import argparse
+
+
+def _result(sn: int, text: str, status: int, replace: bool) -> str:
+    result = {
+        "sn": sn,
+        "ls": status == 2,
+        "ws": [{"bg": 0, "cw": [{"w": ch, "sc": 0}]} for ch in text],
+    }
+    if replace:
+        result.update({"pgs": "rpl", "rg": [1, max(1, sn - 1)]})
+    return json.dumps({"code": 0, "message": "success", "sid": "fake", "data": {"result": result, "status": status}},
+                      ensure_ascii=False)
+
+
+class FakeRecognizer:
+    def __init__(self, text: str = "我想去东京玩五天", chars_every: int = 5, final_ms: float = 50,
+                 linger_ms: float = 0):
+        self.text = text
+        self.chars_every = chars_every
+        self.final_ms = final_ms
+        self.linger_ms = linger_ms
+        self.sessions = 0
+        self.frames = 0
+        self.audio_bytes = 0
+
+    async def handle(self, ws, *_):
+        self.sessions += 1
+        frames = 0
+        sn = 0
+        emitted = 0
+        wpgs = False
+        async for msg in ws:
+            frame = json.loads(msg)
+            if "business" in frame:
+                wpgs = frame["business"].get("dwa") == "wpgs"
+            data = frame.get("data") or {}
+            audio = base64.b64decode(data.get("audio") or "")
+            self.audio_bytes += len(audio)
+            if audio:
+                frames += 1
+                self.frames += 1
+            shown = min(len(self.text), frames // self.chars_every)
+            if data.get("status") == 2:
+                await asyncio.sleep(self.final_ms / 1000)
+                sn += 1
+                # 最终结果：动态修正时给出全文，否则只给出尚未下发的部分
+                await ws.send(_result(sn, self.text if wpgs else self.text[emitted:], 2, wpgs and sn > 1))
+                if self.linger_ms:
+                    await asyncio.sleep(self.linger_ms / 1000)
+                await ws.close()
+                return
+            if shown > emitted:
+                sn += 1
+                # 开启动态修正时每次给出完整前缀并替换之前的结果，否则只追加新字
+                piece = self.text[:shown] if wpgs else self.text[emitted:shown]
+                await ws.send(_result(sn, piece, 1, wpgs and sn > 1))
+                emitted = shown
+
+
+async def serve(host: str = "127.0.0.1", port: int = 8765, **kwargs):
+    """启动模拟服务，返回 (server, FakeRecognizer)；port=0 时由系统分配端口。"""
+    import websockets
+    fake = FakeRecognizer(**kwargs)
+    server = await websockets.serve(fake.handle, host, port, max_size=None)
+    return server, fake
+
+
+async def _main(args):
+    server, _ = await serve(args.host, args.port, text=args.text, chars_every=args.chars_every,
+                            final_ms=args.final_ms, linger_ms=args.linger_ms)
+    print(f"模拟讯飞 ASR 服务：ws://{args.host}:{args.port}/v2/iat")
+    await server.wait_closed()
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8765)
+    ap.add_argument("--text", default="我想去东京玩五天")
+    ap.add_argument("--chars-every", type=int, default=5)
+    ap.add_argument("--final-ms", type=float, default=50)
+    ap.add_argument("--linger-ms", type=float, default=0)
+    asyncio.run(_main(ap.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""本地 OpenAI 兼容的桩 LLM 服务，供基准测试使用，不访问外网。
+
+POST /v1/chat/completions：根据系统提示词判断是解析还是行程请求，
+按 latency 秒延迟后返回固定 JSON。
+"""
+import json
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+PARSED = {
+    "destination": "日本",
+    "city": "东京",
+    "days": 5,
+    "budget_cny": 10000,
+    "people": {"adults": 2, "children": 1},
+    "preferences": ["美食", "动漫"],
+    "special_needs": [],
+}
+
+
+def _itinerary(days: int) -> dict:
+    spot = {"name": "浅草寺", "type": "文化", "open_time": "06:00-17:00", "ticket_cny": 0,
+            "duration_hours": 2, "suitable": ["成人", "亲子"], "area": "浅草"}
+    meal = {"name": "一兰拉面", "cuisine": "拉面", "avg_spend_cny": 80, "area": "多区域", "features": []}
+    return {
+        "destination": "日本",
+        "city": "东京",
+        "hotel": {"name": "浅草商务酒店", "area": "浅草", "price_range_cny": [450, 700]},
+        "transport": {"airport_city": [], "local": []},
+        "days": days,
+        "plan": [
+            {"day": i + 1, "theme": "城市精选", "morning": dict(spot, name=f"景点{i}-上午"),
+             "afternoon": dict(spot, name=f"景点{i}-下午"), "evening_meal": meal, "notes": "避免折返"}
+            for i in range(days)
+        ],
+        "people": {"adults": 2, "children": 1},
+        "preferences": ["美食", "动漫"],
+    }
+
+
+def _reply(messages) -> tuple:
+    """返回 (内容, 行程天数)；天数用于按输出长度模拟生成耗时。"""
+    system = (messages[0].get("content") or "") if messages else ""
+    try:
+        user = json.loads(messages[-1]["content"])
+    except Exception:
+        user = {}
+    if "skeleton" in system:
+        days = int(user.get("days") or 5)
+        out = {k: v for k, v in _itinerary(days).items() if k in ("destination", "city", "hotel", "transport")}
+        out["skeleton"] = [{"day": i + 1, "theme": "城市精选", "area": f"区域{i + 1}"} for i in range(days)]
+        return out, 0
+    if "days_to_plan" in user:
+        wanted = [d["day"] for d in user["days_to_plan"]]
+        plan = _itinerary(max(wanted))["plan"]
+        return {"plan": [plan[d - 1] for d in wanted]}, len(wanted)
+    if "plan" in system:
+        days = int(user.get("days") or 5)
+        return _itinerary(days), days
+    return PARSED, 0
+
+
+def make_handler(latency: float, per_day: float = 0.0):
+    """latency：每次调用的固定延迟；per_day：行程每多生成一天增加的延迟（模拟输出 token 耗时）。"""
+    class Handler(BaseHTTPRequestHandler):
+        calls = 0
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+            req = json.loads(body or b"{}")
+            Handler.calls += 1
+            reply, days = _reply(req.get("messages") or [])
+            time.sleep(latency + per_day * days)
+            content = json.dumps(reply, ensure_ascii=False)
+            payload = json.dumps({
+                "id": "stub",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": req.get("model") or "stub",
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": content}}],
+                "usage": {"prompt_tokens": len(body) // 4, "completion_tokens": len(content) // 2,
+                          "total_tokens": len(body) // 4 + len(content) // 2},
+            }).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+
+def start_stub(latency: float = 0.3, port: int = 0, per_day: float = 0.0):
+    """启动桩服务，返回 (server, base_url)；调用 server.shutdown() 结束。"""
+    handler = make_handler(latency, per_day)
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/v1"
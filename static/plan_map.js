@@ -0,0 +1,151 @@
+// 使用服务端预先计算的路线（result["路线"]）绘制地图：
+// 标注与折线直接来自数据，不调用 AMap 的地理编码与路线规划。
+(function(){
+  var palette = ['#2563eb','#16a34a','#dc2626','#7c3aed','#f59e0b','#0ea5e9'];
+  var modeNames = { driving: '驾车', walking: '步行', riding: '骑行' };
+
+  function hasStops(routes) {
+    return !!(routes && Array.isArray(routes.days) && routes.days.some(function(d){ return d && d.stops && d.stops.length; }));
+  }
+
+  // 结构化结果中每个景点是否都已出现在服务端路线中（缺坐标的景点不会进入路线）
+  function coversAll(routes, result) {
+    var schedule = result && result['详细日程'];
+    if (!Array.isArray(schedule)) return true;
+    return schedule.every(function(day, i){
+      var stops = ((routes.days || [])[i] || {}).stops || [];
+      var names = {};
+      stops.forEach(function(s){ names[s.name] = true; });
+      return ((day && day['安排']) || []).every(function(item){
+        return !item || !item['地点'] || names[item['地点']];
+      });
+    });
+  }
+
+  function styleButton(btn, active) {
+    btn.style.background = active ? '#2563eb' : '#111827';
+    btn.style.color = '#fff';
+  }
+
+  function makeButton(text) {
+    var btn = document.createElement('button');
+    btn.type = 'button';
+    btn.textContent = text;
+    btn.className = 'secondary';
+    btn.style.padding = '6px 10px';
+    btn.style.borderRadius = '6px';
+    btn.style.cursor = 'pointer';
+    return btn;
+  }
+
+  function formatLeg(day) {
+    var km = (day.distance_m || 0) / 1000;
+    var min = Math.round((day.duration_s || 0) / 60);
+    return '当天路程约 ' + km.toFixed(1) + ' 公里，' + min + ' 分钟';
+  }
+
+  // opts: { mapId, controlsId, summaryId, routes, routesUrl }
+  // routesUrl 存在时，切换出行方式会请求 routesUrl + '?mode=xxx'（服务端经缓存计算）
+  function render(opts) {
+    var map = new AMap.Map(opts.mapId, { zoom: 12, viewMode: '2D' });
+    var routes = opts.routes;
+    var overlays = [];
+    var currentDay = 0;
+
+    function clear() {
+      overlays.forEach(function(o){ o.setMap(null); });
+      overlays = [];
+    }
+
+    function renderDay(idx) {
+      currentDay = idx;
+      clear();
+      var day = (routes.days || [])[idx] || { stops: [], legs: [] };
+      var color = palette[idx % palette.length];
+      var n = 0;
+      (day.stops || []).forEach(function(s, i){
+        // 首尾的酒店只标注一次
+        if (s.type === 'hotel' && i > 0) return;
+        var mk = new AMap.Marker({
+          position: [s.lng, s.lat],
+          title: s.name,
+          icon: s.type === 'hotel' ? 'https://webapi.amap.com/theme/v1.3/markers/n/mark_b.png' : 'https://webapi.amap.com/theme/v1.3/markers/n/mark_r.png'
+        });
+        if (s.type !== 'hotel') {
+          n += 1;
+          try { mk.setLabel({ content: String(n), direction: 'top' }); } catch (e) { /* 兼容处理 */ }
+        }
+        mk.setMap(map);
+        overlays.push(mk);
+      });
+      (day.legs || []).forEach(function(leg){
+        if (!leg.polyline || leg.polyline.length < 2) return;
+        var line = new AMap.Polyline({
+          path: leg.polyline,
+          isOutline: true,
+          outlineColor: '#ffffff',
+          borderWeight: 2,
+          strokeColor: color,
+          strokeOpacity: 0.9,
+          strokeWeight: 4,
+        });
+        line.setMap(map);
+        overlays.push(line);
+      });
+      if (overlays.length) { map.setFitView(overlays); }
+      var summary = opts.summaryId && document.getElementById(opts.summaryId);
+      if (summary) { summary.textContent = (day.legs && day.legs.length) ? formatLeg(day) : ''; }
+      var controls = document.getElementById(opts.controlsId);
+      if (controls) {
+        controls.querySelectorAll('button[data-day]').forEach(function(btn){
+          styleButton(btn, parseInt(btn.dataset.day) === idx);
+        });
+      }
+    }
+
+    function buildControls() {
+      var controls = document.getElementById(opts.controlsId);
+      if (!controls) return;
+      controls.innerHTML = '';
+      var label = document.createElement('span');
+      label.textContent = '选择天数：';
+      label.className = 'muted';
+      controls.appendChild(label);
+      (routes.days || []).forEach(function(_, i){
+        var btn = makeButton('第' + (i + 1) + '天');
+        btn.dataset.day = String(i);
+        btn.addEventListener('click', function(){ renderDay(i); });
+        controls.appendChild(btn);
+      });
+      if (!opts.routesUrl) return;
+      var sep = document.createElement('span');
+      sep.textContent = '｜'; sep.className = 'muted'; sep.style.margin = '0 6px';
+      controls.appendChild(sep);
+      var modeLabel = document.createElement('span');
+      modeLabel.textContent = '出行方式：'; modeLabel.className = 'muted';
+      controls.appendChild(modeLabel);
+      Object.keys(modeNames).forEach(function(m){
+        var btn = makeButton(modeNames[m]);
+        btn.dataset.mode = m;
+        if (routes.mode === m) { styleButton(btn, true); }
+        btn.addEventListener('click', function(){
+          fetch(opts.routesUrl + '?mode=' + encodeURIComponent(m), { credentials: 'same-origin' })
+            .then(function(r){ return r.ok ? r.json() : null; })
+            .then(function(data){
+              if (!data || !Array.isArray(data.days)) return;
+              routes = data;
+              controls.querySelectorAll('button[data-mode]').forEach(function(b){ styleButton(b, b.dataset.mode === m); });
+              renderDay(currentDay);
+            })
+            .catch(function(e){ console.warn('获取路线失败：', e); });
+        });
+        controls.appendChild(btn);
+      });
+    }
+
+    buildControls();
+    renderDay(0);
+  }
+
+  window.PlanMap = { hasStops: hasStops, coversAll: coversAll, render: render };
+})();
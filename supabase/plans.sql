@@ -11,9 +11,17 @@ create table if not exists public.plans (
   updated_at timestamptz not null default now()
 );
 
+-- 摘要列：写入时从行程中提取，列表与筛选无需读取 data_json
+alter table public.plans add column if not exists destination text;
+alter table public.plans add column if not exists city text;
+alter table public.plans add column if not exists days integer;
+alter table public.plans add column if not exists budget_cny numeric;
+
 -- 索引（提高查询与排序性能）
 create index if not exists plans_user_id_idx on public.plans (user_id);
 create index if not exists plans_updated_at_idx on public.plans (updated_at desc);
+-- 计划列表按 (updated_at, id) 键集分页
+create index if not exists plans_user_updated_idx on public.plans (user_id, updated_at desc, id desc);
 
 -- 启用行级权限（RLS）
 alter table public.plans enable row level security;
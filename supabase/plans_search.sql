@@ -0,0 +1,74 @@
+-- Supabase: 计划全文检索（在 plans.sql 之后执行）
+-- Postgres 的 simple 配置同样会把连续汉字当成一个词，这里与 SQLite 端一致，
+-- 写入与查询时都把汉字拆成单字，查询按短语（相邻单字）匹配。
+-- 单字之间插入 U+2063（不可见分隔符，chr(8291)），服务端删除它即可从高亮结果还原原文。
+
+create or replace function public.plans_segment(t text)
+returns text as $$
+  select regexp_replace(replace(coalesce(t, ''), chr(8291), ''), '([㐀-䶿一-鿿豈-﫿])',
+                        chr(8291) || '\1' || chr(8291), 'g');
+$$ language sql immutable;
+
+alter table public.plans add column if not exists search_tsv tsvector;
+
+-- 标题 > 目的地 > 景点 > 餐厅/酒店，分别对应权重 A/B/C/D
+create or replace function public.plans_search_tsv()
+returns trigger as $$
+declare
+  d jsonb;
+begin
+  begin
+    d := new.data_json::jsonb;
+  exception when others then
+    d := '{}'::jsonb;
+  end;
+  new.search_tsv :=
+    setweight(to_tsvector('simple', public.plans_segment(new.title)), 'A') ||
+    setweight(to_tsvector('simple', public.plans_segment(
+      concat_ws(' ', new.destination, new.city, d #>> '{行程概览,目的地}', d #>> '{行程概览,城市}'))), 'B') ||
+    setweight(to_tsvector('simple', public.plans_segment(
+      (select string_agg(v #>> '{}', ' ') from jsonb_path_query(d, '$."详细日程"[*]."安排"[*]."地点"') as j(v)))), 'C') ||
+    setweight(to_tsvector('simple', public.plans_segment(concat_ws(' ',
+      (select string_agg(v #>> '{}', ' ') from jsonb_path_query(d, '$."详细日程"[*]."安排"[*]."餐厅"') as j(v)),
+      d #>> '{住宿推荐,name}', d #>> '{住宿推荐,area}'))), 'D');
+  return new;
+end;
+$$ language plpgsql;
+
+drop trigger if exists plans_search_tsv on public.plans;
+create trigger plans_search_tsv
+before insert or update of title, data_json, destination, city on public.plans
+for each row execute function public.plans_search_tsv();
+
+-- 回填已有数据（触发器会重新计算 search_tsv）
+update public.plans set title = title where search_tsv is null;
+
+create index if not exists plans_search_tsv_idx on public.plans using gin (search_tsv);
+
+-- 检索函数：uid 为请求用户，显式按 user_id 过滤。后端共用一个 Supabase 客户端，
+-- auth.uid() 不一定是当前请求的用户，不能只靠 RLS 限定范围（RLS 仍然生效，作为额外保护）。
+-- terms 为应用端拆分好的关键词，每个词按短语匹配，多个词之间为 AND。
+drop function if exists public.search_plans(text[], int, text, text);
+create or replace function public.search_plans(uid uuid, terms text[], lim int default 20, hl_start text default '<b>', hl_end text default '</b>')
+returns table (
+  id bigint, title text, destination text, city text, days integer, budget_cny numeric,
+  updated_at timestamptz, score real, title_hl text, destination_hl text
+)
+language sql stable security invoker as $$
+  with query as (
+    select string_agg(format('(%s)', phraseto_tsquery('simple', public.plans_segment(t))::text), ' & ')::tsquery as tq
+    from unnest(terms) as t
+    where phraseto_tsquery('simple', public.plans_segment(t))::text <> ''
+  )
+  select p.id, p.title, p.destination, p.city, p.days, p.budget_cny, p.updated_at,
+         ts_rank(p.search_tsv, query.tq) as score,
+         ts_headline('simple', public.plans_segment(p.title), query.tq,
+                     format('StartSel=%s, StopSel=%s, HighlightAll=true', hl_start, hl_end)),
+         -- 目的地与城市之间用非汉字分隔，去掉分字空格后不会连成一个词
+         ts_headline('simple', public.plans_segment(concat_ws(' / ', p.destination, p.city)), query.tq,
+                     format('StartSel=%s, StopSel=%s, HighlightAll=true', hl_start, hl_end))
+  from public.plans p, query
+  where p.user_id = uid and p.search_tsv @@ query.tq
+  order by score desc, p.updated_at desc
+  limit lim;
+$$;
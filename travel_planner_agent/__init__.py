@@ -1,18 +1,78 @@
 VERSION = "0.1.0"
 
-from .parser import parse_input
-from .planner import generate_itinerary
+from .parser import parse_input, parse_input_async, parse_form, compose_form_text
+from .planner import generate_itinerary, generate_itinerary_async, postprocess_itinerary_async
 from .budget import make_budget_plan
-from .output import build_structured_output, export_json, export_csv
+from .output import build_structured_output, build_detail_day, export_json, export_csv, iter_json, iter_csv
 from .expenses import BudgetTracker
 from .tips import build_tips
+from .llm import _llm_client_ok
+from .streaming import stream_itinerary_llm
+from .tracing import span
 
 
-def plan_trip(natural_text: str):
-    parsed = parse_input(natural_text)
-    itinerary = generate_itinerary(parsed)
-    budget_plan = make_budget_plan(parsed, itinerary)
-    tips = build_tips(parsed)
-    tracker = BudgetTracker(budget_plan)
-    output = build_structured_output(parsed, itinerary, budget_plan, tips, tracker)
+def _finish_plan(parsed, itinerary):
+    with span("plan.budget"):
+        budget_plan = make_budget_plan(parsed, itinerary)
+    with span("plan.tips"):
+        tips = build_tips(parsed)
+    with span("plan.output"):
+        tracker = BudgetTracker(budget_plan)
+        output = build_structured_output(parsed, itinerary, budget_plan, tips, tracker)
     return output
+
+
+def plan_trip(natural_text: str):
+    with span("plan.parse"):
+        parsed = parse_input(natural_text)
+    with span("plan.itinerary"):
+        itinerary = generate_itinerary(parsed)
+    return _finish_plan(parsed, itinerary)
+
+
+async def plan_trip_async(natural_text: str):
+    # 仅 LLM 调用需要等待；预算、提示与输出构建为纯计算，耗时可忽略
+    with span("plan.parse"):
+        parsed = await parse_input_async(natural_text)
+    with span("plan.itinerary"):
+        itinerary = await generate_itinerary_async(parsed)
+    return _finish_plan(parsed, itinerary)
+
+
+def plan_trip_form(**fields):
+    """结构化模式：表单字段直接构建参数，跳过 LLM 解析，每个计划只调用一次 LLM。
+
+    fields 与 parse_form 的参数一致。
+    """
+    if not _llm_client_ok():
+        raise RuntimeError("无法调用LLM：未配置或不可用")
+    parsed = parse_form(**fields)
+    with span("plan.itinerary"):
+        itinerary = generate_itinerary(parsed)
+    return _finish_plan(parsed, itinerary)
+
+
+async def plan_trip_form_async(**fields):
+    if not _llm_client_ok():
+        raise RuntimeError("无法调用LLM：未配置或不可用")
+    parsed = parse_form(**fields)
+    with span("plan.itinerary"):
+        itinerary = await generate_itinerary_async(parsed)
+    return _finish_plan(parsed, itinerary)
+
+
+async def plan_trip_form_stream(**fields):
+    """结构化模式的流式版本：逐个产出 (event, data)。
+
+    event 依次为 hotel / transport / day（每天一条，已转换为“详细日程”结构），最后为 result（完整输出）。
+    """
+    if not _llm_client_ok():
+        raise RuntimeError("无法调用LLM：未配置或不可用")
+    parsed = parse_form(**fields)
+    async for kind, data in stream_itinerary_llm(parsed):
+        if kind == "itinerary":
+            yield "result", _finish_plan(parsed, await postprocess_itinerary_async(data))
+        elif kind == "day":
+            yield "day", build_detail_day(data)
+        else:
+            yield kind, data
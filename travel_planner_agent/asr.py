@@ -0,0 +1,475 @@
+import os
+import ssl
+import json
+import time
+import asyncio
+import threading
+import hmac
+import base64
+import hashlib
+import urllib.parse
+from email.utils import formatdate
+from typing import AsyncIterator, Awaitable, Callable, Dict, Optional, Tuple
+
+from . import config
+
+
+# 讯飞语音听写（流式版）要求 16k/16bit/单声道 PCM，每帧建议 1280 字节（40ms）
+SAMPLE_RATE = 16000
+FRAME_BYTES = 1280
+BYTES_PER_MS = SAMPLE_RATE * 2 // 1000
+
+STATUS_FIRST, STATUS_CONTINUE, STATUS_LAST = 0, 1, 2
+
+DEFAULT_HOST = "iat-api.xfyun.cn"
+DEFAULT_PATH = "/v2/iat"
+
+
+class ASRError(RuntimeError):
+    """语音识别失败（未配置、连接失败或服务端返回错误码）。"""
+
+
+def xfyun_credentials() -> Tuple[str, str, str]:
+    appid = getattr(config, "XFYUN_APPID", None) or os.getenv("XFYUN_APPID")
+    api_key = getattr(config, "XFYUN_API_KEY", None) or os.getenv("XFYUN_API_KEY")
+    api_secret = getattr(config, "XFYUN_API_SECRET", None) or os.getenv("XFYUN_API_SECRET")
+    if not (appid and api_key and api_secret):
+        raise ASRError("讯飞ASR未配置：请在config.py或环境变量填写 XFYUN_APPID / XFYUN_API_KEY / XFYUN_API_SECRET")
+    return appid, api_key, api_secret
+
+
+def signed_url(api_key: str, api_secret: str, host: str = DEFAULT_HOST, path: str = DEFAULT_PATH,
+               date: Optional[str] = None) -> str:
+    """按讯飞文档生成带 authorization/date/host 的 wss 地址（签名有效期 5 分钟）。
+
+    设置环境变量 XFYUN_ASR_URL（如 ws://127.0.0.1:8765/v2/iat）时直接使用该地址，用于本地模拟服务。
+    """
+    override = os.environ.get("XFYUN_ASR_URL")
+    if override:
+        return override
+    date = date or formatdate(timeval=None, localtime=False, usegmt=True)
+    signature_origin = f"host: {host}\ndate: {date}\nGET {path} HTTP/1.1"
+    signature_sha = hmac.new(api_secret.encode("utf-8"), signature_origin.encode("utf-8"), digestmod=hashlib.sha256).digest()
+    signature = base64.b64encode(signature_sha).decode("utf-8")
+    authorization_origin = f'api_key="{api_key}", algorithm="hmac-sha256", headers="host date request-line", signature="{signature}"'
+    authorization = base64.b64encode(authorization_origin.encode("utf-8")).decode("utf-8")
+    query = urllib.parse.urlencode({"authorization": authorization, "date": date, "host": host})
+    return f"wss://{host}{path}?{query}"
+
+
+def business_params(vad_eos_ms: int = 1000, dynamic_correction: bool = False) -> Dict:
+    params = {
+        "language": "zh_cn",
+        "domain": "iat",
+        "accent": "mandarin",
+        "vad_eos": vad_eos_ms,
+        "ptt": 1,
+    }
+    if dynamic_correction:
+        # 开启动态修正：中间结果可被后续结果替换（pgs=rpl）
+        params["dwa"] = "wpgs"
+    return params
+
+
+# 后续帧结构固定，直接拼接字符串，省去每帧一次的 json.dumps
+_FRAME_HEAD = '{"data":{"format":"audio/L16;rate=%d","encoding":"raw","status":' % SAMPLE_RATE
+
+
+def make_frame(appid: str, chunk, status: int, business: Optional[Dict] = None) -> str:
+    """组一帧请求；common/business 只需在首帧携带。chunk 可为 bytes 或 memoryview。"""
+    audio = base64.b64encode(chunk).decode("ascii")
+    if status != STATUS_FIRST:
+        return f'{_FRAME_HEAD}{status},"audio":"{audio}"}}}}'
+    frame: Dict = {
+        # 注意：顶层是 data，而不是 audio；字段名为 format/encoding/status/audio
+        "data": {
+            "format": f"audio/L16;rate={SAMPLE_RATE}",
+            "encoding": "raw",
+            "status": status,
+            "audio": audio,
+        },
+        "common": {"app_id": appid},
+        "business": business or business_params(),
+    }
+    return json.dumps(frame, ensure_ascii=False)
+
+
+class TranscriptAssembler:
+    """按 sn 拼接识别结果，支持动态修正（pgs=rpl 时用当前结果替换 rg 范围内的旧结果）。"""
+
+    def __init__(self):
+        self._pieces: Dict[int, str] = {}
+        self.final = False
+
+    def feed(self, data: Dict) -> str:
+        """处理一条服务端响应，返回目前为止的完整文本；错误码非 0 时抛出 ASRError。"""
+        if data.get("code") != 0:
+            desc = data.get("message") or data.get("desc") or "未知错误"
+            raise ASRError(f"讯飞ASR错误：code={data.get('code')}, desc={desc}")
+        body = data.get("data") or {}
+        result = body.get("result") or {}
+        if result:
+            words = "".join(
+                cw.get("w") or ""
+                for ws_item in result.get("ws") or []
+                for cw in (ws_item.get("cw") or [])[:1]
+            )
+            sn = int(result.get("sn") or len(self._pieces) + 1)
+            if result.get("pgs") == "rpl":
+                lo, hi = (result.get("rg") or [sn, sn])[:2]
+                for k in range(int(lo), int(hi) + 1):
+                    self._pieces.pop(k, None)
+            self._pieces[sn] = words
+        if body.get("status") == STATUS_LAST:
+            self.final = True
+        return self.text
+
+    @property
+    def text(self) -> str:
+        return "".join(self._pieces[k] for k in sorted(self._pieces)).strip()
+
+
+def _ssl_context(url: str) -> Optional[ssl.SSLContext]:
+    return ssl.create_default_context() if url.startswith("wss://") else None
+
+
+class StreamingRecognizer:
+    """一次流式识别会话：边录边发，边收中间结果。
+
+    用法：
+        async with StreamingRecognizer() as rec:
+            await rec.send_audio(pcm)   # 可多次调用，任意长度
+            await rec.finish()          # 发送结束帧
+            async for kind, text in rec.results():   # kind 为 partial / final
+                ...
+    send_audio 与 results 可在两个任务中并发进行。
+    """
+
+    def __init__(self, url: Optional[str] = None, appid: Optional[str] = None,
+                 business: Optional[Dict] = None, connect_timeout: float = 10.0,
+                 connector: Optional[Callable[[], Awaitable]] = None):
+        if url is None or appid is None:
+            appid_cfg, api_key, api_secret = xfyun_credentials()
+            appid = appid or appid_cfg
+            url = url or signed_url(api_key, api_secret)
+        self.url = url
+        self.appid = appid
+        self.business = business or business_params(dynamic_correction=True)
+        self.connect_timeout = connect_timeout
+        self._ws = None
+        self._buf = bytearray()
+        self._sent_first = False
+        self._finished = False
+        self.assembler = TranscriptAssembler()
+        self.bytes_sent = 0
+        # connector 由 ASRSessionManager 提供：复用预签名地址、SSL 上下文与预热连接
+        self._connector = connector
+        # 各阶段耗时（毫秒）：connect / first_result（自首帧）/ final_wait（自结束帧）
+        self.timings: Dict[str, float] = {}
+        self._t_first_frame: Optional[float] = None
+        self._t_finish: Optional[float] = None
+
+    async def __aenter__(self) -> "StreamingRecognizer":
+        await self.open()
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        await self.close()
+
+    async def open(self) -> None:
+        t0 = time.perf_counter()
+        if self._connector is not None:
+            self._ws = await self._connector()
+            self.timings["connect"] = (time.perf_counter() - t0) * 1000
+            return
+        try:
+            import websockets
+        except Exception:
+            raise ASRError("未找到 websockets 库：请安装依赖 pip install websockets 后再试")
+        try:
+            self._ws = await websockets.connect(
+                self.url, ssl=_ssl_context(self.url), open_timeout=self.connect_timeout, max_size=None
+            )
+        except Exception as e:
+            raise ASRError(f"连接讯飞ASR失败：{e}")
+        self.timings["connect"] = (time.perf_counter() - t0) * 1000
+
+    async def close(self) -> None:
+        if self._ws is not None:
+            try:
+                await self._ws.close()
+            except Exception:
+                pass
+            self._ws = None
+
+    async def _send_frame(self, chunk, last: bool) -> None:
+        if not self._sent_first:
+            # 首帧携带 common/business；整段音频不足一帧时首帧之后紧跟空的结束帧
+            self._sent_first = True
+            self._t_first_frame = time.perf_counter()
+            await self._ws.send(make_frame(self.appid, chunk, STATUS_FIRST, self.business))
+            self.bytes_sent += len(chunk)
+            if not last:
+                return
+            chunk = b""
+        await self._ws.send(make_frame(self.appid, chunk, STATUS_LAST if last else STATUS_CONTINUE))
+        self.bytes_sent += len(chunk)
+
+    async def send_audio(self, pcm) -> None:
+        """追加 16k 单声道 16bit PCM；凑满整帧即发送，余数留到下次。"""
+        if self._finished:
+            raise ASRError("识别会话已结束")
+        self._buf.extend(pcm)
+        view = memoryview(self._buf)
+        n = len(self._buf) // FRAME_BYTES * FRAME_BYTES
+        try:
+            for off in range(0, n, FRAME_BYTES):
+                await self._send_frame(view[off:off + FRAME_BYTES], False)
+        finally:
+            view.release()
+        del self._buf[:n]
+
+    async def finish(self) -> None:
+        """发送剩余音频与结束帧（status=2）。"""
+        if self._finished:
+            return
+        self._finished = True
+        self._t_finish = time.perf_counter()
+        await self._send_frame(bytes(self._buf), True)
+        self._buf.clear()
+
+    async def results(self) -> AsyncIterator[Tuple[str, str]]:
+        """产出 ("partial", 当前文本)，收到 status=2 时产出 ("final", 文本) 并结束，不等待连接超时。"""
+        import websockets
+        try:
+            async for msg in self._ws:
+                text = self.assembler.feed(json.loads(msg))
+                now = time.perf_counter()
+                if "first_result" not in self.timings and self._t_first_frame is not None:
+                    self.timings["first_result"] = (now - self._t_first_frame) * 1000
+                if self.assembler.final:
+                    if self._t_finish is not None:
+                        self.timings["final_wait"] = (now - self._t_finish) * 1000
+                    yield "final", text
+                    return
+                yield "partial", text
+        except websockets.exceptions.ConnectionClosed:
+            pass
+        # 服务端未发送最终结果就关闭连接：以已收到的文本作为结果
+        yield "final", self.assembler.text
+
+
+class FramePacer:
+    """按音频时长限速发送：速度为实时的 speedup 倍，开头允许突发 burst_ms 的音频。
+
+    只有发送进度超前时才 sleep，一次 sleep 覆盖多帧，而不是每帧固定等待；speedup<=0 表示不限速。
+    """
+
+    def __init__(self, speedup: float = 8.0, burst_ms: float = 1000.0):
+        self.speedup = speedup
+        self.burst_ms = burst_ms
+        self._t0 = 0.0
+        self._sent_ms = 0.0
+        self.slept_ms = 0.0
+
+    def start(self) -> None:
+        self._t0 = time.monotonic()
+        self._sent_ms = 0.0
+        self.slept_ms = 0.0
+
+    async def wait(self, audio_ms: float) -> None:
+        self._sent_ms += audio_ms
+        if self.speedup <= 0:
+            return
+        due = self._t0 + max(0.0, self._sent_ms - self.burst_ms) / 1000 / self.speedup
+        delay = due - time.monotonic()
+        if delay > 0.002:
+            self.slept_ms += delay * 1000
+            await asyncio.sleep(delay)
+
+
+class ASRSessionManager:
+    """讯飞听写会话管理：
+
+    - 签名地址缓存 url_ttl 秒（签名有效期 5 分钟），不再每次请求重新签名；
+    - 所有连接共用一个 SSLContext（证书只加载一次）；
+    - prewarm 时在后台保持一条已完成 TLS + WebSocket 握手的空闲连接，下一次识别直接使用，
+      超过 warm_max_age 秒未使用则丢弃重建（讯飞对无数据的连接约 10 秒后断开）；
+    - 讯飞每次听写结束后会关闭连接，因此“复用”体现为握手提前完成，而不是同一连接多次听写。
+    """
+
+    def __init__(self, appid: str, api_key: str, api_secret: str,
+                 url_ttl: float = 240.0, prewarm: bool = True, warm_max_age: float = 8.0,
+                 speedup: float = 8.0, burst_ms: float = 1000.0, connect_timeout: float = 10.0):
+        self.appid = appid
+        self.api_key = api_key
+        self.api_secret = api_secret
+        self.url_ttl = url_ttl
+        self.prewarm = prewarm
+        self.warm_max_age = warm_max_age
+        self.speedup = speedup
+        self.burst_ms = burst_ms
+        self.connect_timeout = connect_timeout
+        self.ssl_ctx = ssl.create_default_context()
+        self._url: Optional[str] = None
+        self._url_at = 0.0
+        self._warm: Optional[Tuple[object, float]] = None
+        self._warm_task: Optional[asyncio.Task] = None
+        self._lock = threading.Lock()
+        self.sessions = 0
+        self.warm_hits = 0
+        self.signatures = 0
+        self._timing_totals: Dict[str, float] = {}
+        self._timing_counts: Dict[str, int] = {}
+
+    def url(self) -> str:
+        now = time.monotonic()
+        with self._lock:
+            if self._url is None or now - self._url_at > self.url_ttl:
+                self._url = signed_url(self.api_key, self.api_secret)
+                self._url_at = now
+                self.signatures += 1
+            return self._url
+
+    async def _open(self):
+        try:
+            import websockets
+        except Exception:
+            raise ASRError("未找到 websockets 库：请安装依赖 pip install websockets 后再试")
+        url = self.url()
+        try:
+            return await websockets.connect(
+                url, ssl=self.ssl_ctx if url.startswith("wss://") else None,
+                open_timeout=self.connect_timeout, max_size=None,
+            )
+        except Exception as e:
+            raise ASRError(f"连接讯飞ASR失败：{e}")
+
+    async def _fill_warm(self) -> None:
+        try:
+            ws = await self._open()
+        except ASRError:
+            return
+        old, self._warm = self._warm, (ws, time.monotonic())
+        if old is not None:
+            await _close_quietly(old[0])
+
+    def _schedule_prewarm(self) -> None:
+        if self.prewarm and (self._warm_task is None or self._warm_task.done()):
+            self._warm_task = asyncio.ensure_future(self._fill_warm())
+
+    async def acquire(self):
+        """取一条可用连接：优先使用未过期的预热连接，否则现场建立；随后在后台预热下一条。"""
+        warm, self._warm = self._warm, None
+        ws = None
+        if warm is not None:
+            conn, opened_at = warm
+            if time.monotonic() - opened_at < self.warm_max_age and _is_open(conn):
+                ws = conn
+                with self._lock:
+                    self.warm_hits += 1
+            else:
+                await _close_quietly(conn)
+        if ws is None:
+            ws = await self._open()
+        with self._lock:
+            self.sessions += 1
+        self._schedule_prewarm()
+        return ws
+
+    def session(self, business: Optional[Dict] = None) -> StreamingRecognizer:
+        return StreamingRecognizer(url=self.url(), appid=self.appid, business=business, connector=self.acquire)
+
+    def _record(self, timings: Dict[str, float]) -> None:
+        with self._lock:
+            for k, v in timings.items():
+                self._timing_totals[k] = self._timing_totals.get(k, 0.0) + v
+                self._timing_counts[k] = self._timing_counts.get(k, 0) + 1
+
+    async def transcribe(self, pcm, business: Optional[Dict] = None) -> Tuple[str, Dict[str, float]]:
+        """识别一段完整的 16k PCM，返回 (文本, 各阶段耗时毫秒)。
+
+        发送与接收并发进行；音频按 FramePacer 限速批量发送，收到 status=2 的最终结果立即返回。
+        """
+        t0 = time.perf_counter()
+        view = memoryview(pcm)
+        pacer = FramePacer(self.speedup, self.burst_ms)
+        timings: Dict[str, float] = {}
+        text = ""
+        async with self.session(business or business_params()) as rec:
+            async def send():
+                t_send = time.perf_counter()
+                pacer.start()
+                for off in range(0, len(view), FRAME_BYTES):
+                    chunk = view[off:off + FRAME_BYTES]
+                    await rec.send_audio(chunk)
+                    await pacer.wait(len(chunk) / BYTES_PER_MS)
+                await rec.finish()
+                timings["upload"] = (time.perf_counter() - t_send) * 1000
+
+            sender = asyncio.ensure_future(send())
+            try:
+                async for kind, text in rec.results():
+                    if kind == "final":
+                        break
+                await sender
+            finally:
+                if not sender.done():
+                    sender.cancel()
+            timings.update(rec.timings)
+        timings["pacing_sleep"] = pacer.slept_ms
+        timings["total"] = (time.perf_counter() - t0) * 1000
+        timings = {k: round(v, 1) for k, v in timings.items()}
+        self._record(timings)
+        return text, timings
+
+    async def close(self) -> None:
+        if self._warm_task is not None:
+            self._warm_task.cancel()
+        warm, self._warm = self._warm, None
+        if warm is not None:
+            await _close_quietly(warm[0])
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "sessions": self.sessions,
+                "warm_hits": self.warm_hits,
+                "signatures": self.signatures,
+                "avg_ms": {k: round(self._timing_totals[k] / self._timing_counts[k], 1) for k in self._timing_totals},
+            }
+
+
+def _is_open(ws) -> bool:
+    # websockets 新旧版本的连接状态属性不同
+    state = getattr(ws, "state", None)
+    if state is not None:
+        return getattr(state, "name", str(state)) == "OPEN"
+    return not getattr(ws, "closed", False)
+
+
+async def _close_quietly(ws) -> None:
+    try:
+        await ws.close()
+    except Exception:
+        pass
+
+
+_manager: Optional[ASRSessionManager] = None
+_manager_lock = threading.Lock()
+
+
+def get_asr_manager() -> ASRSessionManager:
+    """进程内单例；凭证缺失时抛出 ASRError。"""
+    global _manager
+    if _manager is None:
+        with _manager_lock:
+            if _manager is None:
+                appid, api_key, api_secret = xfyun_credentials()
+                _manager = ASRSessionManager(
+                    appid, api_key, api_secret,
+                    prewarm=os.environ.get("ASR_PREWARM", "1") == "1",
+                    speedup=float(os.environ.get("ASR_PACE_SPEEDUP", "8")),
+                    burst_ms=float(os.environ.get("ASR_PACE_BURST_MS", "1000")),
+                )
+    return _manager
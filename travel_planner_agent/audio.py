@@ -0,0 +1,208 @@
+import sys
+import math
+import array
+import struct
+from typing import Dict, NamedTuple, Tuple
+
+try:
+    import numpy as np
+except Exception:
+    np = None
+
+
+# 讯飞听写要求的输入格式：16k / 16bit / 单声道
+TARGET_RATE = 16000
+
+_FORMAT_PCM = 1
+_FORMAT_FLOAT = 3
+_FORMAT_EXTENSIBLE = 0xFFFE
+
+
+class AudioError(RuntimeError):
+    """音频无法解析或格式不受支持；在连接识别服务之前抛出。"""
+
+
+class WavInfo(NamedTuple):
+    channels: int
+    sample_rate: int
+    bits: int
+    is_float: bool
+    data: memoryview  # data 块的零拷贝视图，长度已截为整帧
+
+
+def parse_wav(buf) -> WavInfo:
+    """逐块解析 RIFF/WAVE：跳过 LIST/fact 等附加块，不假设头长为 44 字节。"""
+    view = memoryview(buf)
+    if len(view) < 12 or view[:4] != b"RIFF" or view[8:12] != b"WAVE":
+        raise AudioError("上传的音频不是 WAV 文件（缺少 RIFF/WAVE 头）")
+    fmt = None
+    pos = 12
+    while pos + 8 <= len(view):
+        chunk_id = bytes(view[pos:pos + 4])
+        size = struct.unpack_from("<I", view, pos + 4)[0]
+        body = pos + 8
+        if chunk_id == b"fmt ":
+            if size < 16 or body + size > len(view):
+                raise AudioError("WAV 的 fmt 块不完整")
+            tag, channels, rate, _, block_align, bits = struct.unpack_from("<HHIIHH", view, body)
+            if tag == _FORMAT_EXTENSIBLE and size >= 40:
+                # WAVE_FORMAT_EXTENSIBLE：真实格式在子格式 GUID 的前两个字节
+                tag = struct.unpack_from("<H", view, body + 24)[0]
+            fmt = (tag, channels, rate, block_align, bits)
+        elif chunk_id == b"data":
+            if fmt is None:
+                raise AudioError("WAV 的 data 块出现在 fmt 块之前")
+            tag, channels, rate, block_align, bits = fmt
+            if tag not in (_FORMAT_PCM, _FORMAT_FLOAT):
+                raise AudioError(f"不支持的 WAV 编码格式：{tag}（仅支持 PCM 与 32 位浮点）")
+            if tag == _FORMAT_FLOAT and bits != 32 or tag == _FORMAT_PCM and bits not in (8, 16, 24, 32):
+                raise AudioError(f"不支持的采样位数：{bits}")
+            if not channels or not rate or block_align != channels * bits // 8:
+                raise AudioError("WAV 的 fmt 块参数无效")
+            # 边录边写的文件 data 大小可能为 0 或 0xFFFFFFFF：以实际长度为准，并去掉不完整的末帧
+            end = len(view) if size in (0, 0xFFFFFFFF) else min(body + size, len(view))
+            end -= (end - body) % block_align
+            return WavInfo(channels, rate, bits, tag == _FORMAT_FLOAT, view[body:end])
+        pos = body + size + (size & 1)
+    raise AudioError("WAV 中没有 fmt 块" if fmt is None else "WAV 中没有 data 块")
+
+
+def _decode_np(info: WavInfo):
+    """解码为 float32 单声道（-1~1）；16 位输入直接 frombuffer，不复制原始字节。"""
+    data = info.data
+    if info.is_float:
+        x = np.frombuffer(data, dtype="<f4")
+    elif info.bits == 8:
+        x = (np.frombuffer(data, dtype=np.uint8).astype(np.float32) - 128.0) / 128.0
+    elif info.bits == 16:
+        x = np.frombuffer(data, dtype="<i2").astype(np.float32) / 32768.0
+    elif info.bits == 24:
+        raw = np.frombuffer(data, dtype=np.uint8).reshape(-1, 3).astype(np.int32)
+        x = ((raw[:, 0] | (raw[:, 1] << 8) | (raw[:, 2] << 16)) << 8 >> 8).astype(np.float32) / 8388608.0
+    else:
+        x = np.frombuffer(data, dtype="<i4").astype(np.float32) / 2147483648.0
+    if info.channels > 1:
+        x = x.reshape(-1, info.channels).mean(axis=1)
+    return x
+
+
+def _resample_np(x, rate: int):
+    if rate == TARGET_RATE or not len(x):
+        return x
+    ratio = rate / TARGET_RATE
+    if ratio > 1:
+        # 降采样前做滑动平均低通，减轻线性插值的混叠
+        k = int(round(ratio))
+        if k > 1:
+            x = np.convolve(x, np.full(k, 1.0 / k, dtype=np.float32), mode="same")
+    n = int(len(x) / ratio)
+    return np.interp(np.arange(n) * ratio, np.arange(len(x)), x).astype(np.float32)
+
+
+def _to_pcm16_np(info: WavInfo) -> bytes:
+    x = _resample_np(_decode_np(info), info.sample_rate)
+    return (np.clip(x, -1.0, 1.0) * 32767.0).astype("<i2").tobytes()
+
+
+def _samples_py(info: WavInfo) -> array.array:
+    """无 NumPy 时的回退：解码为单声道 int16 数组。"""
+    data = info.data
+    if info.bits == 16 and not info.is_float:
+        s = array.array("h")
+        s.frombytes(data)
+        if sys.byteorder == "big":
+            s.byteswap()
+    else:
+        width = info.bits // 8
+        if info.is_float:
+            vals = [int(max(-1.0, min(1.0, v)) * 32767) for v in struct.unpack(f"<{len(data) // 4}f", data)]
+        elif width == 1:
+            vals = [(b - 128) << 8 for b in data]
+        else:
+            vals = [int.from_bytes(data[i:i + width], "little", signed=True) >> (8 * width - 16)
+                    for i in range(0, len(data), width)]
+        s = array.array("h", vals)
+    if info.channels > 1:
+        c = info.channels
+        s = array.array("h", (sum(s[i:i + c]) // c for i in range(0, len(s), c)))
+    return s
+
+
+def _resample_py(s: array.array, rate: int) -> array.array:
+    if rate == TARGET_RATE or not len(s):
+        return s
+    ratio = rate / TARGET_RATE
+    last = len(s) - 1
+    out = array.array("h", bytes(2 * int(len(s) / ratio)))
+    for i in range(len(out)):
+        t = i * ratio
+        j = int(t)
+        k = min(j + 1, last)
+        out[i] = int(s[j] + (s[k] - s[j]) * (t - j))
+    return out
+
+
+def _is_target(info: WavInfo) -> bool:
+    return info.channels == 1 and info.sample_rate == TARGET_RATE and info.bits == 16 and not info.is_float
+
+
+def to_pcm16_mono(info: WavInfo) -> memoryview:
+    """转为 16k 单声道 16bit 小端 PCM。已是目标格式时直接返回 data 视图（零拷贝）。"""
+    if _is_target(info):
+        return info.data
+    if np is not None:
+        return memoryview(_to_pcm16_np(info))
+    s = _resample_py(_samples_py(info), info.sample_rate)
+    if sys.byteorder == "big":
+        s.byteswap()
+    return memoryview(s.tobytes())
+
+
+def _frame_energies(pcm: memoryview, frame: int):
+    n = len(pcm) // 2 // frame
+    if np is not None:
+        x = np.frombuffer(pcm[:n * frame * 2], dtype="<i2").astype(np.float32).reshape(n, frame)
+        return np.sqrt((x * x).mean(axis=1)).tolist()
+    s = pcm[:n * frame * 2].cast("h")
+    return [math.sqrt(sum(v * v for v in s[i * frame:(i + 1) * frame]) / frame) for i in range(n)]
+
+
+def trim_silence(pcm: memoryview, frame_ms: int = 20, pad_ms: int = 300,
+                 min_rms: float = 300.0, noise_ratio: float = 3.0) -> memoryview:
+    """基于能量的 VAD：去掉首尾静音，两端各保留 pad_ms；返回原缓冲区的切片视图。
+
+    阈值取 max(min_rms, 噪声底 × noise_ratio)，噪声底为各帧能量的第 10 百分位。
+    只有最响的一帧也低于 min_rms 时才视为整段静音、返回空视图；有声音但没有帧超过
+    自适应阈值（如持续背景噪声下的说话）时无法区分语音与噪声，原样返回不做裁剪。
+    """
+    frame = TARGET_RATE * frame_ms // 1000
+    energies = _frame_energies(pcm, frame)
+    if not energies:
+        return pcm
+    if max(energies) < min_rms:
+        return pcm[:0]
+    floor = sorted(energies)[len(energies) // 10]
+    threshold = max(min_rms, floor * noise_ratio)
+    voiced = [i for i, e in enumerate(energies) if e >= threshold]
+    if not voiced:
+        return pcm
+    pad = pad_ms // frame_ms
+    start = max(0, voiced[0] - pad) * frame * 2
+    # 语音延续到最后一个整帧时，连同不足一帧的尾部一起保留
+    last = voiced[-1] + 1 + pad
+    end = last * frame * 2 if last < len(energies) else len(pcm) - len(pcm) % 2
+    return pcm[start:end]
+
+
+def prepare_pcm(wav_bytes, vad: bool = True, pad_ms: int = 300) -> Tuple[memoryview, Dict]:
+    """解析 WAV、转为 16k 单声道 PCM 并裁掉首尾静音；返回 (PCM 视图, 统计信息)。"""
+    info = parse_wav(wav_bytes)
+    pcm = to_pcm16_mono(info)
+    input_ms = len(info.data) // (info.channels * info.bits // 8) * 1000 // info.sample_rate
+    if vad:
+        pcm = trim_silence(pcm, pad_ms=pad_ms)
+    return pcm, {
+        "input_ms": input_ms,
+        "sent_ms": len(pcm) // 2 * 1000 // TARGET_RATE,
+        "converted": not _is_target(info),
+    }
@@ -1,5 +1,7 @@
 from typing import Dict, List
 
+from .knowledge import get_knowledge_base
+
 
 DEFAULT_ALLOCATION = {
     "交通": 0.30,
@@ -45,11 +47,19 @@ def make_budget_plan(parsed: Dict, itinerary: Dict) -> Dict:
     # 简易估算各日餐饮与门票：
     # 餐饮：成人 150/天，儿童 100/天；门票：依据景点静态票价汇总
     daily_meal = int(days * (people["adults"] * 150 + people["children"] * 100))
+    # LLM 行程缺少票价时，按景点名到城市知识库中查找
+    info = get_knowledge_base().city(itinerary.get("city"))
     ticket_sum = 0
     for d in itinerary.get("plan", []):
         for node in [d.get("morning"), d.get("afternoon")]:
-            if node and node.get("ticket_cny", 0) > 0:
-                ticket_sum += node.get("ticket_cny", 0)
+            if not node:
+                continue
+            ticket = node.get("ticket_cny")
+            if ticket is None and info is not None:
+                known = info.attraction(node.get("name"))
+                ticket = known.get("ticket_cny") if known else None
+            if isinstance(ticket, (int, float)) and ticket > 0:
+                ticket_sum += ticket
 
     estimate = {
         "餐饮总计": daily_meal,
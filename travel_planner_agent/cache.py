@@ -0,0 +1,201 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+
+def make_cache_key(model: str, temperature: float, messages: List[Dict[str, str]]) -> str:
+    """对 (model, temperature, messages) 做规范化后取 sha256，作为缓存键。"""
+    norm_messages = [
+        {"role": str(m.get("role", "")), "content": " ".join(str(m.get("content", "")).split())}
+        for m in messages
+    ]
+    payload = json.dumps(
+        {"model": model, "temperature": round(float(temperature), 3), "messages": norm_messages},
+        ensure_ascii=False,
+        sort_keys=True,
+        separators=(",", ":"),
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class _BaseCache(ABC):
+    """缓存后端的公共部分：TTL、容量上限与命中统计；子类设置 backend 名称并实现读写。"""
+
+    backend = "base"
+
+    def __init__(self, ttl_seconds: float, max_entries: int):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[str]:
+        """返回未过期的值，不存在或已过期时返回 None。"""
+
+    @abstractmethod
+    def set(self, key: str, value: str) -> None:
+        """写入并刷新过期时间，超过 max_entries 时淘汰最久未用的条目。"""
+
+    @abstractmethod
+    def delete(self, key: str) -> None:
+        """删除一个键，不存在时忽略。"""
+
+    @abstractmethod
+    def clear(self) -> None:
+        """清空全部条目。"""
+
+    @abstractmethod
+    def __len__(self) -> int:
+        """当前条目数。"""
+
+    def stats(self) -> Dict:
+        total = self.hits + self.misses
+        return {
+            "backend": self.backend,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "size": len(self),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl_seconds,
+        }
+
+
+class MemoryCache(_BaseCache):
+    """进程内缓存：OrderedDict 实现 LRU，读取时检查 TTL。"""
+
+    backend = "memory"
+
+    def __init__(self, ttl_seconds: float = 3600, max_entries: int = 512):
+        super().__init__(ttl_seconds, max_entries)
+        self._data: "OrderedDict[str, tuple]" = OrderedDict()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            expires_at, value = item
+            if expires_at < time.time():
+                del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: str, value: str) -> None:
+        with self._lock:
+            self._data[key] = (time.time() + self.ttl_seconds, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class SQLiteCache(_BaseCache):
+    """磁盘缓存：独立的 SQLite 文件，服务重启后仍可命中。
+
+    按 accessed_at 做 LRU 淘汰，按 expires_at 做 TTL 过期。
+    """
+
+    backend = "sqlite"
+
+    def __init__(self, path: str, ttl_seconds: float = 86400, max_entries: int = 5000):
+        super().__init__(ttl_seconds, max_entries)
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS llm_cache (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                expires_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            );
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS llm_cache_accessed_idx ON llm_cache(accessed_at)")
+        self._conn.commit()
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT value, expires_at FROM llm_cache WHERE key=?", (key,)).fetchone()
+            if not row:
+                self.misses += 1
+                return None
+            value, expires_at = row
+            if expires_at < now:
+                self._conn.execute("DELETE FROM llm_cache WHERE key=?", (key,))
+                self._conn.commit()
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE llm_cache SET accessed_at=? WHERE key=?", (now, key))
+            self._conn.commit()
+            self.hits += 1
+            return value
+
+    def set(self, key: str, value: str) -> None:
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO llm_cache(key, value, expires_at, accessed_at) VALUES(?,?,?,?)",
+                (key, value, now + self.ttl_seconds, now),
+            )
+            self._conn.execute("DELETE FROM llm_cache WHERE expires_at < ?", (now,))
+            self._conn.execute(
+                "DELETE FROM llm_cache WHERE key IN ("
+                "SELECT key FROM llm_cache ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+            self._conn.commit()
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM llm_cache WHERE key=?", (key,))
+            self._conn.commit()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM llm_cache")
+            self._conn.commit()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+
+
+def build_cache(backend: str, ttl_seconds: float, max_entries: int, path: Optional[str] = None) -> Optional[_BaseCache]:
+    """按名称构建缓存后端：memory / sqlite；off 或空字符串表示关闭。"""
+    backend = (backend or "").strip().lower()
+    if backend in ("", "0", "off", "none"):
+        return None
+    if backend == "sqlite":
+        if not path:
+            base_dir = os.path.dirname(os.path.dirname(__file__))
+            path = os.path.join(base_dir, "llm_cache.db")
+        return SQLiteCache(path, ttl_seconds=ttl_seconds, max_entries=max_entries)
+    if backend == "memory":
+        return MemoryCache(ttl_seconds=ttl_seconds, max_entries=max_entries)
+    raise ValueError(f"未知的LLM缓存后端：{backend}")
@@ -19,3 +19,5 @@ SUPABASE_ANON_KEY = "eyJhbGciOiJIUzI1NiIsInR5cCI6IkpXVCJ9.eyJpc3MiOiJzdXBhYmFzZS
 
 AMAP_WEB_KEY = "2da26b9ae9cdf90dc4d1e2c9be70aa04"
 AMAP_SECURITY_JS_CODE = "5e0f98c310427e21e4036886bc32c76b"
+# 高德 Web 服务 Key（服务端路线规划，与上面的前端 JS Key 不同；留空则用直线估算）
+AMAP_REST_KEY = ""
@@ -1,10 +1,21 @@
 import os
+import json
+import base64
+import queue
 import sqlite3
-import hashlib
 import datetime
+import threading
+import contextvars
+from contextlib import contextmanager
 from typing import Optional, List, Dict
 
 from .supabase_client import get_supabase_client
+from . import plan_store
+from .cache import MemoryCache
+from . import passwords
+from .passwords import get_hasher
+from . import search as plan_search
+from .tracing import traced
 
 
 def _db_path() -> str:
@@ -12,18 +23,417 @@ def _db_path() -> str:
     return os.path.join(base_dir, "app.db")
 
 
+class PoolExhausted(RuntimeError):
+    """连接池中的连接全部借出，且在 busy_timeout 内没有归还。"""
+
+
+class _ConnectionPool:
+    """线程安全的 SQLite 连接池。
+
+    连接复用后，sqlite3 的语句缓存（cached_statements）在请求间持续有效；
+    WAL + synchronous=NORMAL 让读写并发互不阻塞，busy_timeout 避免写冲突时直接报 database is locked。
+    """
+
+    def __init__(self, path: str, size: int = 8, busy_timeout_ms: int = 5000, cached_statements: int = 256):
+        self.path = path
+        self.size = size
+        self.busy_timeout_ms = busy_timeout_ms
+        self.cached_statements = cached_statements
+        self._idle: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def _new_conn(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(
+            self.path,
+            timeout=self.busy_timeout_ms / 1000,
+            check_same_thread=False,
+            cached_statements=self.cached_statements,
+        )
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA busy_timeout={int(self.busy_timeout_ms)}")
+        return conn
+
+    def acquire(self) -> sqlite3.Connection:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._created < self.size:
+                self._created += 1
+                try:
+                    return self._new_conn()
+                except Exception:
+                    self._created -= 1
+                    raise
+        try:
+            return self._idle.get(timeout=self.busy_timeout_ms / 1000)
+        except queue.Empty:
+            raise PoolExhausted(
+                f"数据库连接池已满：{self.size} 个连接均在使用中，等待 {self.busy_timeout_ms} 毫秒后仍无空闲连接"
+                "（可调大 SQLITE_POOL_SIZE）"
+            ) from None
+
+    def release(self, conn: sqlite3.Connection) -> None:
+        self._idle.put(conn)
+
+    def discard(self, conn: sqlite3.Connection) -> None:
+        with self._lock:
+            self._created -= 1
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def close(self) -> None:
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self.discard(conn)
+
+
+_pools: Dict[str, _ConnectionPool] = {}
+_pools_lock = threading.Lock()
+
+
+def _get_pool() -> _ConnectionPool:
+    path = _db_path()
+    pool = _pools.get(path)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(path)
+            if pool is None:
+                pool = _ConnectionPool(
+                    path,
+                    size=int(os.environ.get("SQLITE_POOL_SIZE", "8")),
+                    busy_timeout_ms=int(os.environ.get("SQLITE_BUSY_TIMEOUT_MS", "5000")),
+                )
+                _pools[path] = pool
+    return pool
+
+
+# 这些错误说明连接或数据库文件本身有问题，连接不再复用
+_BROKEN_ERRORS = (sqlite3.InterfaceError, sqlite3.InternalError)
+_BROKEN_MESSAGES = ("malformed", "not a database", "disk i/o error", "unable to open")
+
+
+def _is_broken(e: BaseException) -> bool:
+    if isinstance(e, _BROKEN_ERRORS) or type(e) is sqlite3.DatabaseError:
+        return True
+    return isinstance(e, sqlite3.DatabaseError) and any(m in str(e).lower() for m in _BROKEN_MESSAGES)
+
+
+def _reset(conn: sqlite3.Connection) -> bool:
+    """回滚未提交的事务并确认连接可用；失败时返回 False。"""
+    try:
+        if conn.in_transaction:
+            conn.rollback()
+        conn.execute("SELECT 1")
+        return True
+    except Exception:
+        return False
+
+
+@contextmanager
+def _connect():
+    """从连接池借出连接；异常时回滚未提交的事务后归还。
+
+    约束冲突、database is locked 等只影响本次操作，连接照常复用；连接损坏或回滚失败时才丢弃。
+    """
+    pool = _get_pool()
+    conn = pool.acquire()
+    try:
+        yield conn
+    except BaseException as e:
+        if _is_broken(e) or not _reset(conn):
+            pool.discard(conn)
+        else:
+            pool.release(conn)
+        raise
+    else:
+        if conn.in_transaction:
+            conn.rollback()
+        pool.release(conn)
+
+
 def _use_supabase() -> bool:
     return bool(os.environ.get("SUPABASE_URL") and os.environ.get("SUPABASE_ANON_KEY"))
 
 
+def _init_jobs_table(conn: sqlite3.Connection) -> None:
+    # 后台规划任务属于服务端运行状态，始终保存在本地 SQLite（Supabase 模式下亦然）
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS plan_jobs (
+            id TEXT PRIMARY KEY,
+            user_id TEXT NOT NULL,
+            status TEXT NOT NULL,
+            params_json TEXT NOT NULL,
+            result_json TEXT,
+            error TEXT,
+            created_at TEXT NOT NULL,
+            updated_at TEXT NOT NULL
+        );
+        """
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS plan_jobs_status_idx ON plan_jobs(status)")
+
+
+def _init_route_cache_table(conn: sqlite3.Connection) -> None:
+    # 路线缓存与后台任务一样属于服务端状态，始终保存在本地 SQLite；
+    # 端点坐标按 "lng,lat"（保留 5 位小数）作为键，provider 不同的结果分开保存
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS route_legs (
+            provider TEXT NOT NULL,
+            mode TEXT NOT NULL,
+            origin TEXT NOT NULL,
+            destination TEXT NOT NULL,
+            distance_m REAL NOT NULL,
+            duration_s REAL NOT NULL,
+            polyline TEXT NOT NULL,
+            created_at TEXT NOT NULL,
+            PRIMARY KEY (provider, mode, origin, destination)
+        ) WITHOUT ROWID;
+        """
+    )
+
+
+def _init_geocode_cache_table(conn: sqlite3.Connection) -> None:
+    # 地名坐标缓存，跨用户共享；lng/lat 为 NULL 表示查询过但未找到，过期后重新查询
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS geocodes (
+            city TEXT NOT NULL,
+            name TEXT NOT NULL,
+            lng REAL,
+            lat REAL,
+            provider TEXT NOT NULL,
+            created_at TEXT NOT NULL,
+            PRIMARY KEY (city, name)
+        ) WITHOUT ROWID;
+        """
+    )
+
+
+def _init_usage_table(conn: sqlite3.Connection) -> None:
+    # LLM 用量按 (日期, 用户, 阶段, 模型) 聚合累加，始终保存在本地 SQLite；user_id 为空串表示未登录调用
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS llm_usage (
+            day TEXT NOT NULL,
+            user_id TEXT NOT NULL,
+            stage TEXT NOT NULL,
+            model TEXT NOT NULL,
+            calls INTEGER NOT NULL,
+            prompt_tokens INTEGER NOT NULL,
+            completion_tokens INTEGER NOT NULL,
+            PRIMARY KEY (day, user_id, stage, model)
+        ) WITHOUT ROWID;
+        """
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS llm_usage_user_idx ON llm_usage(user_id, day)")
+
+
+_PLAN_SUMMARY_COLUMNS = (
+    ("data_hash", "TEXT"),
+    ("destination", "TEXT"),
+    ("city", "TEXT"),
+    ("days", "INTEGER"),
+    ("budget_cny", "REAL"),
+)
+
+
+def _add_plan_blob_storage(conn: sqlite3.Connection) -> None:
+    """plans 增加内容哈希与摘要列；行程 JSON 压缩后按哈希去重存入 plan_blobs。"""
+    existing = {r[1] for r in conn.execute("PRAGMA table_info(plans)").fetchall()}
+    for name, typ in _PLAN_SUMMARY_COLUMNS:
+        if name not in existing:
+            conn.execute(f"ALTER TABLE plans ADD COLUMN {name} {typ}")
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS plan_blobs (
+            hash TEXT PRIMARY KEY,
+            data BLOB NOT NULL,
+            raw_size INTEGER NOT NULL
+        );
+        """
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS plans_data_hash_idx ON plans(data_hash)")
+    backfill_plan_storage(conn)
+
+
+def backfill_plan_storage(conn: sqlite3.Connection, batch_size: int = 200) -> int:
+    """把仍以明文保存的旧计划转为压缩去重存储，返回处理的行数。
+
+    分批提交，中断后再次执行会从剩余的行继续。
+    """
+    done = 0
+    while True:
+        rows = conn.execute(
+            "SELECT id, data_json, params_json FROM plans WHERE data_hash IS NULL LIMIT ?",
+            (batch_size,),
+        ).fetchall()
+        if not rows:
+            return done
+        for plan_id, data_json, params_json in rows:
+            _store_plan_blob(conn, plan_id, data_json or "", params_json)
+        conn.commit()
+        done += len(rows)
+
+
+@traced()
+def backfill_plans() -> int:
+    """手动回填入口：迁移之后仍以明文写入的计划（例如旧版本进程写入）也会被转换。"""
+    if _use_supabase():
+        return 0
+    with _connect() as conn:
+        return backfill_plan_storage(conn)
+
+
+def _put_blob(conn: sqlite3.Connection, data_json: str, params_json: Optional[str]):
+    data_hash, blob, summary = plan_store.encode_plan(data_json, params_json)
+    conn.execute(
+        "INSERT OR IGNORE INTO plan_blobs(hash, data, raw_size) VALUES(?,?,?)",
+        (data_hash, blob, len(data_json.encode("utf-8"))),
+    )
+    return data_hash, summary
+
+
+def _store_plan_blob(conn: sqlite3.Connection, plan_id, data_json: str, params_json: Optional[str]) -> None:
+    data_hash, summary = _put_blob(conn, data_json, params_json)
+    conn.execute(
+        "UPDATE plans SET data_json='', data_hash=?, destination=?, city=?, days=?, budget_cny=? WHERE id=?",
+        (data_hash, summary["destination"], summary["city"], summary["days"], summary["budget_cny"], plan_id),
+    )
+
+
+def _gc_blob(conn: sqlite3.Connection, data_hash: Optional[str]) -> None:
+    # 没有计划再引用该内容时删除
+    if data_hash:
+        conn.execute(
+            "DELETE FROM plan_blobs WHERE hash=? AND NOT EXISTS (SELECT 1 FROM plans WHERE data_hash=?)",
+            (data_hash, data_hash),
+        )
+
+
+def _add_plan_search(conn: sqlite3.Connection) -> None:
+    """全文检索：plan_search 保存分字后的检索文本，plans_fts 为其 FTS5 外部内容索引。
+
+    触发器保证 plan_search 的增删改同步到 plans_fts，删除计划时同步删除检索文本。
+    owner 列写入 "u<user_id>"，查询时与关键词一起 MATCH，按用户过滤也走倒排索引。
+    """
+    conn.executescript(
+        """
+        CREATE TABLE IF NOT EXISTS plan_search (
+            plan_id INTEGER PRIMARY KEY,
+            owner TEXT NOT NULL,
+            title TEXT,
+            destination TEXT,
+            places TEXT,
+            restaurants TEXT,
+            hotel TEXT
+        );
+        CREATE VIRTUAL TABLE IF NOT EXISTS plans_fts USING fts5(
+            owner, title, destination, places, restaurants, hotel,
+            content='plan_search', content_rowid='plan_id', tokenize='unicode61'
+        );
+        CREATE TRIGGER IF NOT EXISTS plan_search_ai AFTER INSERT ON plan_search BEGIN
+            INSERT INTO plans_fts(rowid, owner, title, destination, places, restaurants, hotel)
+            VALUES (new.plan_id, new.owner, new.title, new.destination, new.places, new.restaurants, new.hotel);
+        END;
+        CREATE TRIGGER IF NOT EXISTS plan_search_ad AFTER DELETE ON plan_search BEGIN
+            INSERT INTO plans_fts(plans_fts, rowid, owner, title, destination, places, restaurants, hotel)
+            VALUES ('delete', old.plan_id, old.owner, old.title, old.destination, old.places, old.restaurants, old.hotel);
+        END;
+        CREATE TRIGGER IF NOT EXISTS plan_search_au AFTER UPDATE ON plan_search BEGIN
+            INSERT INTO plans_fts(plans_fts, rowid, owner, title, destination, places, restaurants, hotel)
+            VALUES ('delete', old.plan_id, old.owner, old.title, old.destination, old.places, old.restaurants, old.hotel);
+            INSERT INTO plans_fts(rowid, owner, title, destination, places, restaurants, hotel)
+            VALUES (new.plan_id, new.owner, new.title, new.destination, new.places, new.restaurants, new.hotel);
+        END;
+        CREATE TRIGGER IF NOT EXISTS plans_search_ad AFTER DELETE ON plans BEGIN
+            DELETE FROM plan_search WHERE plan_id = old.id;
+        END;
+        """
+    )
+    _backfill_plan_search(conn)
+
+
+def _backfill_plan_search(conn: sqlite3.Connection) -> None:
+    # 为尚未建立检索文本的计划建立索引
+    rows = conn.execute(
+        "SELECT p.id, p.user_id, p.title, p.data_json, p.destination, p.city, b.data FROM plans p"
+        " LEFT JOIN plan_blobs b ON b.hash = p.data_hash"
+        " WHERE NOT EXISTS (SELECT 1 FROM plan_search s WHERE s.plan_id = p.id)"
+    )
+    for plan_id, user_id, title, data_json, destination, city, blob in rows.fetchall():
+        if blob is not None:
+            data_json = plan_store.decompress(blob)
+        _index_plan(conn, plan_id, user_id, title, data_json, {"destination": destination, "city": city})
+    conn.commit()
+
+
+def _reindex_plan_search(conn: sqlite3.Connection) -> None:
+    """检索文本的生成方式变化后重建（删除经触发器同步到 plans_fts）。"""
+    conn.execute("DELETE FROM plan_search")
+    _backfill_plan_search(conn)
+
+
+def _index_plan(conn: sqlite3.Connection, plan_id, user_id, title: str, data_json: str, summary: Dict) -> None:
+    fields = plan_search.extract_search_fields(title, data_json, summary)
+    conn.execute(
+        "INSERT OR REPLACE INTO plan_search(plan_id, owner, title, destination, places, restaurants, hotel)"
+        " VALUES(?,?,?,?,?,?,?)",
+        (plan_id, f"u{user_id}", *[fields[c] for c in plan_search.SEARCH_COLUMNS]),
+    )
+
+
+# 迁移按版本号顺序执行，已执行的版本记录在 PRAGMA user_version 中
+_MIGRATIONS = [
+    (1, [
+        "CREATE INDEX IF NOT EXISTS plans_user_updated_idx ON plans(user_id, updated_at DESC, id DESC)",
+    ]),
+    (2, [_add_plan_blob_storage]),
+    (3, [_add_plan_search]),
+    # 同一列的多个值改用 search.VALUE_SEPARATOR 分隔
+    (4, [_reindex_plan_search]),
+    # 分字改用 search.SEG 分隔，高亮可还原原文
+    (5, [_reindex_plan_search]),
+]
+
+
+def _migrate(conn: sqlite3.Connection) -> None:
+    current = conn.execute("PRAGMA user_version").fetchone()[0]
+    for version, statements in _MIGRATIONS:
+        if version <= current:
+            continue
+        for stmt in statements:
+            if callable(stmt):
+                stmt(conn)
+            else:
+                conn.execute(stmt)
+        conn.execute(f"PRAGMA user_version={int(version)}")
+        conn.commit()
+
+
+@traced()
 def init_db() -> None:
+    os.makedirs(os.path.dirname(_db_path()), exist_ok=True)
     if _use_supabase():
-        # Supabase 使用托管 Postgres 与 Row Level Security；无需本地初始化
+        # Supabase 使用托管 Postgres 与 Row Level Security；本地仅保存后台任务状态
+        with _connect() as conn:
+            _init_jobs_table(conn)
+            _init_route_cache_table(conn)
+            _init_geocode_cache_table(conn)
+            _init_usage_table(conn)
+            conn.commit()
         return
-    path = _db_path()
-    os.makedirs(os.path.dirname(path), exist_ok=True)
-    conn = sqlite3.connect(path)
-    try:
+    with _connect() as conn:
         conn.execute(
             """
             CREATE TABLE IF NOT EXISTS users (
@@ -49,21 +459,49 @@ def init_db() -> None:
             );
             """
         )
+        _init_jobs_table(conn)
+        _init_route_cache_table(conn)
+        _init_geocode_cache_table(conn)
+        _init_usage_table(conn)
         conn.commit()
-    finally:
-        conn.close()
+        _migrate(conn)
 
 
-def _hash_password(password: str, salt_hex: Optional[str] = None) -> (str, str):
-    if salt_hex is None:
-        salt = os.urandom(16)
-        salt_hex = salt.hex()
-    else:
-        salt = bytes.fromhex(salt_hex)
-    dk = hashlib.pbkdf2_hmac("sha256", password.encode("utf-8"), salt, 100_000)
-    return dk.hex(), salt_hex
+def _find_user_by_name(username: str) -> Optional[tuple]:
+    with _connect() as conn:
+        return conn.execute(
+            "SELECT id, username, password_hash, password_salt FROM users WHERE username=?",
+            (username,),
+        ).fetchone()
+
+
+def _insert_user(username: str, password_hash: str) -> Optional[str]:
+    # 新格式的哈希自带盐与参数，password_salt 列留空
+    with _connect() as conn:
+        now = datetime.datetime.utcnow().isoformat()
+        try:
+            conn.execute(
+                "INSERT INTO users(username, password_hash, password_salt, created_at) VALUES(?,?,?,?)",
+                (username, password_hash, "", now),
+            )
+        except sqlite3.IntegrityError:
+            return "用户名已存在"
+        conn.commit()
+        return None
 
 
+def _set_password_hash(user_id: str, password_hash: str) -> bool:
+    with _connect() as conn:
+        cur = conn.execute(
+            "UPDATE users SET password_hash=?, password_salt='' WHERE id=?",
+            (password_hash, user_id),
+        )
+        conn.commit()
+    invalidate_user(user_id)
+    return cur.rowcount > 0
+
+
+@traced()
 def create_user(username: str, password: str) -> Optional[str]:
     """Create user. Returns error message if failed, otherwise None.
 
@@ -78,23 +516,12 @@ def create_user(username: str, password: str) -> Optional[str]:
         except Exception as e:
             return f"注册失败：{e}"
     # SQLite 回退
-    conn = sqlite3.connect(_db_path())
-    try:
-        cur = conn.execute("SELECT id FROM users WHERE username=?", (username,))
-        if cur.fetchone():
-            return "用户名已存在"
-        pwd_hash, salt_hex = _hash_password(password)
-        now = datetime.datetime.utcnow().isoformat()
-        conn.execute(
-            "INSERT INTO users(username, password_hash, password_salt, created_at) VALUES(?,?,?,?)",
-            (username, pwd_hash, salt_hex, now),
-        )
-        conn.commit()
-        return None
-    finally:
-        conn.close()
+    if _find_user_by_name(username):
+        return "用户名已存在"
+    return _insert_user(username, get_hasher().hash(password))
 
 
+@traced()
 def verify_user(username: str, password: str) -> Optional[Dict]:
     if _use_supabase():
         client = get_supabase_client()
@@ -109,41 +536,69 @@ def verify_user(username: str, password: str) -> Optional[Dict]:
         except Exception:
             return None
     # SQLite 回退
-    conn = sqlite3.connect(_db_path())
-    try:
-        cur = conn.execute(
-            "SELECT id, username, password_hash, password_salt FROM users WHERE username=?",
-            (username,),
-        )
-        row = cur.fetchone()
-        if not row:
-            return None
-        user_id, uname, pwd_hash, pwd_salt = row
-        candidate_hash, _ = _hash_password(password, pwd_salt)
-        if candidate_hash == pwd_hash:
-            return {"id": user_id, "username": uname}
+    row = _find_user_by_name(username)
+    if not row:
+        return None
+    user_id, uname, pwd_hash, pwd_salt = row
+    hasher = get_hasher()
+    if not hasher.verify(password, pwd_hash, pwd_salt or None):
         return None
-    finally:
-        conn.close()
+    if passwords.needs_rehash(pwd_hash):
+        # 旧格式或成本参数已调整：用当前配置重新哈希
+        _set_password_hash(user_id, hasher.hash(password))
+    return {"id": user_id, "username": uname}
+
+
+# 用户信息缓存：页面每次渲染都要取用户名，命中时不再访问数据库。
+# 修改密码与退出登录时主动失效；不缓存“用户不存在”的结果。
+_user_cache = MemoryCache(
+    ttl_seconds=float(os.environ.get("USER_CACHE_TTL", "300")),
+    max_entries=int(os.environ.get("USER_CACHE_MAX", "1024")),
+)
+
+# 当前请求内节省的数据库往返次数，由 web 层的中间件设置并读取
+request_db_stats: contextvars.ContextVar[Optional[Dict]] = contextvars.ContextVar("request_db_stats", default=None)
+
+
+def _count_saved_roundtrip() -> None:
+    stats = request_db_stats.get()
+    if stats is not None:
+        stats["saved"] = stats.get("saved", 0) + 1
 
 
+@traced()
 def get_user_by_id(user_id: str) -> Optional[Dict]:
     if _use_supabase():
         # 仅用于展示用户名，真实环境可使用 access_token 调用 gotrue /auth/v1/user
         return {"id": user_id}
-    conn = sqlite3.connect(_db_path())
-    try:
+    key = str(user_id)
+    cached = _user_cache.get(key)
+    if cached is not None:
+        _count_saved_roundtrip()
+        return dict(cached)
+    with _connect() as conn:
         cur = conn.execute("SELECT id, username FROM users WHERE id=?", (user_id,))
         row = cur.fetchone()
         if not row:
             return None
-        return {"id": row[0], "username": row[1]}
-    finally:
-        conn.close()
+        user = {"id": row[0], "username": row[1]}
+    _user_cache.set(key, user)
+    return dict(user)
+
+
+def invalidate_user(user_id: str) -> None:
+    _user_cache.delete(str(user_id))
+
 
+def user_cache_stats() -> Dict:
+    """缓存统计；hits 即累计节省的数据库往返次数。"""
+    return _user_cache.stats()
 
+
+@traced()
 def create_plan(user_id: str, title: str, data_json: str, params_json: Optional[str]) -> str:
     if _use_supabase():
+        # Postgres 对大字段自带 TOAST 压缩，这里只额外写入摘要列
         client = get_supabase_client()
         assert client is not None
         res = client.table("plans").insert({
@@ -151,44 +606,165 @@ def create_plan(user_id: str, title: str, data_json: str, params_json: Optional[
             "title": title,
             "data_json": data_json,
             "params_json": params_json,
+            **plan_store.extract_summary(data_json, params_json),
         }).execute()
         row = (res.data or [{}])[0]
         return str(row.get("id"))
-    conn = sqlite3.connect(_db_path())
-    try:
+    with _connect() as conn:
         now = datetime.datetime.utcnow().isoformat()
+        data_hash, summary = _put_blob(conn, data_json, params_json)
         cur = conn.execute(
-            "INSERT INTO plans(user_id, title, data_json, params_json, created_at, updated_at) VALUES(?,?,?,?,?,?)",
-            (user_id, title, data_json, params_json, now, now),
+            "INSERT INTO plans(user_id, title, data_json, params_json, created_at, updated_at,"
+            " data_hash, destination, city, days, budget_cny) VALUES(?,?,?,?,?,?,?,?,?,?,?)",
+            (user_id, title, "", params_json, now, now,
+             data_hash, summary["destination"], summary["city"], summary["days"], summary["budget_cny"]),
         )
+        _index_plan(conn, cur.lastrowid, user_id, title, data_json, summary)
         conn.commit()
         return str(cur.lastrowid)
-    finally:
-        conn.close()
 
 
-def list_plans(user_id: str) -> List[Dict]:
+def _encode_cursor(updated_at: str, plan_id) -> str:
+    raw = json.dumps([updated_at, int(plan_id)], separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def _decode_cursor(cursor: str):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        updated_at, plan_id = json.loads(raw)
+        # 只接受合法的时间戳：Supabase 分支会把它写进 PostgREST 过滤表达式
+        datetime.datetime.fromisoformat(updated_at)
+        return updated_at, int(plan_id)
+    except Exception:
+        raise ValueError("无效的分页游标")
+
+
+# 列表只读取摘要列，不解压行程数据
+_PLAN_LIST_FIELDS = "id,title,created_at,updated_at,destination,city,days,budget_cny"
+
+
+@traced()
+def list_plans(user_id: str, limit: Optional[int] = None, cursor: Optional[str] = None) -> List[Dict]:
+    """按更新时间倒序列出计划。
+
+    limit 为空时返回全部；cursor 为上一页最后一条的游标（见 list_plans_page），
+    采用 (updated_at, id) 键集分页，翻页成本与页码无关。
+    """
+    after = _decode_cursor(cursor) if cursor else None
     if _use_supabase():
         client = get_supabase_client()
         assert client is not None
-        res = client.table("plans").select("id,title,created_at,updated_at").eq("user_id", user_id).order("updated_at", desc=True).execute()
+        q = client.table("plans").select(_PLAN_LIST_FIELDS).eq("user_id", user_id)
+        if after:
+            ts, pid = after
+            q = q.or_(f'updated_at.lt."{ts}",and(updated_at.eq."{ts}",id.lt.{pid})')
+        q = q.order("updated_at", desc=True).order("id", desc=True)
+        if limit:
+            q = q.limit(limit)
+        res = q.execute()
         rows = res.data or []
         return rows
-    conn = sqlite3.connect(_db_path())
-    try:
-        cur = conn.execute(
-            "SELECT id, title, created_at, updated_at FROM plans WHERE user_id=? ORDER BY updated_at DESC",
-            (user_id,),
-        )
-        rows = cur.fetchall()
+    sql = f"SELECT {_PLAN_LIST_FIELDS} FROM plans WHERE user_id=?"
+    args: list = [user_id]
+    if after:
+        sql += " AND (updated_at < ? OR (updated_at = ? AND id < ?))"
+        args += [after[0], after[0], after[1]]
+    sql += " ORDER BY updated_at DESC, id DESC"
+    if limit:
+        sql += " LIMIT ?"
+        args.append(int(limit))
+    with _connect() as conn:
+        cur = conn.execute(sql, args)
+        cols = [c[0] for c in cur.description]
+        return [dict(zip(cols, r)) for r in cur.fetchall()]
+
+
+@traced()
+def list_plans_page(user_id: str, limit: int = 20, cursor: Optional[str] = None) -> Dict:
+    """分页列出计划：返回 {"items": [...], "next_cursor": str|None}。"""
+    rows = list_plans(user_id, limit=limit + 1, cursor=cursor)
+    items = rows[:limit]
+    next_cursor = None
+    if len(rows) > limit and items:
+        last = items[-1]
+        next_cursor = _encode_cursor(str(last["updated_at"]), last["id"])
+    return {"items": items, "next_cursor": next_cursor}
+
+
+def _search_candidates() -> int:
+    # 参与打分的候选命中数上限（按最新优先）
+    return int(os.environ.get("PLAN_SEARCH_CANDIDATES", "500"))
+
+
+_SEARCH_RESULT_FIELDS = ("id", "title", "destination", "city", "days", "budget_cny", "updated_at")
+
+
+def _search_result(row: Dict, score: float, hl_texts) -> Dict:
+    hl = {}
+    for col, text in zip(plan_search.SEARCH_COLUMNS, hl_texts):
+        if text and plan_search.HL_START in text:
+            hl[col] = plan_search.highlight_parts(text)
+    out = {k: row.get(k) for k in _SEARCH_RESULT_FIELDS}
+    out["score"] = round(float(score or 0), 4)
+    out["highlights"] = hl
+    return out
+
+
+@traced()
+def search_plans(user_id: str, q: str, limit: int = 20) -> List[Dict]:
+    """按关键词检索当前用户的计划，按相关度从高到低排序。
+
+    highlights 为 {列名: [(文本, 是否命中), ...]}，只包含有命中的列。
+    """
+    if _use_supabase():
+        # 见 supabase/plans_search.sql 中的 search_plans 函数（只返回标题/目的地高亮）。
+        # 与 list_plans/get_plan 一样显式传入用户：共享客户端上的 auth.uid() 未必是当前请求者
+        client = get_supabase_client()
+        assert client is not None
+        terms = plan_search.query_terms(q)
+        if not terms:
+            return []
+        res = client.rpc("search_plans", {
+            "uid": user_id,
+            "terms": terms,
+            "lim": int(limit),
+            "hl_start": plan_search.HL_START,
+            "hl_end": plan_search.HL_END,
+        }).execute()
         return [
-            {"id": r[0], "title": r[1], "created_at": r[2], "updated_at": r[3]}
-            for r in rows
+            _search_result(r, r.get("score"), [r.get(f"{c}_hl") for c in plan_search.SEARCH_COLUMNS])
+            for r in res.data or []
         ]
-    finally:
-        conn.close()
+    match = plan_search.build_match_query(q)
+    if not match:
+        return []
+    hl_cols = ", ".join(
+        f"highlight(plans_fts, {i + 1}, '{plan_search.HL_START}', '{plan_search.HL_END}')"
+        for i in range(len(plan_search.SEARCH_COLUMNS))
+    )
+    with _connect() as conn:
+        # 不用 bm25()：它要为每个短语统计全库文档数，常见词在 10 万级数据上要多花数毫秒。
+        # 先取该用户最新的一批命中（rowid 倒序，FTS5 可直接按索引输出），再按列权重打分。
+        cur = conn.execute(
+            f"SELECT rowid, {hl_cols} FROM plans_fts WHERE plans_fts MATCH ? ORDER BY rowid DESC LIMIT ?",
+            (f'owner:"u{user_id}" AND ({match})', _search_candidates()),
+        )
+        hits = [(plan_search.score_highlights(r[1:]), r[0], r[1:]) for r in cur.fetchall()]
+        hits.sort(key=lambda h: (h[0], h[1]), reverse=True)
+        hits = hits[:int(limit)]
+        if not hits:
+            return []
+        ids = [h[1] for h in hits]
+        cur = conn.execute(
+            f"SELECT {', '.join(_SEARCH_RESULT_FIELDS)} FROM plans WHERE id IN ({','.join('?' * len(ids))})",
+            ids,
+        )
+        rows = {r[0]: dict(zip(_SEARCH_RESULT_FIELDS, r)) for r in cur.fetchall()}
+        return [_search_result(rows[pid], score, texts) for score, pid, texts in hits if pid in rows]
 
 
+@traced()
 def get_plan(plan_id: str, user_id: str) -> Optional[Dict]:
     if _use_supabase():
         client = get_supabase_client()
@@ -196,10 +772,10 @@ def get_plan(plan_id: str, user_id: str) -> Optional[Dict]:
         res = client.table("plans").select("id,title,data_json,params_json,created_at,updated_at").eq("id", plan_id).eq("user_id", user_id).limit(1).execute()
         rows = res.data or []
         return rows[0] if rows else None
-    conn = sqlite3.connect(_db_path())
-    try:
+    with _connect() as conn:
         cur = conn.execute(
-            "SELECT id, title, data_json, params_json, created_at, updated_at FROM plans WHERE id=? AND user_id=?",
+            "SELECT p.id, p.title, p.data_json, p.params_json, p.created_at, p.updated_at, b.data"
+            " FROM plans p LEFT JOIN plan_blobs b ON b.hash = p.data_hash WHERE p.id=? AND p.user_id=?",
             (plan_id, user_id),
         )
         row = cur.fetchone()
@@ -208,30 +784,30 @@ def get_plan(plan_id: str, user_id: str) -> Optional[Dict]:
         return {
             "id": row[0],
             "title": row[1],
-            "data_json": row[2],
+            "data_json": plan_store.decompress(row[6]) if row[6] is not None else row[2],
             "params_json": row[3],
             "created_at": row[4],
             "updated_at": row[5],
         }
-    finally:
-        conn.close()
 
 
+@traced()
 def delete_plan(plan_id: str, user_id: str) -> bool:
     if _use_supabase():
         client = get_supabase_client()
         assert client is not None
         res = client.table("plans").delete().eq("id", plan_id).eq("user_id", user_id).execute()
         return (res.data is not None) and len(res.data) > 0
-    conn = sqlite3.connect(_db_path())
-    try:
+    with _connect() as conn:
+        row = conn.execute("SELECT data_hash FROM plans WHERE id=? AND user_id=?", (plan_id, user_id)).fetchone()
         cur = conn.execute("DELETE FROM plans WHERE id=? AND user_id=?", (plan_id, user_id))
+        if row:
+            _gc_blob(conn, row[0])
         conn.commit()
         return cur.rowcount > 0
-    finally:
-        conn.close()
 
 
+@traced()
 def update_user_password(user_id: str, new_password: str) -> bool:
     """Update user's password.
 
@@ -247,14 +823,228 @@ def update_user_password(user_id: str, new_password: str) -> bool:
         except Exception:
             return False
     # SQLite fallback
-    conn = sqlite3.connect(_db_path())
-    try:
-        new_hash, new_salt = _hash_password(new_password)
+    return _set_password_hash(user_id, get_hasher().hash(new_password))
+
+
+# =============== 后台规划任务 ===============
+@traced()
+def create_job(job_id: str, user_id: str, params_json: str) -> None:
+    with _connect() as conn:
+        now = datetime.datetime.utcnow().isoformat()
+        conn.execute(
+            "INSERT INTO plan_jobs(id, user_id, status, params_json, created_at, updated_at) VALUES(?,?,?,?,?,?)",
+            (job_id, str(user_id), "queued", params_json, now, now),
+        )
+        conn.commit()
+
+
+@traced()
+def update_job(job_id: str, status: str, result_json: Optional[str] = None, error: Optional[str] = None) -> None:
+    with _connect() as conn:
+        now = datetime.datetime.utcnow().isoformat()
+        conn.execute(
+            "UPDATE plan_jobs SET status=?, result_json=?, error=?, updated_at=? WHERE id=?",
+            (status, result_json, error, now, job_id),
+        )
+        conn.commit()
+
+
+@traced()
+def get_job(job_id: str, user_id: Optional[str] = None) -> Optional[Dict]:
+    with _connect() as conn:
+        sql = "SELECT id, user_id, status, params_json, result_json, error, created_at, updated_at FROM plan_jobs WHERE id=?"
+        args = [job_id]
+        if user_id is not None:
+            sql += " AND user_id=?"
+            args.append(str(user_id))
+        row = conn.execute(sql, args).fetchone()
+        if not row:
+            return None
+        return {
+            "id": row[0],
+            "user_id": row[1],
+            "status": row[2],
+            "params_json": row[3],
+            "result_json": row[4],
+            "error": row[5],
+            "created_at": row[6],
+            "updated_at": row[7],
+        }
+
+
+@traced()
+def claim_job(job_id: str) -> bool:
+    """把 queued 的任务标记为 running；返回是否由本次调用领取（多进程时每个任务只执行一次）。"""
+    with _connect() as conn:
+        now = datetime.datetime.utcnow().isoformat()
         cur = conn.execute(
-            "UPDATE users SET password_hash=?, password_salt=? WHERE id=?",
-            (new_hash, new_salt, user_id),
+            "UPDATE plan_jobs SET status='running', updated_at=? WHERE id=? AND status='queued'",
+            (now, job_id),
         )
         conn.commit()
-        return cur.rowcount > 0
-    finally:
-        conn.close()
\ No newline at end of file
+        return cur.rowcount == 1
+
+
+@traced()
+def requeue_stale_jobs(stale_seconds: float) -> int:
+    """把超过 stale_seconds 仍为 running 的任务（执行它的进程已退出）改回 queued，返回条数。"""
+    cutoff = (datetime.datetime.utcnow() - datetime.timedelta(seconds=stale_seconds)).isoformat()
+    with _connect() as conn:
+        now = datetime.datetime.utcnow().isoformat()
+        cur = conn.execute(
+            "UPDATE plan_jobs SET status='queued', updated_at=? WHERE status='running' AND updated_at < ?",
+            (now, cutoff),
+        )
+        conn.commit()
+        return cur.rowcount
+
+
+@traced()
+def delete_finished_jobs(retention_seconds: float) -> int:
+    """删除结束超过 retention_seconds 的 done/failed 任务，返回条数。"""
+    cutoff = (datetime.datetime.utcnow() - datetime.timedelta(seconds=retention_seconds)).isoformat()
+    with _connect() as conn:
+        cur = conn.execute(
+            "DELETE FROM plan_jobs WHERE status IN ('done','failed') AND updated_at < ?",
+            (cutoff,),
+        )
+        conn.commit()
+        return cur.rowcount
+
+
+@traced()
+def list_queued_jobs() -> List[Dict]:
+    """返回等待执行的任务（按创建时间），用于启动与定期巡检时入队。"""
+    with _connect() as conn:
+        rows = conn.execute(
+            "SELECT id, user_id, params_json FROM plan_jobs WHERE status='queued' ORDER BY created_at",
+        ).fetchall()
+        return [{"id": r[0], "user_id": r[1], "params_json": r[2]} for r in rows]
+
+
+# =============== 路线缓存 ===============
+@traced()
+def get_route_legs(provider: str, mode: str, pairs: List[tuple]) -> Dict[tuple, Dict]:
+    """批量读取 (origin, destination) 的缓存路段；未命中的键不出现在返回值中。"""
+    out: Dict[tuple, Dict] = {}
+    if not pairs:
+        return out
+    with _connect() as conn:
+        # 每批最多 400 对，避免超出 SQLite 参数个数上限
+        for i in range(0, len(pairs), 400):
+            batch = pairs[i:i + 400]
+            placeholders = ",".join(["(?,?)"] * len(batch))
+            args = [provider, mode] + [v for pair in batch for v in pair]
+            rows = conn.execute(
+                "SELECT origin, destination, distance_m, duration_s, polyline FROM route_legs"
+                f" WHERE provider=? AND mode=? AND (origin, destination) IN (VALUES {placeholders})",
+                args,
+            ).fetchall()
+            for origin, destination, distance_m, duration_s, polyline in rows:
+                out[(origin, destination)] = {
+                    "distance_m": distance_m,
+                    "duration_s": duration_s,
+                    "polyline": json.loads(polyline),
+                }
+    return out
+
+
+@traced()
+def save_route_legs(provider: str, mode: str, legs: Dict[tuple, Dict]) -> None:
+    if not legs:
+        return
+    now = datetime.datetime.utcnow().isoformat()
+    with _connect() as conn:
+        conn.executemany(
+            "INSERT OR REPLACE INTO route_legs(provider, mode, origin, destination, distance_m, duration_s, polyline, created_at)"
+            " VALUES(?,?,?,?,?,?,?,?)",
+            [
+                (provider, mode, o, d, leg["distance_m"], leg["duration_s"],
+                 json.dumps(leg["polyline"], separators=(",", ":")), now)
+                for (o, d), leg in legs.items()
+            ],
+        )
+        conn.commit()
+
+
+# =============== 地名坐标缓存 ===============
+@traced()
+def get_geocodes(city: str, names: List[str], miss_ttl_seconds: float = 86400) -> Dict[str, Optional[tuple]]:
+    """批量读取坐标：命中返回 (lng, lat)，已知查不到（且未过期）返回 None，未缓存的名称不出现在结果中。"""
+    out: Dict[str, Optional[tuple]] = {}
+    if not names:
+        return out
+    miss_after = (datetime.datetime.utcnow() - datetime.timedelta(seconds=miss_ttl_seconds)).isoformat()
+    with _connect() as conn:
+        for i in range(0, len(names), 500):
+            batch = names[i:i + 500]
+            rows = conn.execute(
+                "SELECT name, lng, lat, created_at FROM geocodes"
+                f" WHERE city=? AND name IN ({','.join(['?'] * len(batch))})",
+                [city] + batch,
+            ).fetchall()
+            for name, lng, lat, created_at in rows:
+                if lng is not None and lat is not None:
+                    out[name] = (lng, lat)
+                elif created_at >= miss_after:
+                    out[name] = None
+    return out
+
+
+@traced()
+def save_geocodes(city: str, provider: str, coords: Dict[str, Optional[tuple]]) -> None:
+    if not coords:
+        return
+    now = datetime.datetime.utcnow().isoformat()
+    with _connect() as conn:
+        conn.executemany(
+            "INSERT OR REPLACE INTO geocodes(city, name, lng, lat, provider, created_at) VALUES(?,?,?,?,?,?)",
+            [
+                (city, name, pt[0] if pt else None, pt[1] if pt else None, provider, now)
+                for name, pt in coords.items()
+            ],
+        )
+        conn.commit()
+
+
+# =============== LLM 用量 ===============
+@traced()
+def add_llm_usage(rows: List[tuple]) -> None:
+    """批量累加用量：rows 为 (day, user_id, stage, model, calls, prompt_tokens, completion_tokens)。"""
+    if not rows:
+        return
+    with _connect() as conn:
+        conn.executemany(
+            "INSERT INTO llm_usage(day, user_id, stage, model, calls, prompt_tokens, completion_tokens)"
+            " VALUES(?,?,?,?,?,?,?)"
+            " ON CONFLICT(day, user_id, stage, model) DO UPDATE SET"
+            " calls=calls+excluded.calls,"
+            " prompt_tokens=prompt_tokens+excluded.prompt_tokens,"
+            " completion_tokens=completion_tokens+excluded.completion_tokens",
+            rows,
+        )
+        conn.commit()
+
+
+@traced()
+def get_llm_usage(since_day: str, user_id: Optional[str] = None) -> List[Dict]:
+    """读取 since_day（含）以来的用量明细；指定 user_id 时只返回该用户。"""
+    sql = "SELECT day, user_id, stage, model, calls, prompt_tokens, completion_tokens FROM llm_usage WHERE day>=?"
+    args: list = [since_day]
+    if user_id is not None:
+        sql += " AND user_id=?"
+        args.append(str(user_id))
+    with _connect() as conn:
+        rows = conn.execute(sql + " ORDER BY day, user_id, stage", args).fetchall()
+    keys = ("day", "user_id", "stage", "model", "calls", "prompt_tokens", "completion_tokens")
+    return [dict(zip(keys, r)) for r in rows]
+
+
+@traced()
+def get_user_tokens(user_id: str, day: str) -> int:
+    with _connect() as conn:
+        row = conn.execute(
+            "SELECT COALESCE(SUM(prompt_tokens + completion_tokens), 0) FROM llm_usage WHERE user_id=? AND day=?",
+            (str(user_id), day),
+        ).fetchone()
+    return int(row[0] or 0)
@@ -0,0 +1,79 @@
+"""db 模块的异步门面：在专用线程池中执行数据库调用，供 async 路由与后台任务使用，避免阻塞事件循环。"""
+import os
+import asyncio
+import functools
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+
+from . import db
+from . import passwords
+
+
+# 线程数与 SQLite 连接池大小一致，线程不会因等待连接而空转
+_executor = ThreadPoolExecutor(
+    max_workers=int(os.environ.get("SQLITE_POOL_SIZE", "8")),
+    thread_name_prefix="db",
+)
+
+
+async def run(fn, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    # 带上调用方的 contextvars（如 db.request_db_stats），与 asyncio.to_thread 行为一致
+    ctx = contextvars.copy_context()
+    return await loop.run_in_executor(_executor, functools.partial(ctx.run, fn, *args, **kwargs))
+
+
+def _wrap(fn):
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        return await run(fn, *args, **kwargs)
+    return wrapper
+
+
+get_user_by_id = _wrap(db.get_user_by_id)
+invalidate_user = db.invalidate_user
+
+
+# 账号相关：数据库读写在线程池，密码哈希在 passwords 的进程池中 await，两者都不占用事件循环
+async def create_user(username: str, password: str):
+    if db._use_supabase():
+        return await run(db.create_user, username, password)
+    if await run(db._find_user_by_name, username):
+        return "用户名已存在"
+    return await run(db._insert_user, username, await passwords.get_hasher().hash_async(password))
+
+
+async def verify_user(username: str, password: str):
+    if db._use_supabase():
+        return await run(db.verify_user, username, password)
+    row = await run(db._find_user_by_name, username)
+    if not row:
+        return None
+    user_id, uname, pwd_hash, pwd_salt = row
+    hasher = passwords.get_hasher()
+    if not await hasher.verify_async(password, pwd_hash, pwd_salt or None):
+        return None
+    if passwords.needs_rehash(pwd_hash):
+        await run(db._set_password_hash, user_id, await hasher.hash_async(password))
+    return {"id": user_id, "username": uname}
+
+
+async def update_user_password(user_id: str, new_password: str) -> bool:
+    if db._use_supabase():
+        return await run(db.update_user_password, user_id, new_password)
+    return await run(db._set_password_hash, user_id, await passwords.get_hasher().hash_async(new_password))
+
+
+create_plan = _wrap(db.create_plan)
+list_plans = _wrap(db.list_plans)
+list_plans_page = _wrap(db.list_plans_page)
+get_plan = _wrap(db.get_plan)
+delete_plan = _wrap(db.delete_plan)
+create_job = _wrap(db.create_job)
+update_job = _wrap(db.update_job)
+get_job = _wrap(db.get_job)
+claim_job = _wrap(db.claim_job)
+requeue_stale_jobs = _wrap(db.requeue_stale_jobs)
+delete_finished_jobs = _wrap(db.delete_finished_jobs)
+list_queued_jobs = _wrap(db.list_queued_jobs)
+get_user_tokens = _wrap(db.get_user_tokens)
@@ -0,0 +1,214 @@
+import os
+import re
+import json
+import threading
+import urllib.parse
+import urllib.request
+from abc import ABC, abstractmethod
+from typing import Dict, List, Optional, Tuple
+
+from . import config
+from . import db
+from .cache import MemoryCache
+from .knowledge import get_knowledge_base
+
+
+class GeocodeError(RuntimeError):
+    """地理编码服务调用失败时抛出；本次未解析的地名不写入缓存。"""
+
+
+_CITY_SPLIT_RE = re.compile(r"[、，,/\\\s]+")
+
+
+def normalize_city(city: Optional[str]) -> str:
+    # 多城市行程取第一个城市，去掉“市”后缀（与前端地图脚本一致）
+    first = _CITY_SPLIT_RE.split(str(city or "").strip())[0]
+    return first[:-1] if first.endswith("市") and len(first) > 1 else first
+
+
+class GeocodeProvider(ABC):
+    """地理编码接口：geocode_batch 返回 {名称: (lng, lat) 或 None（查不到）}。"""
+
+    name = "base"
+
+    @abstractmethod
+    def geocode_batch(self, city: str, names: List[str]) -> Dict[str, Optional[Tuple[float, float]]]:
+        """批量解析同一城市下的地名；服务调用失败时抛出 GeocodeError。"""
+
+
+class LocalGeocoder(GeocodeProvider):
+    """离线替身：在城市知识库的景点/餐厅/酒店中按名称查找坐标。"""
+
+    name = "local"
+
+    def geocode_batch(self, city, names):
+        kb = get_knowledge_base()
+        info = kb.city(city)
+        cities = [info] if info else list(kb.cities.values())
+        index: Dict[str, Tuple[float, float]] = {}
+        for c in cities:
+            for it in c.attractions + c.restaurants + c.hotels:
+                if "lng" in it and "lat" in it:
+                    index.setdefault(it["name"], (it["lng"], it["lat"]))
+        return {n: index.get(n) for n in names}
+
+
+class AMapGeocoder(GeocodeProvider):
+    """高德 Web 服务地理编码，batch=true 每次最多 10 个地址。需要 AMAP_REST_KEY。"""
+
+    name = "amap"
+    URL = "https://restapi.amap.com/v3/geocode/geo"
+    BATCH = 10
+
+    def __init__(self, key: str, timeout: float = 8.0):
+        self.key = key
+        self.timeout = timeout
+
+    def geocode_batch(self, city, names):
+        out: Dict[str, Optional[Tuple[float, float]]] = {}
+        for i in range(0, len(names), self.BATCH):
+            chunk = names[i:i + self.BATCH]
+            query = urllib.parse.urlencode({
+                "key": self.key,
+                "address": "|".join(chunk),
+                "batch": "true",
+                "city": city,
+            })
+            try:
+                with urllib.request.urlopen(f"{self.URL}?{query}", timeout=self.timeout) as resp:
+                    data = json.loads(resp.read().decode("utf-8"))
+            except Exception as e:
+                raise GeocodeError(f"地理编码请求失败：{e}")
+            if str(data.get("status")) != "1":
+                raise GeocodeError(f"地理编码失败：{data.get('info')}")
+            # 批量结果与请求地址一一对应，查不到的地址 location 为空
+            for name, gc in zip(chunk, data.get("geocodes") or []):
+                loc = gc.get("location") if isinstance(gc, dict) else None
+                if isinstance(loc, str) and "," in loc:
+                    lng, lat = loc.split(",")
+                    out[name] = (float(lng), float(lat))
+                else:
+                    out[name] = None
+        return out
+
+
+class Geocoder:
+    """批量地理编码：进程内 LRU -> 本地 geocodes 表 -> 城市知识库 -> 地理编码服务。
+
+    同一行程中的地名先去重再查询，缓存按 (城市, 名称) 跨用户共享；
+    服务返回“查不到”也会缓存 miss_ttl 秒，避免反复查询无效地名。
+    """
+
+    def __init__(self, provider: GeocodeProvider, memory_max: int = 8192, miss_ttl: float = 86400):
+        self.provider = provider
+        self.local = LocalGeocoder()
+        self.miss_ttl = miss_ttl
+        self._memory = MemoryCache(ttl_seconds=miss_ttl, max_entries=memory_max)
+        self._lock = threading.Lock()
+        self.db_hits = 0
+        self.local_hits = 0
+        self.provider_lookups = 0
+        self.errors = 0
+
+    def locate(self, city: Optional[str], names: List[str]) -> Dict[str, Optional[Tuple[float, float]]]:
+        city = normalize_city(city)
+        out: Dict[str, Optional[Tuple[float, float]]] = {}
+        pending: List[str] = []
+        for name in dict.fromkeys(str(n).strip() for n in names if n and str(n).strip()):
+            hit = self._memory.get(f"{city}|{name}")
+            if hit is not None:
+                out[name] = hit["pt"]
+            else:
+                pending.append(name)
+        if not pending:
+            return out
+
+        found = db.get_geocodes(city, pending, self.miss_ttl)
+        with self._lock:
+            self.db_hits += len(found)
+        pending = [n for n in pending if n not in found]
+
+        if pending:
+            local = {n: pt for n, pt in self.local.geocode_batch(city, pending).items() if pt}
+            with self._lock:
+                self.local_hits += len(local)
+            found.update(local)
+            pending = [n for n in pending if n not in local]
+
+        if pending and not isinstance(self.provider, LocalGeocoder):
+            try:
+                fresh = self.provider.geocode_batch(city, pending)
+                with self._lock:
+                    self.provider_lookups += len(pending)
+                db.save_geocodes(city, self.provider.name, fresh)
+                found.update(fresh)
+            except GeocodeError:
+                with self._lock:
+                    self.errors += 1
+
+        for name, pt in found.items():
+            self._memory.set(f"{city}|{name}", {"pt": pt})
+            out[name] = pt
+        return out
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "provider": self.provider.name,
+                "db_hits": self.db_hits,
+                "local_hits": self.local_hits,
+                "provider_lookups": self.provider_lookups,
+                "errors": self.errors,
+                "memory": self._memory.stats(),
+            }
+
+
+def _itinerary_places(itinerary: Dict) -> List[Dict]:
+    nodes: List[Dict] = []
+    if isinstance(itinerary.get("hotel"), dict):
+        nodes.append(itinerary["hotel"])
+    for d in itinerary.get("plan") or []:
+        for part in ("morning", "afternoon", "evening_meal"):
+            node = d.get(part)
+            if isinstance(node, dict) and node.get("name"):
+                nodes.append(node)
+    return nodes
+
+
+def geocode_itinerary(itinerary: Dict, geocoder: Optional["Geocoder"] = None) -> Dict:
+    """为行程中缺少坐标的酒店、景点与餐厅一次性批量补全 lng/lat（原地修改并返回）。"""
+    todo = [n for n in _itinerary_places(itinerary) if n.get("lng") is None or n.get("lat") is None]
+    if not todo:
+        return itinerary
+    coords = (geocoder or get_geocoder()).locate(itinerary.get("city"), [n["name"] for n in todo])
+    for node in todo:
+        pt = coords.get(str(node["name"]).strip())
+        if pt:
+            node["lng"], node["lat"] = pt
+    return itinerary
+
+
+def _build_provider() -> GeocodeProvider:
+    # GEOCODE_PROVIDER：amap / local；未设置时有 Web 服务 Key 则用高德，否则只查知识库
+    key = getattr(config, "AMAP_REST_KEY", None) or os.environ.get("AMAP_REST_KEY") or ""
+    name = os.environ.get("GEOCODE_PROVIDER") or ("amap" if key else "local")
+    if name == "amap" and key:
+        return AMapGeocoder(key)
+    return LocalGeocoder()
+
+
+_geocoder: Optional[Geocoder] = None
+_geocoder_lock = threading.Lock()
+
+
+def get_geocoder() -> Geocoder:
+    global _geocoder
+    if _geocoder is None:
+        with _geocoder_lock:
+            if _geocoder is None:
+                _geocoder = Geocoder(
+                    _build_provider(),
+                    memory_max=int(os.environ.get("GEOCODE_CACHE_MAX", "8192")),
+                    miss_ttl=float(os.environ.get("GEOCODE_MISS_TTL", "86400")),
+                )
+    return _geocoder
@@ -0,0 +1,170 @@
+import json
+import uuid
+import asyncio
+from collections import deque, OrderedDict
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional
+
+from . import db_async as db
+
+
+class JobQueueFull(RuntimeError):
+    """排队任务过多（全局或单用户）时抛出，路由层返回 429。"""
+
+
+class JobQueue:
+    """基于 asyncio 的后台规划任务队列。
+
+    - 每个用户一条待办队列，工作协程按用户轮询取任务，避免单个用户占满 worker；
+    - max_pending 限制全局排队数，max_per_user 限制单用户未完成任务数（背压）；
+    - 任务状态写入 app.db 的 plan_jobs 表。执行前用条件更新领取（queued -> running），
+      多个进程从同一张表恢复任务时每个任务只执行一次；
+    - 巡检协程每 sweep_interval 秒把超过 stale_seconds 仍为 running 的任务（进程已退出）改回 queued
+      并入队，同时删除结束超过 retention_seconds 的任务。
+    """
+
+    def __init__(
+        self,
+        runner: Callable[[Dict[str, Any]], Awaitable[Dict[str, Any]]],
+        workers: int = 4,
+        max_pending: int = 200,
+        max_per_user: int = 3,
+        sweep_interval: float = 300.0,
+        stale_seconds: float = 900.0,
+        retention_seconds: float = 7 * 86400.0,
+    ):
+        self.runner = runner
+        self.workers = workers
+        self.max_pending = max_pending
+        self.max_per_user = max_per_user
+        self.sweep_interval = sweep_interval
+        self.stale_seconds = stale_seconds
+        self.retention_seconds = retention_seconds
+        self._queues: "OrderedDict[str, Deque[tuple]]" = OrderedDict()
+        self._active: Dict[str, int] = {}
+        self._pending = 0
+        self._cond: Optional[asyncio.Condition] = None
+        self._tasks: List[asyncio.Task] = []
+        # 本进程队列中的任务 ID，巡检时避免重复入队
+        self._queued_ids: set = set()
+
+    # ---------- 生命周期 ----------
+    async def start(self) -> None:
+        self._cond = asyncio.Condition()
+        await self._sweep()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._sweeper()))
+
+    async def _sweep(self) -> None:
+        await db.delete_finished_jobs(self.retention_seconds)
+        await db.requeue_stale_jobs(self.stale_seconds)
+        jobs = await db.list_queued_jobs()
+        async with self._cond:
+            for job in jobs:
+                if job["id"] in self._queued_ids:
+                    continue
+                try:
+                    params = json.loads(job["params_json"])
+                except Exception:
+                    await db.update_job(job["id"], "failed", error="任务参数损坏")
+                    continue
+                self._reserve(job["user_id"])
+                self._enqueue(job["id"], job["user_id"], params)
+            self._cond.notify_all()
+
+    async def _sweeper(self) -> None:
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            try:
+                await self._sweep()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                # 数据库暂时不可用时下次再试
+                pass
+
+    async def stop(self) -> None:
+        for t in self._tasks:
+            t.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    # ---------- 提交 ----------
+    def _reserve(self, user_id: str) -> None:
+        self._active[user_id] = self._active.get(user_id, 0) + 1
+        self._pending += 1
+
+    def _unreserve(self, user_id: str) -> None:
+        self._active[user_id] = max(self._active.get(user_id, 1) - 1, 0)
+        self._pending -= 1
+
+    def _enqueue(self, job_id: str, user_id: str, params: Dict[str, Any]) -> None:
+        self._queues.setdefault(user_id, deque()).append((job_id, params))
+        self._queued_ids.add(job_id)
+
+    async def submit(self, user_id: str, params: Dict[str, Any]) -> str:
+        user_id = str(user_id)
+        if self._pending >= self.max_pending:
+            raise JobQueueFull("当前排队任务过多，请稍后重试")
+        if self._active.get(user_id, 0) >= self.max_per_user:
+            raise JobQueueFull(f"每位用户最多同时进行 {self.max_per_user} 个规划任务")
+        # 先占位再写库，避免并发提交同时通过上限检查
+        self._reserve(user_id)
+        job_id = uuid.uuid4().hex
+        try:
+            await db.create_job(job_id, user_id, json.dumps(params, ensure_ascii=False))
+        except Exception:
+            self._unreserve(user_id)
+            raise
+        async with self._cond:
+            self._enqueue(job_id, user_id, params)
+            self._cond.notify()
+        return job_id
+
+    def _next(self) -> Optional[tuple]:
+        # 轮询：取队首用户的一个任务后把该用户移到末尾
+        for user_id in list(self._queues.keys()):
+            q = self._queues[user_id]
+            if not q:
+                del self._queues[user_id]
+                continue
+            job_id, params = q.popleft()
+            self._queued_ids.discard(job_id)
+            self._queues.move_to_end(user_id)
+            self._pending -= 1
+            return user_id, job_id, params
+        return None
+
+    # ---------- 执行 ----------
+    async def _worker(self) -> None:
+        while True:
+            async with self._cond:
+                item = self._next()
+                while item is None:
+                    await self._cond.wait()
+                    item = self._next()
+            user_id, job_id, params = item
+            try:
+                # 已被其它进程领取（或已结束）的任务直接跳过
+                if not await db.claim_job(job_id):
+                    continue
+                result = await self.runner(params)
+                await db.update_job(job_id, "done", result_json=json.dumps(result, ensure_ascii=False))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                try:
+                    await db.update_job(job_id, "failed", error=f"无法调用LLM：{e}")
+                except Exception:
+                    # 数据库不可用：任务保持原状态，由巡检在超时后重新入队
+                    pass
+            finally:
+                self._active[user_id] = max(self._active.get(user_id, 1) - 1, 0)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "workers": self.workers,
+            "pending": self._pending,
+            "users_waiting": sum(1 for q in self._queues.values() if q),
+            "max_pending": self.max_pending,
+            "max_per_user": self.max_per_user,
+        }
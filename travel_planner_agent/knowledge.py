@@ -0,0 +1,125 @@
+import os
+import json
+import threading
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional
+
+
+def _index(items: List[Dict], key: str) -> Dict[str, List[Dict]]:
+    # 字段为列表（如 suitable）时，每个取值都建立索引
+    out: Dict[str, List[Dict]] = defaultdict(list)
+    for it in items:
+        val = it.get(key)
+        for v in (val if isinstance(val, list) else [val]):
+            if v is not None:
+                out[str(v)].append(it)
+    return dict(out)
+
+
+class CityData:
+    """单个城市的景点/餐厅/酒店及其索引，加载后只读。"""
+
+    def __init__(self, name: str, raw: Dict):
+        self.name = name
+        self.country: Optional[str] = raw.get("country")
+        self.aliases: List[str] = raw.get("aliases") or []
+        self.attractions: List[Dict] = raw.get("attractions") or []
+        self.restaurants: List[Dict] = raw.get("restaurants") or []
+        self.hotels: List[Dict] = raw.get("hotels") or []
+        self.transport: Dict = raw.get("transport") or {}
+        # 可选的人工路线：routes 为默认每日景点组合，preference_routes 为偏好命中时优先插入的组合
+        self.routes: List[List[str]] = raw.get("routes") or []
+        self.preference_routes: Dict[str, List[str]] = raw.get("preference_routes") or {}
+        self.hotel_preference: Dict[str, List[str]] = raw.get("hotel_preference") or {}
+
+        self.attraction_by_name = {a["name"]: a for a in self.attractions}
+        self.attractions_by_type = _index(self.attractions, "type")
+        self.attractions_by_area = _index(self.attractions, "area")
+        self.attractions_by_suitable = _index(self.attractions, "suitable")
+        self.restaurant_by_name = {r["name"]: r for r in self.restaurants}
+        self.restaurants_by_cuisine = _index(self.restaurants, "cuisine")
+        self.restaurants_by_area = _index(self.restaurants, "area")
+        self.hotels_by_area = _index(self.hotels, "area")
+
+    def attraction(self, name: str) -> Optional[Dict]:
+        return self.attraction_by_name.get(name)
+
+    def attractions_of(self, types: Iterable[str]) -> List[Dict]:
+        out: List[Dict] = []
+        for t in types:
+            out.extend(self.attractions_by_type.get(t, []))
+        return out
+
+    def bundle(self) -> Dict:
+        return {
+            "attractions": self.attractions,
+            "restaurants": self.restaurants,
+            "hotels": self.hotels,
+            "transport": self.transport,
+        }
+
+
+class KnowledgeBase:
+    """静态城市知识库：从 data/cities.json 一次性加载并建立索引。"""
+
+    def __init__(self, raw: Dict):
+        self.version = raw.get("version")
+        self.default_city: str = raw.get("default_city") or ""
+        self.cities: Dict[str, CityData] = {
+            name: CityData(name, c) for name, c in (raw.get("cities") or {}).items()
+        }
+        self._by_alias: Dict[str, CityData] = {}
+        self._by_country: Dict[str, List[CityData]] = defaultdict(list)
+        for c in self.cities.values():
+            self._by_alias[c.name.lower()] = c
+            for a in c.aliases:
+                self._by_alias[a.lower()] = c
+            if c.country:
+                self._by_country[c.country].append(c)
+
+    def city(self, name: Optional[str]) -> Optional[CityData]:
+        if not name:
+            return None
+        return self._by_alias.get(str(name).strip().lower())
+
+    def resolve(self, city: Optional[str], destination: Optional[str] = None) -> Optional[CityData]:
+        """按城市名/别名查找；找不到时若目的地是国家名，取该国第一个城市。"""
+        found = self.city(city) or self.city(destination)
+        if found:
+            return found
+        for key in (destination, city):
+            if key and self._by_country.get(key):
+                return self._by_country[key][0]
+        return None
+
+    def stats(self) -> Dict:
+        return {
+            "version": self.version,
+            "cities": len(self.cities),
+            "attractions": sum(len(c.attractions) for c in self.cities.values()),
+            "restaurants": sum(len(c.restaurants) for c in self.cities.values()),
+            "hotels": sum(len(c.hotels) for c in self.cities.values()),
+        }
+
+
+def _default_path() -> str:
+    return os.path.join(os.path.dirname(__file__), "data", "cities.json")
+
+
+def load_knowledge_base(path: Optional[str] = None) -> KnowledgeBase:
+    with open(path or _default_path(), "r", encoding="utf-8") as f:
+        return KnowledgeBase(json.load(f))
+
+
+_kb: Optional[KnowledgeBase] = None
+_kb_lock = threading.Lock()
+
+
+def get_knowledge_base() -> KnowledgeBase:
+    """进程内单例；路径可用环境变量 CITY_KB_PATH 覆盖。"""
+    global _kb
+    if _kb is None:
+        with _kb_lock:
+            if _kb is None:
+                _kb = load_knowledge_base(os.environ.get("CITY_KB_PATH") or None)
+    return _kb
@@ -2,11 +2,17 @@ import os
 import json
 from typing import Dict, Any, List, Optional
 
+from .cache import build_cache, make_cache_key
+from .llm_client import LLMClientManager
+from .schema import ITINERARY_SCHEMA, SKELETON_SCHEMA, DAYS_SCHEMA, conform, loads_json, schema_hint
+from .tracing import span
+from .usage import get_usage_recorder
+
 
 # DeepSeek（OpenAI兼容）
 _DEEPSEEK_AVAILABLE = True
 try:
-    from openai import OpenAI
+    from openai import OpenAI, AsyncOpenAI
 except Exception:
     _DEEPSEEK_AVAILABLE = False
 
@@ -35,39 +41,231 @@ def _llm_client_ok() -> bool:
 DEFAULT_DEEPSEEK_MODEL = _cfg_get("DEEPSEEK_MODEL", "deepseek-chat")
 DEEPSEEK_API_BASE = _cfg_get("DEEPSEEK_API_BASE", "https://api.deepseek.com")
 
+# 结构化输出方式：json_object（默认，DeepSeek 只支持 JSON 模式，结构以紧凑形式写进系统提示词）
+# / json_schema（response_format 严格 schema）/ tool（强制函数调用，结果取函数参数）
+LLM_SCHEMA_MODE = _cfg_get("LLM_SCHEMA", "json_object")
 
-def _get_client():
+
+_manager = None
+
+
+def _get_manager():
+    # 进程内共享一个客户端管理器：复用 HTTP 连接池，避免每次调用重复 TLS 握手
+    # LLM_MAX_CONNECTIONS / LLM_MAX_KEEPALIVE / LLM_KEEPALIVE_EXPIRY 控制连接池
+    # LLM_MAX_CONCURRENCY / LLM_MAX_QUEUE / LLM_QUEUE_TIMEOUT 控制并发与排队
+    global _manager
     if not _llm_client_ok():
         raise RuntimeError("DeepSeek未配置，请在 config.py 填写 DEEPSEEK_API_KEY 或设置环境变量，并安装 openai 依赖。")
-    return OpenAI(api_key=_cfg_get("DEEPSEEK_API_KEY"), base_url=DEEPSEEK_API_BASE)
+    if _manager is None:
+        _manager = LLMClientManager(
+            api_key=_cfg_get("DEEPSEEK_API_KEY"),
+            base_url=DEEPSEEK_API_BASE,
+            max_connections=int(_cfg_get("LLM_MAX_CONNECTIONS", 20)),
+            max_keepalive=int(_cfg_get("LLM_MAX_KEEPALIVE", 10)),
+            keepalive_expiry=float(_cfg_get("LLM_KEEPALIVE_EXPIRY", 30)),
+            request_timeout=float(_cfg_get("LLM_TIMEOUT", 120)),
+            max_concurrency=int(_cfg_get("LLM_MAX_CONCURRENCY", 8)),
+            max_queue=int(_cfg_get("LLM_MAX_QUEUE", 100)),
+            queue_timeout=float(_cfg_get("LLM_QUEUE_TIMEOUT", 30)),
+        )
+    return _manager
+
+
+def _get_client():
+    return _get_manager().client()
+
+
+def _get_async_client():
+    return _get_manager().async_client()
+
+
+def pool_stats() -> Dict[str, Any]:
+    """连接池与排队指标：并发占用率、排队数、平均/最大排队等待时间。"""
+    if _manager is None:
+        return {}
+    return _manager.stats()
+
+
+# 响应缓存：相同 (model, temperature, messages) 直接复用上次结果
+# LLM_CACHE=memory|sqlite|off，LLM_CACHE_TTL 秒，LLM_CACHE_MAX 条，LLM_CACHE_PATH 仅 sqlite 使用
+_cache = build_cache(
+    _cfg_get("LLM_CACHE", "memory"),
+    ttl_seconds=float(_cfg_get("LLM_CACHE_TTL", 3600)),
+    max_entries=int(_cfg_get("LLM_CACHE_MAX", 512)),
+    path=_cfg_get("LLM_CACHE_PATH"),
+)
 
 
-def ask(messages: List[Dict[str, str]], model: Optional[str] = None, temperature: float = 0.4) -> str:
-    client = _get_client()
+def set_cache(cache) -> None:
+    """替换响应缓存后端（传入 None 关闭缓存）。"""
+    global _cache
+    _cache = cache
+
+
+def cache_stats() -> Dict[str, Any]:
+    if _cache is None:
+        return {"backend": "off", "hits": 0, "misses": 0, "hit_rate": 0.0, "size": 0}
+    return _cache.stats()
+
+
+def _cache_lookup(model: str, temperature: float, messages: List[Dict[str, str]], use_cache: bool,
+                  schema: Optional[Dict] = None):
+    if not use_cache or _cache is None:
+        return None, None
+    # 不同输出方式下同一提示词的返回不同，模式写进缓存键
+    if schema is not None and LLM_SCHEMA_MODE != "json_object":
+        model = f"{model}#{LLM_SCHEMA_MODE}"
+    key = make_cache_key(model, temperature, messages)
+    return key, _cache.get(key)
+
+
+def _cache_store(key: Optional[str], content: Optional[str]) -> None:
+    # 仅缓存可解析的JSON，避免把偶发的坏响应固定下来
+    if key is None or _cache is None or not content:
+        return
+    try:
+        json.loads(content)
+    except Exception:
+        return
+    _cache.set(key, content)
+
+
+def _output_kwargs(schema: Optional[Dict]) -> Dict[str, Any]:
+    """按 LLM_SCHEMA 生成约束输出格式的请求参数；schema 需带 title 作为名称。"""
+    if schema is None or LLM_SCHEMA_MODE == "json_object":
+        return {"response_format": {"type": "json_object"}}
+    name = schema["title"]
+    if LLM_SCHEMA_MODE == "tool":
+        return {
+            "tools": [{"type": "function",
+                       "function": {"name": name, "parameters": schema, "strict": True}}],
+            "tool_choice": {"type": "function", "function": {"name": name}},
+        }
+    return {"response_format": {"type": "json_schema", "json_schema": {"name": name, "schema": schema, "strict": True}}}
+
+
+def _message_text(message) -> str:
+    # tool 模式下结果在函数调用的参数里
+    calls = getattr(message, "tool_calls", None)
+    if calls:
+        return calls[0].function.arguments
+    return message.content
+
+
+def _output_clause(schema: Dict) -> str:
+    """系统提示词中的输出要求：JSON 模式下附上紧凑结构说明，schema 由接口约束时只保留一句。"""
+    if LLM_SCHEMA_MODE == "json_object":
+        return "仅返回如下结构的JSON（?表示可为null），不要输出其它字段或说明：" + schema_hint(schema)
+    return "按给定结构返回，不要输出说明文字。"
+
+
+def ask(messages: List[Dict[str, str]], model: Optional[str] = None, temperature: float = 0.4, use_cache: bool = True,
+        stage: str = "other", schema: Optional[Dict] = None) -> str:
+    """stage 为调用所属的流水线阶段（parse / itinerary / tips 等），用于用量统计；命中缓存不计用量。
+
+    schema 为期望的输出结构，按 LLM_SCHEMA 决定是否交给接口做严格约束。
+    """
     model = model or DEFAULT_DEEPSEEK_MODEL
-    resp = client.chat.completions.create(
-        model=model,
-        temperature=temperature,
-        response_format={"type": "json_object"},
-        messages=messages,
-    )
-    return resp.choices[0].message.content
+    key, cached = _cache_lookup(model, temperature, messages, use_cache, schema)
+    if cached is not None:
+        return cached
+    recorder = get_usage_recorder()
+    recorder.check()
+    manager = _get_manager()
+    with span("llm.ask"), manager.slot():
+        resp = manager.client().chat.completions.create(
+            model=model,
+            temperature=temperature,
+            messages=messages,
+            **_output_kwargs(schema),
+        )
+    recorder.record(stage, model, resp.usage)
+    content = _message_text(resp.choices[0].message)
+    _cache_store(key, content)
+    return content
 
 
-def parse_input_llm(text: str) -> Dict[str, Any]:
+async def ask_async(messages: List[Dict[str, str]], model: Optional[str] = None, temperature: float = 0.4, use_cache: bool = True,
+                    stage: str = "other", schema: Optional[Dict] = None) -> str:
+    """ask 的异步版本，基于共享的 AsyncOpenAI 客户端，不占用线程池。"""
+    model = model or DEFAULT_DEEPSEEK_MODEL
+    key, cached = _cache_lookup(model, temperature, messages, use_cache, schema)
+    if cached is not None:
+        return cached
+    recorder = get_usage_recorder()
+    await recorder.check_async()
+    manager = _get_manager()
+    with span("llm.ask"):
+        async with manager.aslot():
+            resp = await manager.async_client().chat.completions.create(
+                model=model,
+                temperature=temperature,
+                messages=messages,
+                **_output_kwargs(schema),
+            )
+    recorder.record(stage, model, resp.usage)
+    content = _message_text(resp.choices[0].message)
+    _cache_store(key, content)
+    return content
+
+
+async def ask_stream_async(messages: List[Dict[str, str]], model: Optional[str] = None, temperature: float = 0.4,
+                           stage: str = "other", schema: Optional[Dict] = None):
+    """流式调用：逐段产出模型返回的文本；命中缓存时一次性产出完整内容。"""
+    model = model or DEFAULT_DEEPSEEK_MODEL
+    key, cached = _cache_lookup(model, temperature, messages, True, schema)
+    if cached is not None:
+        yield cached
+        return
+    recorder = get_usage_recorder()
+    await recorder.check_async()
+    manager = _get_manager()
+    parts: List[str] = []
+    usage = None
+    # 流式调用的 span 覆盖从排队到最后一段输出（含调用方处理每段的时间）
+    with span("llm.ask_stream"):
+        async with manager.aslot():
+            stream = await manager.async_client().chat.completions.create(
+                model=model,
+                temperature=temperature,
+                messages=messages,
+                stream=True,
+                # 最后一个分片（choices 为空）携带整次调用的 usage
+                stream_options={"include_usage": True},
+                **_output_kwargs(schema),
+            )
+            async for chunk in stream:
+                if getattr(chunk, "usage", None) is not None:
+                    usage = chunk.usage
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta
+                calls = getattr(delta, "tool_calls", None)
+                delta = calls[0].function.arguments if calls else delta.content
+                if delta:
+                    parts.append(delta)
+                    yield delta
+    recorder.record(stage, model, usage)
+    _cache_store(key, "".join(parts))
+
+
+def _parse_messages(text: str) -> List[Dict[str, str]]:
     system = {
         "role": "system",
         "content": (
             "你是专业旅行规划助手。请仅返回JSON对象，字段："
-            "destination, city, days, budget_cny, people{adults,children}, preferences[], special_needs[]."
+            "destination, city, days, budget_cny, people{adults,children}, preferences[], special_needs[], "
+            "extra_info（上述字段未涵盖的其它要求，原话摘录，没有则为空串）。"
             "如无法确定，请给出合理默认值（days=3, budget_cny=null, people={adults:1,children:0}）。"
         ),
     }
     user = {"role": "user", "content": text}
-    content = ask([system, user])
-    try:
-        data = json.loads(content)
-    except Exception:
+    return [system, user]
+
+
+def _normalize_parsed(text: str, content: str) -> Dict[str, Any]:
+    data = loads_json(content)
+    if not isinstance(data, dict):
         data = {}
     days = int(data.get("days") or 3)
     budget_cny = data.get("budget_cny")
@@ -77,7 +275,7 @@ def parse_input_llm(text: str) -> Dict[str, Any]:
     except Exception:
         budget_cny = None
     people = data.get("people") or {"adults": 1, "children": 0}
-    return {
+    parsed = {
         "raw_text": text,
         "destination": data.get("destination"),
         "city": data.get("city"),
@@ -87,35 +285,52 @@ def parse_input_llm(text: str) -> Dict[str, Any]:
         "preferences": data.get("preferences") or [],
         "special_needs": data.get("special_needs") or [],
     }
+    extra = data.get("extra_info")
+    if isinstance(extra, str) and extra.strip():
+        parsed["extra_info"] = extra.strip()
+    return parsed
 
 
-def generate_itinerary_llm(parsed: Dict) -> Dict:
+def parse_input_llm(text: str) -> Dict[str, Any]:
+    return _normalize_parsed(text, ask(_parse_messages(text), stage="parse"))
+
+
+async def parse_input_llm_async(text: str) -> Dict[str, Any]:
+    return _normalize_parsed(text, await ask_async(_parse_messages(text), stage="parse"))
+
+
+# 传给模型的行程参数。raw_text 不再发送：表单模式下它完全由这些字段拼成，文本模式下解析阶段
+# 已把字段之外的要求摘进 extra_info；只有解析不出目的地时才保留原文
+_TRIP_FIELDS = ("destination", "city", "cities", "days", "budget_cny", "people", "preferences", "special_needs", "extra_info")
+
+
+def _compact_trip(parsed: Dict) -> Dict:
+    trip = {k: parsed[k] for k in _TRIP_FIELDS if parsed.get(k) not in (None, "", [], {})}
+    if not (trip.get("destination") or trip.get("city")) and parsed.get("raw_text"):
+        trip["raw_text"] = parsed["raw_text"]
+    return trip
+
+
+def _dumps(obj: Any) -> str:
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
+
+
+def _itinerary_messages(parsed: Dict) -> List[Dict[str, str]]:
     system = {
         "role": "system",
         "content": (
-            "作为专业旅行顾问，根据输入参数生成可执行的多日行程。"
-            "仅返回一个JSON对象，字段：destination, city, hotel{name, area, price_range_cny:[low,high]},"
-            "transport{airport_city:[{route,mode,cost_cny,duration_min}], local:[{card,pass?,benefit,cost_cny?}]},"
-            "days, plan:[{day, theme, morning:{name,type,open_time,ticket_cny,duration_hours,suitable,area},"
-            "afternoon:{...同结构}, evening_meal:{name,cuisine,avg_spend_cny,area,features}, notes}],"
-            "people{adults,children}, preferences[]。时间安排应避免重复与不合理折返，兼顾亲子与偏好。"
+            "作为专业旅行顾问，根据输入参数生成可执行的多日行程，避免重复与不合理折返，兼顾亲子与偏好。"
+            + _output_clause(ITINERARY_SCHEMA)
         ),
     }
-    user = {"role": "user", "content": json.dumps(parsed, ensure_ascii=False)}
-    content = ask([system, user], temperature=0.5)
-    try:
-        data = json.loads(content)
-    except Exception:
-        data = {
-            "destination": parsed.get("destination"),
-            "city": parsed.get("city") or "市区",
-            "hotel": {"name": "中心区酒店", "area": "中心区", "price_range_cny": [500, 900]},
-            "transport": {"airport_city": [], "local": []},
-            "days": parsed.get("days", 3),
-            "plan": [],
-            "people": parsed.get("people", {"adults": 1, "children": 0}),
-            "preferences": parsed.get("preferences", []),
-        }
+    user = {"role": "user", "content": _dumps(_compact_trip(parsed))}
+    return [system, user]
+
+
+def _normalize_itinerary(parsed: Dict, content: str) -> Dict:
+    # 先本地修复小的语法问题再按 schema 纠正；destination/days/people/preferences 以解析结果为准
+    data = loads_json(content)
+    data = conform(data, ITINERARY_SCHEMA) if isinstance(data, dict) else {}
     data.setdefault("destination", parsed.get("destination"))
     data.setdefault("city", parsed.get("city") or "市区")
     data.setdefault("days", parsed.get("days", 3))
@@ -127,18 +342,107 @@ def generate_itinerary_llm(parsed: Dict) -> Dict:
     return data
 
 
+def generate_itinerary_llm(parsed: Dict) -> Dict:
+    content = ask(_itinerary_messages(parsed), temperature=0.5, stage="itinerary", schema=ITINERARY_SCHEMA)
+    return _normalize_itinerary(parsed, content)
+
+
+async def generate_itinerary_llm_async(parsed: Dict) -> Dict:
+    content = await ask_async(_itinerary_messages(parsed), temperature=0.5, stage="itinerary", schema=ITINERARY_SCHEMA)
+    return _normalize_itinerary(parsed, content)
+
+
+def _skeleton_messages(parsed: Dict) -> List[Dict[str, str]]:
+    system = {
+        "role": "system",
+        "content": (
+            "作为专业旅行顾问，先为多日行程做整体骨架规划，不展开具体景点。"
+            "每天一个主题与主要游览区域，相邻天的区域应顺路，避免重复。"
+            + _output_clause(SKELETON_SCHEMA)
+        ),
+    }
+    user = {"role": "user", "content": _dumps(_compact_trip(parsed))}
+    return [system, user]
+
+
+def _days_messages(parsed: Dict, skeleton: Dict, day_range: List[Dict]) -> List[Dict[str, str]]:
+    system = {
+        "role": "system",
+        "content": (
+            "作为专业旅行顾问，按给定骨架为指定的几天展开详细行程，只输出这些天。"
+            "景点应位于当天骨架区域内，兼顾亲子与偏好。"
+            + _output_clause(DAYS_SCHEMA)
+        ),
+    }
+    payload = {
+        "trip": _compact_trip(parsed),
+        "city": skeleton.get("city"),
+        "hotel": skeleton.get("hotel"),
+        "days_to_plan": day_range,
+        "full_skeleton": skeleton.get("skeleton") or [],
+    }
+    user = {"role": "user", "content": _dumps(payload)}
+    return [system, user]
+
+
+def _normalize_skeleton(parsed: Dict, content: str) -> Dict:
+    data = loads_json(content)
+    data = conform(data, SKELETON_SCHEMA) if isinstance(data, dict) else {}
+    days = int(parsed.get("days") or 3)
+    by_day = {}
+    for item in data.get("skeleton") or []:
+        if "day" in item:
+            by_day[item["day"]] = item
+    data["skeleton"] = [
+        {"day": d, "theme": (by_day.get(d) or {}).get("theme") or "城市精选", "area": (by_day.get(d) or {}).get("area") or ""}
+        for d in range(1, days + 1)
+    ]
+    data.setdefault("destination", parsed.get("destination"))
+    data.setdefault("city", parsed.get("city") or "市区")
+    data.setdefault("hotel", {"name": "中心区酒店", "area": "中心区", "price_range_cny": [500, 900]})
+    data.setdefault("transport", {"airport_city": [], "local": []})
+    return data
+
+
+def _normalize_days(content: str) -> List[Dict]:
+    data = loads_json(content)
+    if not isinstance(data, dict):
+        return []
+    return conform(data, DAYS_SCHEMA).get("plan") or []
+
+
+def generate_skeleton_llm(parsed: Dict) -> Dict:
+    content = ask(_skeleton_messages(parsed), temperature=0.5, stage="skeleton", schema=SKELETON_SCHEMA)
+    return _normalize_skeleton(parsed, content)
+
+
+async def generate_skeleton_llm_async(parsed: Dict) -> Dict:
+    content = await ask_async(_skeleton_messages(parsed), temperature=0.5, stage="skeleton", schema=SKELETON_SCHEMA)
+    return _normalize_skeleton(parsed, content)
+
+
+def generate_days_llm(parsed: Dict, skeleton: Dict, day_range: List[Dict]) -> List[Dict]:
+    content = ask(_days_messages(parsed, skeleton, day_range), temperature=0.5, stage="days", schema=DAYS_SCHEMA)
+    return _normalize_days(content)
+
+
+async def generate_days_llm_async(parsed: Dict, skeleton: Dict, day_range: List[Dict]) -> List[Dict]:
+    content = await ask_async(_days_messages(parsed, skeleton, day_range), temperature=0.5, stage="days",
+                              schema=DAYS_SCHEMA)
+    return _normalize_days(content)
+
+
 def generate_tips_llm(parsed: Dict) -> Dict:
     system = {
         "role": "system",
         "content": "为目的地生成天气提示、交通卡建议与注意事项，仅返回JSON: {weather_tip, transit_tip[], notes[]}。",
     }
-    user = {"role": "user", "content": json.dumps(parsed, ensure_ascii=False)}
-    content = ask([system, user])
-    try:
-        return json.loads(content)
-    except Exception:
-        return {
-            "weather_tip": "目的地气候随季节变化，请携带合适衣物与防晒/保暖用品。",
-            "transit_tip": ["办理当地交通卡更便捷", "关注短期地铁票是否更划算"],
-            "notes": ["热门景点需预约", "亲子出行注意节奏与安全"],
-        }
+    user = {"role": "user", "content": _dumps(_compact_trip(parsed))}
+    data = loads_json(ask([system, user], stage="tips"))
+    if isinstance(data, dict):
+        return data
+    return {
+        "weather_tip": "目的地气候随季节变化，请携带合适衣物与防晒/保暖用品。",
+        "transit_tip": ["办理当地交通卡更便捷", "关注短期地铁票是否更划算"],
+        "notes": ["热门景点需预约", "亲子出行注意节奏与安全"],
+    }
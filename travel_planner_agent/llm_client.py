@@ -0,0 +1,268 @@
+import time
+import asyncio
+import threading
+from collections import deque
+from contextlib import contextmanager, asynccontextmanager
+from typing import Dict, Optional
+
+try:
+    import httpx
+except Exception:
+    httpx = None
+
+try:
+    from openai import OpenAI, AsyncOpenAI
+except Exception:
+    OpenAI = AsyncOpenAI = None
+
+
+class LLMBusyError(RuntimeError):
+    """排队已满或等待超过截止时间时抛出。"""
+
+
+class _Waiter:
+    __slots__ = ("granted", "event", "loop", "future")
+
+    def __init__(self, event=None, loop=None, future=None):
+        self.granted = False
+        self.event = event
+        self.loop = loop
+        self.future = future
+
+    def wake(self) -> None:
+        if self.event is not None:
+            self.event.set()
+        else:
+            self.loop.call_soon_threadsafe(_resolve, self.future)
+
+
+def _resolve(future) -> None:
+    if not future.done():
+        future.set_result(True)
+
+
+class _Admission:
+    """同步线程与各事件循环共用的并发名额（先到先得）。
+
+    释放名额时直接移交给队首的等待者：线程用 Event 唤醒，协程经 call_soon_threadsafe 唤醒，
+    等待中的协程不占用线程，也不绑定某个事件循环。
+    """
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self._lock = threading.Lock()
+        self._used = 0
+        self._waiters: "deque[_Waiter]" = deque()
+
+    def try_acquire(self) -> bool:
+        with self._lock:
+            if self._used < self.limit and not self._waiters:
+                self._used += 1
+                return True
+            return False
+
+    def _enqueue(self, waiter: _Waiter) -> bool:
+        # 入队前再检查一次，期间可能已有名额释放
+        with self._lock:
+            if self._used < self.limit and not self._waiters:
+                self._used += 1
+                return True
+            self._waiters.append(waiter)
+            return False
+
+    def _give_up(self, waiter: _Waiter) -> bool:
+        """放弃等待；返回 True 表示名额已在此之前移交给该等待者。"""
+        with self._lock:
+            if waiter.granted:
+                return True
+            self._waiters.remove(waiter)
+            return False
+
+    def acquire(self, timeout: float) -> bool:
+        waiter = _Waiter(event=threading.Event())
+        if self._enqueue(waiter):
+            return True
+        waiter.event.wait(timeout)
+        return self._give_up(waiter)
+
+    async def acquire_async(self, timeout: float) -> bool:
+        loop = asyncio.get_running_loop()
+        waiter = _Waiter(loop=loop, future=loop.create_future())
+        if self._enqueue(waiter):
+            return True
+        try:
+            await asyncio.wait_for(waiter.future, timeout=timeout)
+        except asyncio.TimeoutError:
+            return self._give_up(waiter)
+        except BaseException:
+            # 被取消：已拿到的名额交还给下一个等待者
+            if self._give_up(waiter):
+                self.release()
+            raise
+        return True
+
+    def release(self) -> None:
+        with self._lock:
+            if self._waiters:
+                waiter = self._waiters.popleft()
+                waiter.granted = True
+            else:
+                self._used -= 1
+                return
+        waiter.wake()
+
+
+class LLMClientManager:
+    """进程级 LLM 客户端管理：共享连接池 + 并发上限 + 排队截止时间。
+
+    同步与异步路径各自持有一个客户端（底层 httpx 连接池复用 keep-alive 连接），
+    两条路径共用同一组 max_concurrency 个名额；超过 max_queue 个请求排队时直接拒绝。
+    """
+
+    def __init__(
+        self,
+        api_key: str,
+        base_url: str,
+        max_connections: int = 20,
+        max_keepalive: int = 10,
+        keepalive_expiry: float = 30.0,
+        request_timeout: float = 120.0,
+        max_concurrency: int = 8,
+        max_queue: int = 100,
+        queue_timeout: float = 30.0,
+    ):
+        self.api_key = api_key
+        self.base_url = base_url
+        self.max_connections = max_connections
+        self.max_keepalive = max_keepalive
+        self.keepalive_expiry = keepalive_expiry
+        self.request_timeout = request_timeout
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+
+        self._client = None
+        self._async_client = None
+        self._init_lock = threading.Lock()
+        self._slots = _Admission(max_concurrency)
+
+        self._stats_lock = threading.Lock()
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.waiting = 0
+        self.total = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    # ---------- 客户端 ----------
+    def _limits(self):
+        return httpx.Limits(
+            max_connections=self.max_connections,
+            max_keepalive_connections=self.max_keepalive,
+            keepalive_expiry=self.keepalive_expiry,
+        )
+
+    def client(self):
+        if self._client is None:
+            with self._init_lock:
+                if self._client is None:
+                    kwargs = {}
+                    if httpx is not None:
+                        kwargs["http_client"] = httpx.Client(limits=self._limits(), timeout=self.request_timeout)
+                    self._client = OpenAI(api_key=self.api_key, base_url=self.base_url, **kwargs)
+        return self._client
+
+    def async_client(self):
+        if self._async_client is None:
+            with self._init_lock:
+                if self._async_client is None:
+                    kwargs = {}
+                    if httpx is not None:
+                        kwargs["http_client"] = httpx.AsyncClient(limits=self._limits(), timeout=self.request_timeout)
+                    self._async_client = AsyncOpenAI(api_key=self.api_key, base_url=self.base_url, **kwargs)
+        return self._async_client
+
+    # ---------- 并发控制 ----------
+    def _enter_queue(self) -> None:
+        with self._stats_lock:
+            if self.waiting >= self.max_queue:
+                self.rejected += 1
+                raise LLMBusyError(f"LLM请求排队已满（{self.max_queue}），请稍后重试")
+            self.waiting += 1
+
+    def _leave_queue(self, timed_out: bool = False) -> None:
+        with self._stats_lock:
+            self.waiting -= 1
+            if timed_out:
+                self.timeouts += 1
+
+    def _acquired(self, waited: float) -> None:
+        with self._stats_lock:
+            self.in_flight += 1
+            self.total += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+            self.wait_total += waited
+            self.wait_max = max(self.wait_max, waited)
+
+    def _release(self) -> None:
+        with self._stats_lock:
+            self.in_flight -= 1
+
+    @contextmanager
+    def slot(self, deadline: Optional[float] = None):
+        """同步获取一个并发名额；deadline 为最长排队秒数，默认 queue_timeout。"""
+        timeout = self.queue_timeout if deadline is None else deadline
+        started = time.perf_counter()
+        # 有空闲名额时直接进入，不计入排队
+        if not self._slots.try_acquire():
+            self._enter_queue()
+            ok = self._slots.acquire(timeout)
+            self._leave_queue(timed_out=not ok)
+            if not ok:
+                raise LLMBusyError(f"LLM请求排队超过 {timeout:.1f}s，已放弃")
+        self._acquired(time.perf_counter() - started)
+        try:
+            yield
+        finally:
+            self._release()
+            self._slots.release()
+
+    @asynccontextmanager
+    async def aslot(self, deadline: Optional[float] = None):
+        """slot 的异步版本，与同步路径共用名额；排队时不占用线程。"""
+        timeout = self.queue_timeout if deadline is None else deadline
+        started = time.perf_counter()
+        if not self._slots.try_acquire():
+            self._enter_queue()
+            timed_out = False
+            try:
+                timed_out = not await self._slots.acquire_async(timeout)
+            finally:
+                # 排队中被取消（如 SSE/WebSocket 客户端断开）同样要退出队列，否则 waiting 只增不减
+                self._leave_queue(timed_out=timed_out)
+            if timed_out:
+                raise LLMBusyError(f"LLM请求排队超过 {timeout:.1f}s，已放弃")
+        self._acquired(time.perf_counter() - started)
+        try:
+            yield
+        finally:
+            self._release()
+            self._slots.release()
+
+    def stats(self) -> Dict:
+        with self._stats_lock:
+            return {
+                "max_concurrency": self.max_concurrency,
+                "max_connections": self.max_connections,
+                "in_flight": self.in_flight,
+                "peak_in_flight": self.peak_in_flight,
+                "utilization": round(self.in_flight / self.max_concurrency, 4) if self.max_concurrency else 0.0,
+                "waiting": self.waiting,
+                "total": self.total,
+                "rejected": self.rejected,
+                "timeouts": self.timeouts,
+                "queue_wait_avg_ms": round(self.wait_total / self.total * 1000, 2) if self.total else 0.0,
+                "queue_wait_max_ms": round(self.wait_max * 1000, 2),
+            }
@@ -0,0 +1,384 @@
+import re
+import math
+from typing import Dict, List, Optional, Sequence, Tuple
+
+try:
+    import numpy as np
+except Exception:
+    np = None
+
+
+# 市内平均通行速度（公里/小时）与每段固定开销（小时，含步行、候车）
+DEFAULT_SPEED_KMH = 20.0
+LEG_OVERHEAD_H = 0.25
+# 补位时每天最多考察的剩余候选数（按优先级），限制距离矩阵规模
+REFILL_CANDIDATES = 20
+EARTH_RADIUS_KM = 6371.0088
+
+_HOURS_RE = re.compile(r"(\d{1,2})[:：](\d{2})\s*[-~—至]\s*(\d{1,2})[:：](\d{2})")
+
+
+def parse_open_hours(open_time: Optional[str], default: Tuple[float, float] = (8.0, 20.0)) -> Tuple[float, float]:
+    """把 "09:30-17:00(周一闭馆)" 之类的描述解析为 (开门, 关门) 小时数；"全天" 视为 0-24。"""
+    text = str(open_time or "")
+    if "全天" in text or "24小时" in text:
+        return 0.0, 24.0
+    m = _HOURS_RE.search(text)
+    if not m:
+        return default
+    h1, m1, h2, m2 = (int(x) for x in m.groups())
+    start, end = h1 + m1 / 60, h2 + m2 / 60
+    if end <= start:
+        end += 24
+    return start, end
+
+
+def _coords(p: Dict) -> Optional[Tuple[float, float]]:
+    try:
+        return float(p["lng"]), float(p["lat"])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def haversine_km(a: Tuple[float, float], b: Tuple[float, float]) -> float:
+    """两点 (lng, lat) 间的球面距离（公里）。"""
+    lng1, lat1, lng2, lat2 = map(math.radians, (a[0], a[1], b[0], b[1]))
+    h = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(h)))
+
+
+def distance_matrix(points: Sequence[Tuple[float, float]]):
+    """points 为 (lng, lat) 列表，返回两两球面距离（公里）。有 NumPy 时向量化计算。"""
+    n = len(points)
+    if np is not None:
+        arr = np.radians(np.asarray(points, dtype=float).reshape(n, 2))
+        lng, lat = arr[:, 0][:, None], arr[:, 1][:, None]
+        a = np.sin((lat.T - lat) / 2) ** 2 + np.cos(lat) * np.cos(lat.T) * np.sin((lng.T - lng) / 2) ** 2
+        return (2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))).tolist()
+    rad = [(math.radians(x), math.radians(y)) for x, y in points]
+    cos_lat = [math.cos(y) for _, y in rad]
+    out = [[0.0] * n for _ in range(n)]
+    for i in range(n):
+        lng1, lat1 = rad[i]
+        row = out[i]
+        for j in range(i + 1, n):
+            lng2, lat2 = rad[j]
+            a = math.sin((lat2 - lat1) / 2) ** 2 + cos_lat[i] * cos_lat[j] * math.sin((lng2 - lng1) / 2) ** 2
+            d = 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+            row[j] = d
+            out[j][i] = d
+    return out
+
+
+class _Day:
+    """单日路线求解：带时间窗的最近邻构造 + 2-opt / or-opt 改进。
+
+    节点 0 为起点（酒店），其余为景点；dist 为公里矩阵。
+    """
+
+    def __init__(self, pois: List[Dict], start: Optional[Tuple[float, float]], speed_kmh: float,
+                 day_start: float, day_end: float):
+        self.pois = pois
+        pts = [_coords(p) for p in pois]
+        origin = start or (
+            sum(x for x, _ in pts) / len(pts),
+            sum(y for _, y in pts) / len(pts),
+        )
+        self.dist = distance_matrix([origin] + pts)
+        self.speed = speed_kmh
+        self.day_start = day_start
+        self.day_end = day_end
+        self.windows = [(0.0, 24.0)] + [parse_open_hours(p.get("open_time")) for p in pois]
+        self.service = [0.0] + [float(p.get("duration_hours") or 2) for p in pois]
+
+    def travel(self, i: int, j: int) -> float:
+        return self.dist[i][j] / self.speed + LEG_OVERHEAD_H
+
+    def schedule(self, route: List[int], strict: bool = True) -> Optional[List[Tuple[float, float]]]:
+        """按顺序排时间；任一景点无法在关门前游玩完或超出当日结束时间则返回 None。
+
+        strict=False 时不做校验，总是返回时间表（用于忽略时间窗补入的景点）。
+        """
+        t = self.day_start
+        prev = 0
+        times = []
+        for node in route:
+            t += self.travel(prev, node)
+            opens, closes = self.windows[node]
+            t = max(t, opens)
+            leave = t + self.service[node]
+            if strict and (leave > closes or leave > self.day_end):
+                return None
+            times.append((t, leave))
+            t = leave
+            prev = node
+        return times
+
+    def length(self, route: List[int]) -> float:
+        total, prev = 0.0, 0
+        for node in route:
+            total += self.dist[prev][node]
+            prev = node
+        return total
+
+    def nearest_neighbour(self, candidates: List[int], max_stops: Optional[int]) -> List[int]:
+        """从起点出发每次走向最近的、仍能在时间窗内游玩完的景点。"""
+        route: List[int] = []
+        left = set(candidates)
+        prev, t = 0, self.day_start
+        while left and (max_stops is None or len(route) < max_stops):
+            best, best_leave = None, None
+            for j in sorted(left, key=lambda j: (self.dist[prev][j], j)):
+                opens, closes = self.windows[j]
+                leave = max(t + self.travel(prev, j), opens) + self.service[j]
+                if leave <= closes and leave <= self.day_end:
+                    best, best_leave = j, leave
+                    break
+            if best is None:
+                break
+            route.append(best)
+            left.discard(best)
+            prev, t = best, best_leave
+        return route
+
+    def improve(self, route: List[int], max_rounds: int = 20) -> List[int]:
+        d = self.dist
+        n = len(route)
+        for _ in range(max_rounds):
+            improved = False
+            # 2-opt：翻转 route[i..k]，先用 O(1) 的距离差筛选，再校验时间窗
+            for i in range(n - 1):
+                a = route[i - 1] if i > 0 else 0
+                b = route[i]
+                for k in range(i + 1, n):
+                    c = route[k]
+                    e = route[k + 1] if k + 1 < n else None
+                    before = d[a][b] + (d[c][e] if e is not None else 0.0)
+                    after = d[a][c] + (d[b][e] if e is not None else 0.0)
+                    if after < before - 1e-9:
+                        cand = route[:i] + route[i:k + 1][::-1] + route[k + 1:]
+                        if self.schedule(cand) is not None:
+                            route = cand
+                            b = route[i]
+                            improved = True
+            # or-opt：把长度 1~3 的片段（可反向）移到别处，同样先算距离差
+            for seg in (1, 2, 3):
+                i = 0
+                while i + seg <= n:
+                    moved = self._or_move(route, i, seg)
+                    if moved is not None:
+                        route = moved
+                        improved = True
+                    i += 1
+            if not improved:
+                break
+        return route
+
+    def _or_move(self, route: List[int], i: int, seg: int) -> Optional[List[int]]:
+        d = self.dist
+        n = len(route)
+        a = route[i - 1] if i > 0 else 0
+        first, last = route[i], route[i + seg - 1]
+        e = route[i + seg] if i + seg < n else None
+        # 取出片段后路线缩短的距离
+        gain = d[a][first] + (d[last][e] - d[a][e] if e is not None else 0.0)
+        rest = route[:i] + route[i + seg:]
+        piece = route[i:i + seg]
+        for j in range(len(rest) + 1):
+            if j == i:
+                continue
+            p = rest[j - 1] if j > 0 else 0
+            q = rest[j] if j < len(rest) else None
+            base = d[p][q] if q is not None else 0.0
+            for seq in ((piece, piece[::-1]) if seg > 1 else (piece,)):
+                cost = d[p][seq[0]] + (d[seq[-1]][q] if q is not None else 0.0) - base
+                if cost < gain - 1e-9:
+                    cand = rest[:j] + seq + rest[j:]
+                    if self.schedule(cand) is not None:
+                        return cand
+        return None
+
+
+def _refill(day_pois: List[Dict], route: List[int], pool: List[Dict], max_stops: Optional[int],
+            start: Tuple[float, float], speed_kmh: float, day_start: float, day_end: float):
+    """从 pool（按优先级排列，选中的会被移除）给景点数不足的一天补景点，返回 (景点, 路线, 求解器)。
+
+    依次尝试优先级最高的候选，取满足时间窗、增加里程最少的插入位置；设定了 max_stops 而
+    没有候选能满足时间窗时，忽略时间窗把优先级最高的候选插到里程最少的位置，保证时段不留空。
+    """
+    pois = day_pois + pool[:REFILL_CANDIDATES]
+    solver = _Day(pois, start, speed_kmh, day_start, day_end)
+    free = list(range(len(day_pois) + 1, len(pois) + 1))
+    while free and (max_stops is None or len(route) < max_stops):
+        pick = None
+        for node in free:
+            options = [route[:i] + [node] + route[i:] for i in range(len(route) + 1)]
+            feasible = [r for r in options if solver.schedule(r) is not None]
+            if feasible:
+                pick = node, min(feasible, key=solver.length)
+                break
+        if pick is None:
+            if max_stops is None:
+                break
+            node = free[0]
+            pick = node, min((route[:i] + [node] + route[i:] for i in range(len(route) + 1)), key=solver.length)
+        node, route = pick
+        free.remove(node)
+        chosen = pois[node - 1]
+        pool[:] = [p for p in pool if p is not chosen]
+    return pois, route, solver
+
+
+def _sweep_clusters(pois: List[Dict], days: int, origin: Tuple[float, float], balance_by_count: bool) -> List[List[int]]:
+    """按区域归组后绕起点做极角扫描切分为 days 组：同一区域尽量同一天，相邻方向的区域排在一起。"""
+    units: Dict[str, List[int]] = {}
+    for idx, p in enumerate(pois):
+        units.setdefault(str(p.get("area") or f"#{idx}"), []).append(idx)
+
+    def angle(members: List[int]) -> float:
+        x = sum(_coords(pois[i])[0] for i in members) / len(members) - origin[0]
+        y = sum(_coords(pois[i])[1] for i in members) / len(members) - origin[1]
+        return math.atan2(y, x)
+
+    ordered: List[int] = []
+    for members in sorted(units.values(), key=angle):
+        ordered.extend(members)
+
+    weight = [1.0 if balance_by_count else float(pois[i].get("duration_hours") or 2) for i in ordered]
+    target = sum(weight) / days
+    clusters: List[List[int]] = [[] for _ in range(days)]
+    acc, day = 0.0, 0
+    for i, w in zip(ordered, weight):
+        if acc + w / 2 > target * (day + 1) and day < days - 1:
+            day += 1
+        clusters[day].append(i)
+        acc += w
+    return clusters
+
+
+def optimize_days(
+    pois: List[Dict],
+    days: int,
+    start: Optional[Tuple[float, float]] = None,
+    max_stops: Optional[int] = None,
+    day_start: float = 9.0,
+    day_end: float = 20.0,
+    speed_kmh: float = DEFAULT_SPEED_KMH,
+) -> Dict:
+    """把候选景点分配到 days 天并排出每日顺序，尽量减少往返距离。
+
+    pois 按优先级排列，需带 lng/lat，可带 open_time、duration_hours、area；
+    max_stops 为每天最多景点数（如上午/下午两个时段时为 2），超出部分按优先级舍弃；
+    分组求解后仍有空余的天会按优先级从剩余候选中补位（设定 max_stops 时必要时忽略时间窗补满）。
+    返回 {"days": [[{poi, arrive, leave, travel_km}, ...], ...], "dropped": [...], "distance_km": 总里程}。
+    """
+    located = [p for p in pois if _coords(p)]
+    dropped = [p for p in pois if not _coords(p)]
+    days = max(1, int(days))
+    if max_stops:
+        dropped.extend(located[days * max_stops:])
+        located = located[:days * max_stops]
+    if not located:
+        return {"days": [[] for _ in range(days)], "dropped": dropped, "distance_km": 0.0}
+
+    origin = start or (
+        sum(_coords(p)[0] for p in located) / len(located),
+        sum(_coords(p)[1] for p in located) / len(located),
+    )
+    # 候选不够排满所有时段时只分到能排满的天数，其余天留空（与人工路线一致），避免每天都只排一个
+    active = min(days, -(-len(located) // max_stops)) if max_stops else days
+    clusters = _sweep_clusters(located, active, origin, balance_by_count=bool(max_stops))
+    clusters += [[] for _ in range(days - active)]
+
+    solved = []
+    pool: List[Dict] = []
+    for members in clusters:
+        day_pois = [located[i] for i in members]
+        if not day_pois:
+            solved.append(([], [], None))
+            continue
+        solver = _Day(day_pois, start or origin, speed_kmh, day_start, day_end)
+        route = solver.nearest_neighbour(list(range(1, len(day_pois) + 1)), max_stops)
+        route = solver.improve(route)
+        chosen = set(route)
+        pool.extend(day_pois[j - 1] for j in range(1, len(day_pois) + 1) if j not in chosen)
+        solved.append((day_pois, route, solver))
+
+    # 分组时没排进去的、以及因每日上限截掉的候选，按原优先级给仍有空余的天补位
+    rank = {id(p): i for i, p in enumerate(pois)}
+    pool.extend(p for p in dropped if _coords(p))
+    dropped = [p for p in dropped if not _coords(p)]
+    pool.sort(key=lambda p: rank[id(p)])
+    for k, (day_pois, route, solver) in enumerate(solved):
+        if pool and (max_stops is None or len(route) < max_stops):
+            solved[k] = _refill(day_pois, route, pool, max_stops, start or origin, speed_kmh, day_start, day_end)
+    dropped.extend(pool)
+
+    out_days: List[List[Dict]] = []
+    total_km = 0.0
+    for day_pois, route, solver in solved:
+        if not route:
+            out_days.append([])
+            continue
+        times = solver.schedule(route, strict=False)
+        legs, prev = [], 0
+        for node, (arrive, leave) in zip(route, times):
+            legs.append({
+                "poi": day_pois[node - 1],
+                "arrive": _fmt_hour(arrive),
+                "leave": _fmt_hour(leave),
+                "travel_km": round(solver.dist[prev][node], 2),
+            })
+            prev = node
+        total_km += solver.length(route)
+        out_days.append(legs)
+    return {"days": out_days, "dropped": dropped, "distance_km": round(total_km, 2)}
+
+
+def _fmt_hour(h: float) -> str:
+    minutes = int(round(h * 60))
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"
+
+
+def optimize_itinerary(itinerary: Dict, coords: Optional[Dict[str, Tuple[float, float]]] = None,
+                       regroup: bool = False) -> Dict:
+    """对行程（plan 中每天 morning/afternoon）做路线后处理，原地修改并返回。
+
+    - 景点缺少坐标时用 coords（名称 -> (lng, lat)）补全，仍缺坐标的景点保持原位；
+    - regroup=False：只调整每天上午/下午的先后顺序（保留 LLM 给出的每日主题）；
+    - regroup=True：跨天重新分组，适合静态兜底或无主题的行程。
+    起点为酒店坐标（若有）。
+    """
+    coords = coords or {}
+    plan = itinerary.get("plan") or []
+    hotel = itinerary.get("hotel") if isinstance(itinerary.get("hotel"), dict) else {}
+    start = _coords(hotel) or coords.get(hotel.get("name") or "")
+
+    def locate(node):
+        if isinstance(node, dict) and not _coords(node) and node.get("name") in coords:
+            node["lng"], node["lat"] = coords[node["name"]]
+        return node
+
+    for d in plan:
+        locate(d.get("morning"))
+        locate(d.get("afternoon"))
+
+    if regroup:
+        nodes = [n for d in plan for n in (d.get("morning"), d.get("afternoon")) if isinstance(n, dict)]
+        if nodes and all(_coords(n) for n in nodes):
+            result = optimize_days(nodes, len(plan), start=start, max_stops=2)
+            for d, legs in zip(plan, result["days"]):
+                d["morning"] = legs[0]["poi"] if len(legs) > 0 else None
+                d["afternoon"] = legs[1]["poi"] if len(legs) > 1 else None
+            return itinerary
+
+    for d in plan:
+        pair = [n for n in (d.get("morning"), d.get("afternoon")) if isinstance(n, dict)]
+        if len(pair) == 2 and all(_coords(n) for n in pair):
+            solver = _Day(pair, start, DEFAULT_SPEED_KMH, 9.0, 20.0)
+            best = min(
+                ([1, 2], [2, 1]),
+                key=lambda r: (solver.schedule(r) is None, solver.length(r)),
+            )
+            d["morning"], d["afternoon"] = pair[best[0] - 1], pair[best[1] - 1]
+    return itinerary
@@ -1,5 +1,46 @@
+import io
+import csv
 import json
-from typing import Dict
+from typing import Dict, Iterable, Iterator, List
+
+
+def _with_coords(item: Dict, node: Dict) -> Dict:
+    # 有坐标时附带 [lng, lat]，地图与路线服务直接使用，无需前端再做地理编码
+    if node.get("lng") is not None and node.get("lat") is not None:
+        item["坐标"] = [node["lng"], node["lat"]]
+    return item
+
+
+def build_detail_day(d: Dict) -> Dict:
+    """把行程中的某一天转换为“详细日程”中的展示结构。"""
+    items = []
+    for part_key in ["morning", "afternoon"]:
+        node = d.get(part_key)
+        if node:
+            items.append(_with_coords({
+                "地点": node.get("name"),
+                "类型": node.get("type"),
+                "开放时间": node.get("open_time"),
+                "门票(¥)": node.get("ticket_cny"),
+                "游玩时长(h)": node.get("duration_hours"),
+                "适合人群": node.get("suitable"),
+                "区域": node.get("area"),
+            }, node))
+    if d.get("evening_meal"):
+        meal = d["evening_meal"]
+        items.append(_with_coords({
+            "餐厅": meal.get("name"),
+            "美食类型": meal.get("cuisine"),
+            "人均(¥)": meal.get("avg_spend_cny"),
+            "位置": meal.get("area"),
+            "特色": meal.get("features"),
+        }, meal))
+    return {
+        "日期": f"第{d.get('day')}天",
+        "主题": d.get("theme"),
+        "安排": items,
+        "备注": d.get("notes"),
+    }
 
 
 def build_structured_output(parsed: Dict, itinerary: Dict, budget_plan: Dict, tips: Dict, tracker) -> Dict:
@@ -15,37 +56,10 @@ def build_structured_output(parsed: Dict, itinerary: Dict, budget_plan: Dict, ti
     detail_days = []
     aggregated_daily_notes = []
     for d in itinerary.get("plan", []):
-        items = []
-        for part_key in ["morning", "afternoon"]:
-            node = d.get(part_key)
-            if node:
-                items.append({
-                    "地点": node.get("name"),
-                    "类型": node.get("type"),
-                    "开放时间": node.get("open_time"),
-                    "门票(¥)": node.get("ticket_cny"),
-                    "游玩时长(h)": node.get("duration_hours"),
-                    "适合人群": node.get("suitable"),
-                    "区域": node.get("area"),
-                })
-        if d.get("evening_meal"):
-            meal = d["evening_meal"]
-            items.append({
-                "餐厅": meal.get("name"),
-                "美食类型": meal.get("cuisine"),
-                "人均(¥)": meal.get("avg_spend_cny"),
-                "位置": meal.get("area"),
-                "特色": meal.get("features"),
-            })
         note_text = d.get("notes")
         if note_text:
             aggregated_daily_notes.append(str(note_text))
-        detail_days.append({
-            "日期": f"第{d.get('day')}天",
-            "主题": d.get("theme"),
-            "安排": items,
-            "备注": d.get("notes"),
-        })
+        detail_days.append(build_detail_day(d))
 
     fee_table = {
         "预算分配": budget_plan.get("allocations"),
@@ -82,22 +96,73 @@ def build_structured_output(parsed: Dict, itinerary: Dict, budget_plan: Dict, ti
     }
 
 
-def export_json(data: Dict, path: str):
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
-
-
-def export_csv(data: Dict, path: str):
-    # 简易 CSV 导出：导出预算表与概览关键字段
-    import csv
-    with open(path, "w", newline="", encoding="utf-8") as f:
-        w = csv.writer(f)
-        overview = data.get("行程概览", {})
-        w.writerow(["目的地", overview.get("目的地"), "城市", overview.get("城市")])
-        w.writerow(["天数", overview.get("天数"), "总预算", overview.get("总预算")])
-        w.writerow(["人数", overview.get("人数")])
-        w.writerow(["主题", ",".join(overview.get("旅行主题") or [])])
-        w.writerow([])
-        w.writerow(["预算分配"])
-        for k, v in (data.get("费用明细表", {}).get("预算分配", {}) or {}).items():
-            w.writerow([k, v])
\ No newline at end of file
+def iter_json(data: Dict, chunk_size: int = 16384) -> Iterator[str]:
+    """逐段产出 JSON 文本，可直接交给 StreamingResponse；chunk_size 为合并后的每段字符数。"""
+    encoder = json.JSONEncoder(ensure_ascii=False, indent=2)
+    buf: List[str] = []
+    size = 0
+    for piece in encoder.iterencode(data):
+        buf.append(piece)
+        size += len(piece)
+        if size >= chunk_size:
+            yield "".join(buf)
+            buf, size = [], 0
+    if buf:
+        yield "".join(buf)
+
+
+def _csv_rows(data: Dict) -> Iterator[List]:
+    overview = data.get("行程概览", {}) or {}
+    people = overview.get("人数") or {}
+    fee = data.get("费用明细表", {}) or {}
+    yield ["目的地", overview.get("目的地"), "城市", overview.get("城市")]
+    yield ["天数", overview.get("天数"), "总预算", overview.get("总预算")]
+    yield ["人数", f"成人{people.get('adults', 0)}，儿童{people.get('children', 0)}" if isinstance(people, dict) else people]
+    yield ["主题", ",".join(overview.get("旅行主题") or [])]
+    for title in ("预算分配", "估算费用", "建议档位"):
+        yield []
+        yield [title]
+        for k, v in (fee.get(title) or {}).items():
+            yield [k, v]
+    yield []
+    yield ["每日行程"]
+    yield ["日期", "主题", "类别", "名称", "类型/菜系", "开放时间", "门票/人均(¥)", "游玩时长(h)", "区域", "备注"]
+    for day in data.get("详细日程") or []:
+        items = day.get("安排") or []
+        if not items:
+            yield [day.get("日期"), day.get("主题"), "", "", "", "", "", "", "", day.get("备注")]
+        for item in items:
+            if item.get("餐厅"):
+                yield [day.get("日期"), day.get("主题"), "餐饮", item.get("餐厅"), item.get("美食类型"), "",
+                       item.get("人均(¥)"), "", item.get("位置"), day.get("备注")]
+            else:
+                yield [day.get("日期"), day.get("主题"), "景点", item.get("地点"), item.get("类型"), item.get("开放时间"),
+                       item.get("门票(¥)"), item.get("游玩时长(h)"), item.get("区域"), day.get("备注")]
+
+
+def iter_csv(data: Dict) -> Iterator[str]:
+    """逐行产出 CSV 文本：概览、预算分配、估算费用、建议档位与每日行程。"""
+    buf = io.StringIO()
+    w = csv.writer(buf)
+    for row in _csv_rows(data):
+        w.writerow(row)
+        yield buf.getvalue()
+        buf.seek(0)
+        buf.truncate(0)
+
+
+def _write_chunks(chunks: Iterable[str], path):
+    # path 可以是文件路径，也可以是已打开的文本文件对象（如 io.StringIO）
+    if isinstance(path, str):
+        with open(path, "w", newline="", encoding="utf-8") as f:
+            f.writelines(chunks)
+    else:
+        path.writelines(chunks)
+
+
+def export_json(data: Dict, path):
+    _write_chunks(iter_json(data), path)
+
+
+def export_csv(data: Dict, path):
+    _write_chunks(iter_csv(data), path)
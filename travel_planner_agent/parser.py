@@ -1,7 +1,7 @@
 import os
 import re
 from typing import Dict, List, Optional
-from .llm import parse_input_llm, _llm_client_ok
+from .llm import parse_input_llm, parse_input_llm_async, _llm_client_ok
 
 
 PREFERENCE_KEYWORDS = [
@@ -82,6 +82,78 @@ def _extract_special_needs(text: str) -> List[str]:
     return needs
 
 
+def compose_form_text(
+    destination: str = "",
+    start_date: str = "",
+    end_date: str = "",
+    days: Optional[int] = None,
+    budget_cny: Optional[int] = None,
+    adults: int = 1,
+    children: int = 0,
+    preferences: Optional[List[str]] = None,
+    cities: Optional[List[str]] = None,
+    extra_info: str = "",
+) -> str:
+    """把表单字段拼成自然语言描述，供文本模式解析或作为 raw_text 保留。"""
+    parts = []
+    if destination:
+        parts.append(f"我想去{destination}")
+    if start_date and end_date and days:
+        parts.append(f"从{start_date}到{end_date}共{days}天")
+    elif days:
+        parts.append(f"{days}天")
+    if budget_cny:
+        parts.append(f"预算{budget_cny}元")
+    parts.append(f"成人{adults}，儿童{children}")
+    if preferences:
+        parts.append("喜欢" + ",".join(preferences))
+    if cities:
+        parts.append("城市包括" + "、".join(cities))
+    if extra_info:
+        parts.append("补充信息：" + extra_info)
+    return "，".join(parts) if parts else ""
+
+
+def parse_form(
+    destination: str = "",
+    start_date: str = "",
+    end_date: str = "",
+    days: Optional[int] = None,
+    budget_cny: Optional[int] = None,
+    adults: int = 1,
+    children: int = 0,
+    preferences: Optional[List[str]] = None,
+    cities: Optional[List[str]] = None,
+    extra_info: str = "",
+) -> Dict:
+    """由结构化表单字段直接构建解析结果，无需 LLM 解析。
+
+    字段与 parse_input 的返回保持一致；补充信息中的偏好与特殊需求用关键词补全。
+    """
+    cities = [c for c in (cities or []) if c]
+    prefs = list(preferences or [])
+    for k in _extract_preferences(extra_info or ""):
+        if k not in prefs:
+            prefs.append(k)
+    parsed = {
+        "raw_text": compose_form_text(
+            destination, start_date, end_date, days, budget_cny, adults, children, prefs, cities, extra_info
+        ),
+        "destination": destination or (cities[0] if cities else None),
+        "city": cities[0] if cities else None,
+        "days": int(days or 3),
+        "budget_cny": budget_cny or None,
+        "people": {"adults": max(int(adults or 1), 1), "children": max(int(children or 0), 0)},
+        "preferences": prefs,
+        "special_needs": _extract_special_needs(extra_info or ""),
+    }
+    if len(cities) > 1:
+        parsed["cities"] = cities
+    if extra_info:
+        parsed["extra_info"] = extra_info
+    return parsed
+
+
 def parse_input(text: str) -> Dict:
     """解析自然语言输入为结构化参数。若LLM不可用或失败，则抛出异常。"""
     use_llm = os.environ.get("LLM_PARSE", "1") == "1" and _llm_client_ok()
@@ -91,3 +163,14 @@ def parse_input(text: str) -> Dict:
         return parse_input_llm(text)
     except Exception as e:
         raise RuntimeError(f"LLM解析失败：{e}")
+
+
+async def parse_input_async(text: str) -> Dict:
+    """parse_input 的异步版本，错误语义保持一致。"""
+    use_llm = os.environ.get("LLM_PARSE", "1") == "1" and _llm_client_ok()
+    if not use_llm:
+        raise RuntimeError("无法调用LLM：未配置或不可用")
+    try:
+        return await parse_input_llm_async(text)
+    except Exception as e:
+        raise RuntimeError(f"LLM解析失败：{e}")
@@ -0,0 +1,188 @@
+import os
+import hmac
+import asyncio
+import hashlib
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Optional
+
+
+# 存储格式（自描述，便于调整算法与成本后在登录时透明升级）：
+#   pbkdf2_sha256$<iterations>$<salt_hex>$<hash_hex>
+#   scrypt$<n>$<r>$<p>$<salt_hex>$<hash_hex>
+# 早期版本只存 hash_hex，盐在 users.password_salt 中，固定 PBKDF2-SHA256 100000 次。
+LEGACY_ITERATIONS = 100_000
+
+
+class PasswordHashBusy(RuntimeError):
+    """密码哈希排队已满时抛出，路由层返回 503。"""
+
+
+def _cfg() -> Dict:
+    return {
+        "scheme": os.environ.get("PASSWORD_SCHEME", "pbkdf2_sha256"),
+        "iterations": int(os.environ.get("PASSWORD_PBKDF2_ITERATIONS", "100000")),
+        "n": int(os.environ.get("PASSWORD_SCRYPT_N", "16384")),
+        "r": int(os.environ.get("PASSWORD_SCRYPT_R", "8")),
+        "p": int(os.environ.get("PASSWORD_SCRYPT_P", "1")),
+    }
+
+
+def hash_password(password: str, salt: Optional[bytes] = None, cfg: Optional[Dict] = None) -> str:
+    cfg = cfg or _cfg()
+    salt = salt or os.urandom(16)
+    pwd = password.encode("utf-8")
+    if cfg["scheme"] == "scrypt":
+        n, r, p = cfg["n"], cfg["r"], cfg["p"]
+        dk = hashlib.scrypt(pwd, salt=salt, n=n, r=r, p=p, maxmem=256 * n * r + (1 << 20), dklen=32)
+        return f"scrypt${n}${r}${p}${salt.hex()}${dk.hex()}"
+    if cfg["scheme"] == "pbkdf2_sha256":
+        it = cfg["iterations"]
+        dk = hashlib.pbkdf2_hmac("sha256", pwd, salt, it)
+        return f"pbkdf2_sha256${it}${salt.hex()}${dk.hex()}"
+    raise RuntimeError(f"未知的密码哈希算法：{cfg['scheme']}")
+
+
+def verify_password(password: str, stored: str, legacy_salt: Optional[str] = None) -> bool:
+    pwd = password.encode("utf-8")
+    parts = (stored or "").split("$")
+    try:
+        if parts[0] == "scrypt" and len(parts) == 6:
+            n, r, p = int(parts[1]), int(parts[2]), int(parts[3])
+            salt, expected = bytes.fromhex(parts[4]), bytes.fromhex(parts[5])
+            dk = hashlib.scrypt(pwd, salt=salt, n=n, r=r, p=p, maxmem=256 * n * r + (1 << 20), dklen=len(expected))
+        elif parts[0] == "pbkdf2_sha256" and len(parts) == 4:
+            salt, expected = bytes.fromhex(parts[2]), bytes.fromhex(parts[3])
+            dk = hashlib.pbkdf2_hmac("sha256", pwd, salt, int(parts[1]))
+        elif len(parts) == 1 and legacy_salt:
+            expected = bytes.fromhex(stored)
+            dk = hashlib.pbkdf2_hmac("sha256", pwd, bytes.fromhex(legacy_salt), LEGACY_ITERATIONS)
+        else:
+            return False
+    except ValueError:
+        return False
+    return hmac.compare_digest(dk, expected)
+
+
+def needs_rehash(stored: str) -> bool:
+    """存储的算法或参数与当前配置不一致（含旧格式）时返回 True。"""
+    cfg = _cfg()
+    parts = (stored or "").split("$")
+    if parts[0] != cfg["scheme"]:
+        return True
+    if parts[0] == "scrypt":
+        return parts[1:4] != [str(cfg["n"]), str(cfg["r"]), str(cfg["p"])]
+    return parts[1] != str(cfg["iterations"])
+
+
+def _mp_context():
+    # 进程池在服务运行中（已有工作线程、连接池等）首次登录时才创建，fork 会继承其它线程持有的锁而死锁；
+    # 用 forkserver（不支持的平台用 spawn）从干净的进程启动 worker
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+
+
+class PasswordHasher:
+    """在独立进程池中计算密码哈希，避免 PBKDF2/scrypt 占用请求线程与 GIL。
+
+    max_queue 限制同时提交（运行中 + 排队）的任务数，超出直接拒绝，
+    登录风暴时不会无限堆积任务拖慢其它请求。workers=0 时在当前线程中计算（用于测试/单核环境）。
+    """
+
+    def __init__(self, workers: int = 2, max_queue: int = 32):
+        self.workers = workers
+        self.max_queue = max_queue
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_queue)
+        self.pending = 0
+        self.total = 0
+        self.rejected = 0
+
+    def _pool(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=_mp_context())
+        return self._executor
+
+    def _acquire(self) -> None:
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.rejected += 1
+            raise PasswordHashBusy("登录请求过多，请稍后重试")
+        with self._lock:
+            self.pending += 1
+            self.total += 1
+
+    def _release(self, _=None) -> None:
+        with self._lock:
+            self.pending -= 1
+        self._slots.release()
+
+    def _submit(self, fn, *args):
+        self._acquire()
+        if self.workers <= 0:
+            try:
+                return None, fn(*args)
+            finally:
+                self._release()
+        try:
+            fut = self._pool().submit(fn, *args)
+        except Exception:
+            self._release()
+            raise
+        fut.add_done_callback(self._release)
+        return fut, None
+
+    def run(self, fn, *args):
+        fut, value = self._submit(fn, *args)
+        return value if fut is None else fut.result()
+
+    async def run_async(self, fn, *args):
+        fut, value = self._submit(fn, *args)
+        return value if fut is None else await asyncio.wrap_future(fut)
+
+    def hash(self, password: str) -> str:
+        return self.run(hash_password, password, None, _cfg())
+
+    def verify(self, password: str, stored: str, legacy_salt: Optional[str] = None) -> bool:
+        return self.run(verify_password, password, stored, legacy_salt)
+
+    async def hash_async(self, password: str) -> str:
+        return await self.run_async(hash_password, password, None, _cfg())
+
+    async def verify_async(self, password: str, stored: str, legacy_salt: Optional[str] = None) -> bool:
+        return await self.run_async(verify_password, password, stored, legacy_salt)
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "max_queue": self.max_queue,
+                "pending": self.pending,
+                "total": self.total,
+                "rejected": self.rejected,
+            }
+
+
+_hasher: Optional[PasswordHasher] = None
+_hasher_lock = threading.Lock()
+
+
+def get_hasher() -> PasswordHasher:
+    global _hasher
+    if _hasher is None:
+        with _hasher_lock:
+            if _hasher is None:
+                _hasher = PasswordHasher(
+                    workers=int(os.environ.get("PASSWORD_HASH_WORKERS", str(min(2, os.cpu_count() or 1)))),
+                    max_queue=int(os.environ.get("PASSWORD_HASH_MAX_QUEUE", "32")),
+                )
+    return _hasher
@@ -0,0 +1,175 @@
+import os
+import re
+import json
+import zlib
+import hashlib
+from typing import Any, Dict, Optional, Tuple
+
+try:
+    import zstandard
+except Exception:
+    zstandard = None
+
+
+# 共享字典：由真实生成结果（静态行程 + _finish_plan + 保存时计算的路线）与保存参数组成的样本，
+# 存于 data/plan_dict_v{版本}.json。字典内容一旦用于写入就不能修改，调整时用 build_dict_samples
+# 生成新版本文件并加入 DICT_VERSIONS，旧版本文件保留用于解压。
+_DATA_DIR = os.path.join(os.path.dirname(__file__), "data")
+DICT_VERSIONS = (1,)
+CURRENT_DICT_VERSION = max(DICT_VERSIONS)
+
+# build_dict_samples 的默认取样：覆盖中日城市、不同天数、人数与偏好
+_SAMPLE_CASES = [
+    {"destination": "日本", "cities": ["东京"], "days": 3, "budget_cny": 15000, "adults": 2, "children": 1,
+     "preferences": ["美食", "动漫"]},
+    {"destination": "中国", "cities": ["北京"], "days": 4, "budget_cny": 8000, "adults": 2, "children": 0,
+     "preferences": ["历史"]},
+    {"destination": "中国", "cities": ["成都"], "days": 2, "budget_cny": 3000, "adults": 1, "children": 0,
+     "preferences": ["美食"]},
+]
+
+
+def build_dict_samples(cases=None, mode: str = "driving") -> list:
+    """按 cases 离线生成字典样本：静态行程经 _finish_plan 与 attach_routes 得到的结果，以及对应的保存参数。"""
+    from . import parse_form, _finish_plan
+    from .planner import generate_static_itinerary
+    from .routing import attach_routes
+
+    samples = []
+    for case in cases or _SAMPLE_CASES:
+        parsed = parse_form(start_date="2025-05-01", extra_info="", **case)
+        samples.append(attach_routes(_finish_plan(parsed, generate_static_itinerary(parsed)), mode))
+    case = (cases or _SAMPLE_CASES)[-1]
+    samples.append({
+        "title": "我的旅行计划", "destination": case["destination"], "start_date": "2025-05-01",
+        "end_date": "2025-05-03", "days": case["days"], "budget_cny": case["budget_cny"],
+        "adults": case["adults"], "children": case["children"], "preferences": case["preferences"],
+        "cities_text": "，".join(case["cities"]), "extra_info": "", "travel_mode": mode,
+    })
+    return samples
+
+
+def _load_samples(version: int) -> list:
+    if version not in DICT_VERSIONS:
+        raise RuntimeError(f"未知的压缩字典版本：{version}")
+    with open(os.path.join(_DATA_DIR, f"plan_dict_v{version}.json"), encoding="utf-8") as f:
+        return json.load(f)["samples"]
+
+# 压缩数据首字节标记编码方式，第二字节为字典版本
+CODEC_ZLIB = b"z"
+CODEC_ZSTD = b"s"
+
+_zdicts: Dict[int, bytes] = {}
+_zstd_dicts: Dict[int, Any] = {}
+
+
+def _dict_bytes(version: int) -> bytes:
+    if version not in _zdicts:
+        samples = _load_samples(version)
+        parts = [json.dumps(s, ensure_ascii=False, indent=2) for s in samples]
+        parts += [json.dumps(s, ensure_ascii=False) for s in samples]
+        # 计划按紧凑 JSON 存储；zlib 优先匹配字典末尾的内容，紧凑形式放在最后，超出 32KB 时截去开头的缩进形式
+        _zdicts[version] = "\n".join(parts).encode("utf-8")[-32768:]
+    return _zdicts[version]
+
+
+def _zstd_dict(version: int):
+    if version not in _zstd_dicts:
+        _zstd_dicts[version] = zstandard.ZstdCompressionDict(
+            _dict_bytes(version), dict_type=zstandard.DICT_TYPE_RAWCONTENT
+        )
+    return _zstd_dicts[version]
+
+
+def default_codec() -> bytes:
+    """PLAN_STORE_CODEC=zstd|zlib；未指定时有 zstandard 则用 zstd，否则 zlib。"""
+    name = (os.environ.get("PLAN_STORE_CODEC") or "").strip().lower()
+    if name == "zlib" or (name != "zstd" and zstandard is None):
+        return CODEC_ZLIB
+    if zstandard is None:
+        raise RuntimeError("PLAN_STORE_CODEC=zstd 需要安装 zstandard")
+    return CODEC_ZSTD
+
+
+def compress(text: str, codec: Optional[bytes] = None) -> bytes:
+    codec = codec or default_codec()
+    version = CURRENT_DICT_VERSION
+    raw = text.encode("utf-8")
+    if codec == CODEC_ZSTD:
+        body = zstandard.ZstdCompressor(level=10, dict_data=_zstd_dict(version)).compress(raw)
+    else:
+        c = zlib.compressobj(level=9, zdict=_dict_bytes(version))
+        body = c.compress(raw) + c.flush()
+    return codec + bytes([version]) + body
+
+
+def decompress(blob: bytes) -> str:
+    blob = bytes(blob)
+    codec, version, body = blob[:1], blob[1], blob[2:]
+    if codec == CODEC_ZSTD:
+        if zstandard is None:
+            raise RuntimeError("该计划使用 zstd 压缩，需要安装 zstandard 才能读取")
+        raw = zstandard.ZstdDecompressor(dict_data=_zstd_dict(version)).decompress(body)
+    elif codec == CODEC_ZLIB:
+        d = zlib.decompressobj(zdict=_dict_bytes(version))
+        raw = d.decompress(body) + d.flush()
+    else:
+        raise RuntimeError("无法识别的计划数据编码")
+    return raw.decode("utf-8")
+
+
+def content_hash(text: str) -> str:
+    """对规范化后的 JSON 取 sha256，键顺序或空白不同的相同内容视为同一份。"""
+    try:
+        norm = json.dumps(json.loads(text), ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    except Exception:
+        norm = text
+    return hashlib.sha256(norm.encode("utf-8")).hexdigest()
+
+
+def _to_int(v) -> Optional[int]:
+    try:
+        return int(float(v))
+    except (TypeError, ValueError):
+        return None
+
+
+def _to_float(v) -> Optional[float]:
+    try:
+        return float(v)
+    except (TypeError, ValueError):
+        return None
+
+
+def extract_summary(data_json: str, params_json: Optional[str] = None) -> Dict[str, Any]:
+    """写入时提取列表/筛选用的摘要列：destination、city、days、budget_cny。
+
+    优先取结果中的“行程概览”，缺失时回退到保存时的表单参数。
+    """
+    def _load(s) -> Dict:
+        try:
+            obj = json.loads(s) if s else {}
+            return obj if isinstance(obj, dict) else {}
+        except Exception:
+            return {}
+
+    overview = _load(data_json).get("行程概览") or {}
+    params = _load(params_json)
+    params = params.get("params") if isinstance(params.get("params"), dict) else params
+    city = overview.get("城市")
+    if not city:
+        cities = params.get("cities")
+        if not isinstance(cities, list):
+            cities = re.split(r"[，,\s]+", str(params.get("cities_text") or "").strip())
+        city = next((c for c in cities if c), None)
+    return {
+        "destination": overview.get("目的地") or params.get("destination") or None,
+        "city": city or None,
+        "days": _to_int(overview.get("天数") or params.get("days")),
+        "budget_cny": _to_float(overview.get("总预算") or params.get("budget_cny")),
+    }
+
+
+def encode_plan(data_json: str, params_json: Optional[str] = None) -> Tuple[str, bytes, Dict[str, Any]]:
+    """返回 (内容哈希, 压缩数据, 摘要列)。"""
+    return content_hash(data_json), compress(data_json), extract_summary(data_json, params_json)
@@ -1,89 +1,91 @@
 from typing import Dict, List
 import os
-from .providers import get_static_city_bundle
-from .llm import generate_itinerary_llm, _llm_client_ok
-
-
-def _pick_items(items: List[Dict], types: List[str], limit: int) -> List[Dict]:
-    if not items:
-        return []
-    selected = []
-    for t in types:
-        for it in items:
-            if it.get("type") == t and it not in selected:
-                selected.append(it)
-                if len(selected) >= limit:
-                    return selected
-    # 填充不足
-    for it in items:
-        if it not in selected:
+import asyncio
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from .knowledge import CityData, get_knowledge_base
+from .optimizer import optimize_days, optimize_itinerary
+from .geocoding import geocode_itinerary
+from .tracing import span
+from .llm import (
+    generate_itinerary_llm,
+    generate_itinerary_llm_async,
+    generate_skeleton_llm,
+    generate_skeleton_llm_async,
+    generate_days_llm,
+    generate_days_llm_async,
+    _llm_client_ok,
+)
+
+
+def _pick_items(info: CityData, types: List[str], limit: int) -> List[Dict]:
+    """按类型优先挑选景点，不足时按原顺序补齐；用类型索引与 id 集合去重，避免逐个扫描。"""
+    selected: List[Dict] = []
+    seen = set()
+    for it in info.attractions_of(types) + info.attractions:
+        if len(selected) >= limit:
+            break
+        if id(it) not in seen:
+            seen.add(id(it))
             selected.append(it)
-            if len(selected) >= limit:
-                break
     return selected
 
 
-def _meal_suggestion(restaurants: List[Dict], preference: List[str]) -> List[Dict]:
+def _meal_suggestion(info: CityData, preference: List[str]) -> List[Dict]:
     # 简单策略：美食偏好优先海鲜/拉面；动漫偏好推荐秋叶原周边餐馆
-    picks = []
-    for r in restaurants:
-        if "美食" in preference and r["cuisine"] in ("海鲜", "拉面"):
-            picks.append(r)
-        elif "动漫" in preference and ("秋叶原" in r["area"] or "多区域" in r["area"]):
-            picks.append(r)
-    # 回填其他
-    for r in restaurants:
-        if r not in picks:
-            picks.append(r)
-    return picks[:3]
-
-
-def _hotel_suggestion(hotels: List[Dict], people: Dict, preference: List[str]) -> Dict:
-    # 亲子优先：上野/浅草区域，步行与公园便利
-    for h in hotels:
-        if "亲子" in preference and ("上野" in h["area"] or "浅草" in h["area"]):
-            return h
-    # 默认选择新宿，餐饮选择多
-    return hotels[0] if hotels else {"name": "市中心酒店(示例)", "area": "中心区", "price_range_cny": [600, 900]}
-
-
-def generate_itinerary(parsed: Dict) -> Dict:
-    """默认使用DeepSeek生成行程；失败时回退静态策略。"""
-    use_llm = os.environ.get("LLM_PLAN", "1") == "1" and _llm_client_ok()
-    if use_llm:
-        try:
-            return generate_itinerary_llm(parsed)
-        except Exception:
-            pass
+    picks: List[Dict] = []
+    if "美食" in preference:
+        for cuisine in ("海鲜", "拉面"):
+            picks.extend(info.restaurants_by_cuisine.get(cuisine, []))
+    if "动漫" in preference:
+        for area, items in info.restaurants_by_area.items():
+            if "秋叶原" in area or "多区域" in area:
+                picks.extend(items)
+    # 按原顺序去重并回填其他
+    seen = set()
+    out: List[Dict] = []
+    for r in picks + info.restaurants:
+        if id(r) not in seen:
+            seen.add(id(r))
+            out.append(r)
+        if len(out) >= 3:
+            break
+    return out
 
-    # 回退：静态策略
-    destination = parsed.get("destination")
-    city = parsed.get("city") or ("东京" if destination == "日本" else None)
-    days = parsed.get("days", 3)
-    people = parsed.get("people", {"adults": 1, "children": 0})
-    preference = parsed.get("preferences", [])
 
-    data = get_static_city_bundle(city or "东京")
-    attractions = data.get("attractions", [])
-    restaurants = data.get("restaurants", [])
-    hotels = data.get("hotels", [])
-    transport = data.get("transport", {})
+def _hotel_suggestion(info: CityData, people: Dict, preference: List[str]) -> Dict:
+    # 偏好对应的优先区域（如亲子优先公园附近），见知识库 hotel_preference
+    for pref, areas in info.hotel_preference.items():
+        if pref in preference:
+            for area in areas:
+                hotels = info.hotels_by_area.get(area)
+                if hotels:
+                    return hotels[0]
+    return info.hotels[0] if info.hotels else {"name": "市中心酒店(示例)", "area": "中心区", "price_range_cny": [600, 900]}
 
-    hotel = _hotel_suggestion(hotels, people, preference)
-    meals = _meal_suggestion(restaurants, preference)
 
-    day_plans: List[Dict] = []
-    base_routes = [
-        ["浅草寺", "东京晴空塔"],
-        ["秋叶原电器街", "台场海滨公园与商圈"],
-        ["上野动物园", "teamLab Planets"],
-        ["明治神宫", "涩谷十字路口与天空平台(免费)"]
-    ]
-
-    if "亲子" in preference:
-        base_routes.insert(0, ["上野动物园", "浅草寺"])  # 优先亲子与轻松文化
-    if "动漫" in preference:
-        base_routes.insert(0, ["秋叶原电器街"])  # 动漫偏好优先秋叶原
+def _static_routes(info: CityData, preference: List[str], days: int) -> List[List[str]]:
+    """每日景点组合：城市有人工路线时沿用，否则按偏好挑选后同区域两两配对。"""
+    if info.routes:
+        base_routes = [list(r) for r in info.routes]
+        for pref, route in info.preference_routes.items():
+            if pref in preference:
+                base_routes.insert(0, list(route))
+    else:
+        picks = _pick_items(info, preference, days * 2)
+        base_routes = []
+        used = set()
+        for i, a in enumerate(picks):
+            if a["name"] in used:
+                continue
+            used.add(a["name"])
+            mate = next((b for b in picks[i + 1:] if b["name"] not in used and b.get("area") == a.get("area")), None)
+            mate = mate or next((b for b in picks[i + 1:] if b["name"] not in used), None)
+            if mate:
+                used.add(mate["name"])
+                base_routes.append([a["name"], mate["name"]])
+            else:
+                base_routes.append([a["name"]])
 
     seen = set()
     final_routes = []
@@ -97,19 +99,198 @@ def generate_itinerary(parsed: Dict) -> Dict:
             final_routes.append(fr)
         if len(final_routes) >= days:
             break
+    return final_routes
+
+
+def _use_route_optimizer() -> bool:
+    return os.environ.get("PLAN_ROUTE_OPTIMIZE", "1") == "1"
+
+
+def _optimized_routes(info: CityData, preference: List[str], days: int, hotel: Dict) -> List[List[str]]:
+    """用路线优化器重排每日景点：候选优先级沿用 _static_routes，再按区域分天、按距离与开放时间排序。"""
+    priority = [n for r in _static_routes(info, preference, days) for n in r]
+    candidates: List[Dict] = []
+    seen = set()
+    for a in [info.attraction(n) for n in priority] + _pick_items(info, preference, len(info.attractions)):
+        if a and a["name"] not in seen:
+            seen.add(a["name"])
+            candidates.append(a)
+    start = (hotel["lng"], hotel["lat"]) if "lng" in hotel and "lat" in hotel else None
+    result = optimize_days(candidates, days, start=start, max_stops=2)
+    return [[leg["poi"]["name"] for leg in legs] for legs in result["days"]]
+
+
+def postprocess_itinerary(itinerary: Dict) -> Dict:
+    """LLM 行程后处理：批量补全地点坐标（经地理编码缓存），再按酒店出发的距离与开放时间调整每天上午/下午顺序。"""
+    try:
+        with span("plan.geocode"):
+            geocode_itinerary(itinerary)
+    except Exception:
+        pass
+    if _use_route_optimizer():
+        try:
+            with span("plan.optimize"):
+                optimize_itinerary(itinerary)
+        except Exception:
+            pass
+    return itinerary
+
+
+async def postprocess_itinerary_async(itinerary: Dict) -> Dict:
+    # 地理编码可能访问外部服务，放到线程池执行，不阻塞事件循环
+    # 带上调用方的 contextvars，线程中的 span 记到当前请求的 trace 上
+    loop = asyncio.get_running_loop()
+    ctx = contextvars.copy_context()
+    return await loop.run_in_executor(None, ctx.run, postprocess_itinerary, itinerary)
+
+
+def _use_llm_plan() -> bool:
+    return os.environ.get("LLM_PLAN", "1") == "1" and _llm_client_ok()
+
+
+def _use_chunked(parsed: Dict) -> bool:
+    # 长行程（默认 >= 6 天）走分段并发生成：LLM_CHUNK_MIN_DAYS=0 关闭
+    min_days = int(os.environ.get("LLM_CHUNK_MIN_DAYS", "6"))
+    return min_days > 0 and int(parsed.get("days") or 0) >= min_days
+
+
+def _chunk_size() -> int:
+    return max(int(os.environ.get("LLM_CHUNK_DAYS", "3")), 1)
+
+
+def _chunk_concurrency() -> int:
+    return max(int(os.environ.get("LLM_CHUNK_CONCURRENCY", "4")), 1)
+
+
+def _chunk_ranges(skeleton_days: List[Dict], size: int) -> List[List[Dict]]:
+    return [skeleton_days[i:i + size] for i in range(0, len(skeleton_days), size)]
+
+
+def _stitch_itinerary(parsed: Dict, skeleton: Dict, ranges: List[List[Dict]], chunks: List[List[Dict]]) -> Dict:
+    """把各段生成结果按骨架拼接为完整行程，并去除跨段重复的景点。"""
+    plan: List[Dict] = []
+    seen = set()
+    for day_range, generated in zip(ranges, chunks):
+        for i, skel in enumerate(day_range):
+            d = dict(generated[i]) if i < len(generated) else {}
+            # 以骨架的天序号为准，模型返回的 day 可能从 1 重新计数
+            d["day"] = skel["day"]
+            d.setdefault("theme", skel.get("theme"))
+            if not d.get("notes") and skel.get("area"):
+                d["notes"] = f"主要区域：{skel['area']}"
+            for part in ("morning", "afternoon"):
+                node = d.get(part)
+                name = (node or {}).get("name") if isinstance(node, dict) else None
+                if not name:
+                    d[part] = None
+                    continue
+                key = name.strip()
+                if key in seen:
+                    d[part] = None
+                else:
+                    seen.add(key)
+            d.setdefault("evening_meal", None)
+            plan.append(d)
+    return {
+        "destination": skeleton.get("destination") or parsed.get("destination"),
+        "city": skeleton.get("city") or parsed.get("city") or "市区",
+        "hotel": skeleton.get("hotel"),
+        "transport": skeleton.get("transport"),
+        "days": len(plan),
+        "plan": plan,
+        "people": parsed.get("people", {"adults": 1, "children": 0}),
+        "preferences": parsed.get("preferences", []),
+    }
+
+
+def generate_itinerary_chunked(parsed: Dict) -> Dict:
+    """分段模式：先生成骨架（每天主题与区域），再按天数区间并发展开，最后拼接。"""
+    skeleton = generate_skeleton_llm(parsed)
+    ranges = _chunk_ranges(skeleton["skeleton"], _chunk_size())
+
+    def run(day_range: List[Dict]) -> List[Dict]:
+        try:
+            return generate_days_llm(parsed, skeleton, day_range)
+        except Exception:
+            return []
+
+    # 每段各带一份调用方 contextvars 的副本（当前用户、trace），同一 Context 不能在多个线程中同时 run
+    contexts = [contextvars.copy_context() for _ in ranges]
+    with ThreadPoolExecutor(max_workers=_chunk_concurrency()) as pool:
+        chunks = list(pool.map(lambda ctx, r: ctx.run(run, r), contexts, ranges))
+    return _stitch_itinerary(parsed, skeleton, ranges, chunks)
+
+
+async def generate_itinerary_chunked_async(parsed: Dict) -> Dict:
+    skeleton = await generate_skeleton_llm_async(parsed)
+    ranges = _chunk_ranges(skeleton["skeleton"], _chunk_size())
+    sem = asyncio.Semaphore(_chunk_concurrency())
+
+    async def run(day_range: List[Dict]) -> List[Dict]:
+        async with sem:
+            try:
+                return await generate_days_llm_async(parsed, skeleton, day_range)
+            except Exception:
+                return []
+
+    chunks = await asyncio.gather(*[run(r) for r in ranges])
+    return _stitch_itinerary(parsed, skeleton, ranges, list(chunks))
+
+
+def generate_itinerary(parsed: Dict) -> Dict:
+    """默认使用DeepSeek生成行程；失败时回退静态策略。"""
+    if _use_llm_plan():
+        try:
+            if _use_chunked(parsed):
+                return postprocess_itinerary(generate_itinerary_chunked(parsed))
+            return postprocess_itinerary(generate_itinerary_llm(parsed))
+        except Exception:
+            pass
+    return generate_static_itinerary(parsed)
+
+
+async def generate_itinerary_async(parsed: Dict) -> Dict:
+    """generate_itinerary 的异步版本；静态回退为纯计算，直接同步执行。"""
+    if _use_llm_plan():
+        try:
+            if _use_chunked(parsed):
+                return await postprocess_itinerary_async(await generate_itinerary_chunked_async(parsed))
+            return await postprocess_itinerary_async(await generate_itinerary_llm_async(parsed))
+        except Exception:
+            pass
+    return generate_static_itinerary(parsed)
+
+
+def generate_static_itinerary(parsed: Dict) -> Dict:
+    """静态策略：基于城市知识库生成行程。"""
+    destination = parsed.get("destination")
+    days = parsed.get("days", 3)
+    people = parsed.get("people", {"adults": 1, "children": 0})
+    preference = parsed.get("preferences", [])
+
+    kb = get_knowledge_base()
+    info = kb.resolve(parsed.get("city"), destination) or kb.city(kb.default_city)
+
+    hotel = _hotel_suggestion(info, people, preference)
+    meals = _meal_suggestion(info, preference)
+    if _use_route_optimizer():
+        final_routes = _optimized_routes(info, preference, days, hotel)
+    else:
+        final_routes = _static_routes(info, preference, days)
 
     def find_attr(name: str) -> Dict:
-        for a in attractions:
-            if a["name"] == name:
-                return a
+        a = info.attraction(name)
+        if a:
+            return dict(a)
         return {"name": name, "type": "景点", "open_time": "请查询", "ticket_cny": 0, "duration_hours": 2, "area": "市区"}
 
+    day_plans: List[Dict] = []
     for i in range(days):
         today = final_routes[i] if i < len(final_routes) else []
         picks = [find_attr(n) for n in today]
         morning = picks[0] if len(picks) > 0 else None
         afternoon = picks[1] if len(picks) > 1 else None
-        evening = meals[i % len(meals)] if meals else None
+        evening = dict(meals[i % len(meals)]) if meals else None
 
         day_plans.append({
             "day": i + 1,
@@ -121,10 +302,10 @@ def generate_itinerary(parsed: Dict) -> Dict:
         })
 
     return {
-        "destination": destination or "日本",
-        "city": city or "东京",
-        "hotel": hotel,
-        "transport": transport,
+        "destination": destination or info.country or info.name,
+        "city": info.name,
+        "hotel": dict(hotel),
+        "transport": info.transport,
         "days": days,
         "plan": day_plans,
         "people": people,
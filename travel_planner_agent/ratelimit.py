@@ -0,0 +1,42 @@
+import time
+import threading
+from collections import OrderedDict
+from typing import Dict, Tuple
+
+
+class RateLimiter:
+    """按键（如客户端 IP）的令牌桶限流。
+
+    每个键每分钟补充 rate_per_minute 个令牌，最多积累 burst 个；
+    最多跟踪 max_keys 个键，超出时淘汰最久未访问的键。
+    """
+
+    def __init__(self, rate_per_minute: float = 10, burst: int = 5, max_keys: int = 10000):
+        self.rate = rate_per_minute / 60.0
+        self.burst = burst
+        self.max_keys = max_keys
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.limited = 0
+
+    def hit(self, key: str) -> float:
+        """消耗一个令牌；允许时返回 0，否则返回需要等待的秒数。"""
+        now = time.monotonic()
+        with self._lock:
+            tokens, last = self._buckets.get(key, (float(self.burst), now))
+            tokens = min(float(self.burst), tokens + (now - last) * self.rate)
+            if tokens >= 1:
+                self._buckets[key] = (tokens - 1, now)
+                wait = 0.0
+            else:
+                self._buckets[key] = (tokens, now)
+                self.limited += 1
+                wait = (1 - tokens) / self.rate if self.rate > 0 else float("inf")
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+            return wait
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {"keys": len(self._buckets), "limited": self.limited}
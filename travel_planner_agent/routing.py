@@ -0,0 +1,393 @@
+import os
+import json
+import time
+import threading
+import urllib.parse
+import urllib.request
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Dict, List, Optional, Tuple
+
+from . import config
+from . import db
+from .cache import MemoryCache
+from .optimizer import haversine_km
+
+
+MODES = ("driving", "walking", "riding")
+
+# 直线估算：各出行方式的平均速度（公里/小时），实际道路距离按直线距离乘以绕行系数
+_SPEED_KMH = {"driving": 25.0, "walking": 4.5, "riding": 12.0}
+DETOUR_FACTOR = 1.3
+
+
+class RouteError(RuntimeError):
+    """路线服务调用失败时抛出，RoutingService 会回退为直线估算。"""
+
+
+def normalize_mode(mode: Optional[str]) -> str:
+    return mode if mode in MODES else "driving"
+
+
+def point_key(p: Tuple[float, float]) -> str:
+    # 5 位小数约 1 米精度，同一地点的不同写法落到同一个缓存键
+    return f"{float(p[0]):.5f},{float(p[1]):.5f}"
+
+
+def _parse_key(key: str) -> Tuple[float, float]:
+    lng, lat = key.split(",")
+    return float(lng), float(lat)
+
+
+class RouteProvider(ABC):
+    """路线服务接口：返回 {"distance_m", "duration_s", "polyline": [[lng, lat], ...]}。"""
+
+    name = "base"
+
+    @abstractmethod
+    def route(self, origin: Tuple[float, float], destination: Tuple[float, float], mode: str) -> Dict:
+        """计算 origin 到 destination 的路段；服务调用失败时抛出 RouteError。"""
+
+
+class StraightLineProvider(RouteProvider):
+    """离线替身：按球面距离与平均速度估算，折线为两点直线。"""
+
+    name = "straight"
+
+    def route(self, origin, destination, mode):
+        km = haversine_km(origin, destination) * DETOUR_FACTOR
+        return {
+            "distance_m": round(km * 1000, 1),
+            "duration_s": round(km / _SPEED_KMH[normalize_mode(mode)] * 3600, 1),
+            "polyline": [[origin[0], origin[1]], [destination[0], destination[1]]],
+        }
+
+
+class AMapRouteProvider(RouteProvider):
+    """高德 Web 服务路径规划。需要“Web 服务”类型的 Key（AMAP_REST_KEY），与前端 JS Key 不同。"""
+
+    name = "amap"
+    _URLS = {
+        "driving": "https://restapi.amap.com/v3/direction/driving",
+        "walking": "https://restapi.amap.com/v3/direction/walking",
+        "riding": "https://restapi.amap.com/v4/direction/bicycling",
+    }
+
+    def __init__(self, key: str, timeout: float = 8.0):
+        self.key = key
+        self.timeout = timeout
+
+    def route(self, origin, destination, mode):
+        mode = normalize_mode(mode)
+        query = urllib.parse.urlencode({
+            "key": self.key,
+            "origin": f"{origin[0]:.6f},{origin[1]:.6f}",
+            "destination": f"{destination[0]:.6f},{destination[1]:.6f}",
+        })
+        try:
+            with urllib.request.urlopen(f"{self._URLS[mode]}?{query}", timeout=self.timeout) as resp:
+                data = json.loads(resp.read().decode("utf-8"))
+        except Exception as e:
+            raise RouteError(f"路线服务请求失败：{e}")
+        try:
+            return self._parse(data, origin, destination)
+        except RouteError:
+            raise
+        except Exception as e:
+            raise RouteError(f"路线服务返回格式异常：{e}")
+
+    @staticmethod
+    def _parse(data: Dict, origin, destination) -> Dict:
+        # v3 接口结果在 route.paths，v4（骑行）在 data.paths
+        paths = ((data.get("route") or data.get("data") or {}).get("paths")) or []
+        if not paths:
+            raise RouteError(f"路线服务未返回结果：{data.get('info') or data.get('errmsg')}")
+        path = paths[0]
+        polyline: List[List[float]] = []
+        for step in path.get("steps") or []:
+            for pair in (step.get("polyline") or "").split(";"):
+                if "," in pair:
+                    lng, lat = pair.split(",")
+                    polyline.append([float(lng), float(lat)])
+        if len(polyline) < 2:
+            polyline = [[origin[0], origin[1]], [destination[0], destination[1]]]
+        return {
+            "distance_m": float(path.get("distance") or 0),
+            "duration_s": float(path.get("duration") or 0),
+            "polyline": polyline,
+        }
+
+
+class RoutingService:
+    """按 (provider, mode, 起点, 终点) 缓存路段：进程内 LRU -> 本地 route_legs 表 -> 路线服务。
+
+    未命中的路段最多 concurrency 个并发请求路线服务。失败的路段用直线估算兜底并带 estimated 标记，
+    兜底结果不写入路段缓存，只在 failure_ttl 秒内记为失败、期间不再请求，之后重试。
+    """
+
+    def __init__(self, provider: RouteProvider, memory_max: int = 4096, failure_ttl: float = 300.0,
+                 concurrency: int = 4):
+        self.provider = provider
+        self.fallback = StraightLineProvider()
+        self._memory = MemoryCache(ttl_seconds=86400, max_entries=memory_max)
+        self._failed = MemoryCache(ttl_seconds=failure_ttl, max_entries=memory_max)
+        self._executor = ThreadPoolExecutor(max_workers=max(concurrency, 1), thread_name_prefix="route")
+        self._lock = threading.Lock()
+        self.provider_calls = 0
+        self.db_hits = 0
+        self.fallbacks = 0
+        self.timeouts = 0
+
+    def _estimate(self, pair: Tuple[str, str], mode: str) -> Dict:
+        leg = self.fallback.route(_parse_key(pair[0]), _parse_key(pair[1]), mode)
+        leg["estimated"] = True
+        return leg
+
+    def _fetch(self, pairs: List[Tuple[str, str]], mode: str, budget_s: Optional[float]) -> Dict[Tuple[str, str], Dict]:
+        """并发请求路线服务，返回成功的路段；失败的记入负缓存。
+
+        超过 budget_s 仍未返回的路段本次不再等待，返回后照常写入缓存，供下次使用。
+        """
+        name = self.provider.name
+        futures = {self._executor.submit(self.provider.route, _parse_key(a), _parse_key(b), mode): (a, b)
+                   for a, b in pairs}
+
+        def collect(fut) -> Optional[Dict]:
+            pair = futures[fut]
+            try:
+                leg = fut.result()
+            except Exception:
+                # RouteError 以及路线服务实现中的其它异常，本次都用直线估算
+                with self._lock:
+                    self.fallbacks += 1
+                self._failed.set(f"{name}|{mode}|{pair[0]}|{pair[1]}", "1")
+                return None
+            with self._lock:
+                self.provider_calls += 1
+            self._memory.set(f"{name}|{mode}|{pair[0]}|{pair[1]}", leg)
+            return leg
+
+        def late(fut) -> None:
+            if fut.cancelled():
+                return
+            leg = collect(fut)
+            if leg is not None:
+                try:
+                    db.save_route_legs(name, mode, {futures[fut]: leg})
+                except Exception:
+                    pass
+
+        done, not_done = wait(futures, timeout=budget_s)
+        fresh: Dict[Tuple[str, str], Dict] = {}
+        for fut in done:
+            leg = collect(fut)
+            if leg is not None:
+                fresh[futures[fut]] = leg
+        for fut in not_done:
+            with self._lock:
+                self.timeouts += 1
+            if not fut.cancel():
+                fut.add_done_callback(late)
+        return fresh
+
+    def legs(self, pairs: List[Tuple[str, str]], mode: str,
+             budget_s: Optional[float] = None) -> Dict[Tuple[str, str], Dict]:
+        """pairs 为 (起点键, 终点键)，键由 point_key 生成；返回每对的路段。
+
+        budget_s 为等待路线服务的总时长上限，超时的路段用直线估算（estimated 为 True）；None 表示不限。
+        """
+        mode = normalize_mode(mode)
+        name = self.provider.name
+        out: Dict[Tuple[str, str], Dict] = {}
+        missing: List[Tuple[str, str]] = []
+        for pair in dict.fromkeys(pairs):
+            if pair[0] == pair[1]:
+                out[pair] = {"distance_m": 0.0, "duration_s": 0.0, "polyline": [list(_parse_key(pair[0]))] * 2}
+                continue
+            hit = self._memory.get(f"{name}|{mode}|{pair[0]}|{pair[1]}")
+            if hit is not None:
+                out[pair] = hit
+            else:
+                missing.append(pair)
+        if not missing:
+            return out
+
+        try:
+            found = db.get_route_legs(name, mode, missing)
+        except Exception:
+            # 路段缓存表不可用时直接请求路线服务
+            found = {}
+        to_fetch: List[Tuple[str, str]] = []
+        for pair in missing:
+            leg = found.get(pair)
+            if leg is not None:
+                with self._lock:
+                    self.db_hits += 1
+                self._memory.set(f"{name}|{mode}|{pair[0]}|{pair[1]}", leg)
+                out[pair] = leg
+            elif self._failed.get(f"{name}|{mode}|{pair[0]}|{pair[1]}") is not None:
+                out[pair] = self._estimate(pair, mode)
+            else:
+                to_fetch.append(pair)
+        if not to_fetch:
+            return out
+
+        fresh = self._fetch(to_fetch, mode, budget_s)
+        for pair in to_fetch:
+            out[pair] = fresh.get(pair) or self._estimate(pair, mode)
+        try:
+            db.save_route_legs(name, mode, fresh)
+        except Exception:
+            # 写缓存失败不影响本次结果，内存中已缓存
+            pass
+        return out
+
+    def matrix(self, points: List[Tuple[float, float]], mode: str) -> Dict:
+        """两两之间的道路距离（米）与耗时（秒）矩阵，各路段同样走缓存。"""
+        keys = [point_key(p) for p in points]
+        pairs = [(a, b) for a in keys for b in keys]
+        legs = self.legs(pairs, mode)
+        return {
+            "distance_m": [[legs[(a, b)]["distance_m"] for b in keys] for a in keys],
+            "duration_s": [[legs[(a, b)]["duration_s"] for b in keys] for a in keys],
+        }
+
+    def plan_routes(self, result: Dict, mode: str, budget_s: Optional[float] = None) -> Dict:
+        """为结构化输出计算每日路线：酒店 -> 当天景点 -> 酒店，缺坐标的地点跳过。budget_s 同 legs。"""
+        mode = normalize_mode(mode)
+        days_stops = route_stops(result)
+        pairs = []
+        for stops in days_stops:
+            keys = [point_key((s["lng"], s["lat"])) for s in stops]
+            pairs.extend(zip(keys, keys[1:]))
+        legs = self.legs(pairs, mode, budget_s)
+
+        days = []
+        for stops in days_stops:
+            keys = [point_key((s["lng"], s["lat"])) for s in stops]
+            day_legs = [legs[pair] for pair in zip(keys, keys[1:])]
+            days.append({
+                "stops": stops,
+                "legs": day_legs,
+                "distance_m": round(sum(leg["distance_m"] for leg in day_legs), 1),
+                "duration_s": round(sum(leg["duration_s"] for leg in day_legs), 1),
+            })
+        return {"mode": mode, "provider": self.provider.name, "days": days}
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "provider": self.provider.name,
+                "provider_calls": self.provider_calls,
+                "db_hits": self.db_hits,
+                "fallbacks": self.fallbacks,
+                "timeouts": self.timeouts,
+                "memory": self._memory.stats(),
+            }
+
+
+def _point(lng, lat) -> Optional[Tuple[float, float]]:
+    try:
+        pt = float(lng), float(lat)
+    except (TypeError, ValueError):
+        return None
+    # 排除 NaN/inf 与超出经纬度范围的值
+    if not (-180 <= pt[0] <= 180 and -90 <= pt[1] <= 90):
+        return None
+    return pt
+
+
+def _coord_of(node: Optional[Dict]) -> Optional[Tuple[float, float]]:
+    """取地点的 [lng, lat]；缺失或不是合法数字时返回 None。"""
+    if not isinstance(node, dict):
+        return None
+    c = node.get("坐标")
+    if isinstance(c, (list, tuple)) and len(c) == 2:
+        pt = _point(c[0], c[1])
+        if pt:
+            return pt
+    return _point(node.get("lng"), node.get("lat"))
+
+
+def route_stops(result: Dict) -> List[List[Dict]]:
+    """从结构化输出（详细日程/住宿推荐）提取每天的途经点；格式不对的天与条目跳过。"""
+    if not isinstance(result, dict):
+        return []
+    hotel = result.get("住宿推荐") if isinstance(result.get("住宿推荐"), dict) else None
+    hotel_pt = _coord_of(hotel)
+    schedule = result.get("详细日程")
+    out: List[List[Dict]] = []
+    for day in schedule if isinstance(schedule, list) else []:
+        items = day.get("安排") if isinstance(day, dict) else None
+        spots = []
+        for item in items if isinstance(items, list) else []:
+            pt = _coord_of(item)
+            if pt and item.get("地点"):
+                spots.append({"name": str(item["地点"]), "type": "spot", "lng": pt[0], "lat": pt[1]})
+        stops = list(spots)
+        if hotel_pt and spots:
+            h = {"name": hotel.get("name"), "type": "hotel", "lng": hotel_pt[0], "lat": hotel_pt[1]}
+            stops = [h] + spots + [dict(h)]
+        out.append(stops)
+    return out
+
+
+def _build_provider() -> RouteProvider:
+    # ROUTE_PROVIDER：amap / straight；未设置时有 Web 服务 Key 则用高德，否则直线估算
+    key = getattr(config, "AMAP_REST_KEY", None) or os.environ.get("AMAP_REST_KEY") or ""
+    name = os.environ.get("ROUTE_PROVIDER") or ("amap" if key else "straight")
+    if name == "amap" and key:
+        return AMapRouteProvider(key)
+    return StraightLineProvider()
+
+
+_service: Optional[RoutingService] = None
+_service_lock = threading.Lock()
+
+
+def get_routing_service() -> RoutingService:
+    global _service
+    if _service is None:
+        with _service_lock:
+            if _service is None:
+                _service = RoutingService(
+                    _build_provider(),
+                    memory_max=int(os.environ.get("ROUTE_CACHE_MAX", "4096")),
+                    failure_ttl=float(os.environ.get("ROUTE_FAILURE_TTL", "300")),
+                    concurrency=int(os.environ.get("ROUTE_CONCURRENCY", "4")),
+                )
+    return _service
+
+
+def _budget_seconds() -> float:
+    # 请求内同步计算路线时等待路线服务的总时长上限
+    return float(os.environ.get("ROUTE_BUDGET_SECONDS", "3"))
+
+
+def _usable(routes) -> bool:
+    """保存的路线结构完整且不含直线估算的路段时可直接返回。"""
+    days = routes.get("days")
+    if not isinstance(days, list):
+        return False
+    for day in days:
+        if not isinstance(day, dict) or not isinstance(day.get("legs"), list):
+            return False
+        if any(not isinstance(leg, dict) or leg.get("estimated") for leg in day["legs"]):
+            return False
+    return True
+
+
+def attach_routes(result: Dict, mode: Optional[str]) -> Dict:
+    """把指定出行方式的每日路线写入 result["路线"]，保存计划前调用；返回 result。"""
+    result["路线"] = get_routing_service().plan_routes(result, normalize_mode(mode), _budget_seconds())
+    return result
+
+
+def routes_for(result: Dict, mode: Optional[str]) -> Dict:
+    """读取已保存的路线；出行方式不同、旧计划缺少路线或保存时部分路段为直线估算时，
+    在服务端（经缓存）重新计算，不修改 result。"""
+    mode = normalize_mode(mode)
+    saved = result.get("路线") if isinstance(result, dict) else None
+    if isinstance(saved, dict) and saved.get("mode") == mode and _usable(saved):
+        return saved
+    return get_routing_service().plan_routes(result if isinstance(result, dict) else {}, mode, _budget_seconds())
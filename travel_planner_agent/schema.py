@@ -0,0 +1,358 @@
+import re
+import json
+from typing import Any, Dict, List, Optional
+
+from .tracing import span
+
+
+# ---------- 输出结构 ----------
+# 只包含下游（output / budget / optimizer / geocoding）实际读取的字段；destination、days、people、
+# preferences 由解析结果补齐，不再让模型回写。所有字段都列为 required、禁止额外字段，
+# 可直接用于 OpenAI 兼容接口的严格 json_schema 或函数调用；可缺省的值用 null 表示。
+
+def _obj(props: Dict[str, Dict], title: Optional[str] = None) -> Dict:
+    schema = {"type": "object", "properties": props, "required": list(props), "additionalProperties": False}
+    if title:
+        schema["title"] = title
+    return schema
+
+
+def _arr(items: Dict, description: Optional[str] = None) -> Dict:
+    schema = {"type": "array", "items": items}
+    if description:
+        schema["description"] = description
+    return schema
+
+
+def _nullable(schema: Dict) -> Dict:
+    return dict(schema, type=[schema["type"], "null"])
+
+
+_STR = {"type": "string"}
+_INT = {"type": "integer"}
+_NUM = {"type": "number"}
+
+SPOT_SCHEMA = _obj({
+    "name": _STR, "type": _STR, "open_time": _STR, "ticket_cny": _nullable(_NUM),
+    "duration_hours": _NUM, "suitable": _arr(_STR), "area": _STR,
+})
+MEAL_SCHEMA = _obj({
+    "name": _STR, "cuisine": _STR, "avg_spend_cny": _nullable(_NUM), "area": _STR, "features": _arr(_STR),
+})
+DAY_SCHEMA = _obj({
+    "day": _INT, "theme": _STR, "morning": SPOT_SCHEMA, "afternoon": SPOT_SCHEMA,
+    "evening_meal": MEAL_SCHEMA, "notes": {"type": "string", "description": "一句话"},
+})
+HOTEL_SCHEMA = _obj({"name": _STR, "area": _STR, "price_range_cny": _arr(_INT, "[最低价,最高价]")})
+TRANSPORT_SCHEMA = _obj({
+    "airport_city": _arr(_obj({"route": _STR, "mode": _STR, "cost_cny": _NUM, "duration_min": _INT})),
+    "local": _arr(_obj({"card": _STR, "pass": _nullable(_STR), "benefit": _STR, "cost_cny": _nullable(_NUM)})),
+})
+
+ITINERARY_SCHEMA = _obj(
+    {"city": _STR, "hotel": HOTEL_SCHEMA, "transport": TRANSPORT_SCHEMA, "plan": _arr(DAY_SCHEMA)},
+    title="itinerary",
+)
+SKELETON_SCHEMA = _obj(
+    {"city": _STR, "hotel": HOTEL_SCHEMA, "transport": TRANSPORT_SCHEMA,
+     "skeleton": _arr(_obj({"day": _INT, "theme": _STR, "area": _STR}))},
+    title="skeleton",
+)
+DAYS_SCHEMA = _obj({"plan": _arr(DAY_SCHEMA)}, title="days")
+
+
+_HINT_TYPES = {"string": "str", "integer": "int", "number": "num", "boolean": "bool"}
+
+
+def _types(schema: Dict) -> List[str]:
+    t = schema.get("type")
+    return t if isinstance(t, list) else [t]
+
+
+def schema_hint(schema: Dict) -> str:
+    """把 schema 渲染成写进提示词的紧凑结构说明，如 {name,ticket_cny:num?,suitable:[str]}。
+
+    字符串字段只写字段名，“?”表示可为 null；有 description 的字段用描述代替类型；
+    同一子结构再次出现时写作“同<首次字段名>”。
+    """
+    seen: Dict[int, str] = {}
+
+    def render(node: Dict, key: str) -> str:
+        if "description" in node:
+            return node["description"]
+        if id(node) in seen:
+            return f"同{seen[id(node)]}"
+        types = _types(node)
+        suffix = "?" if "null" in types else ""
+        if "object" in types:
+            seen[id(node)] = key
+            return "{" + ",".join(field(k, v) for k, v in node["properties"].items()) + "}" + suffix
+        if "array" in types:
+            return "[" + render(node["items"], key) + "]" + suffix
+        return _HINT_TYPES.get(types[0], types[0]) + suffix
+
+    def field(key: str, node: Dict) -> str:
+        if _types(node) == ["string"] and "description" not in node:
+            return key
+        return f"{key}:{render(node, key)}"
+
+    return render(schema, "")
+
+
+# ---------- 校验与纠正 ----------
+_INVALID = object()
+_NUMBER = re.compile(r"\d+(?:\.\d+)?")
+
+
+def _numbers(text: str) -> List[float]:
+    if "免费" in text or text.strip().lower() == "free":
+        return [0.0]
+    return [float(x) for x in _NUMBER.findall(text)]
+
+
+def _conform(value: Any, schema: Dict, path: str, errors: List[str]) -> Any:
+    types = _types(schema)
+    if value is None:
+        if "null" in types:
+            return None
+        errors.append(f"{path}: 不能为 null")
+        return _INVALID
+    if "object" in types:
+        if not isinstance(value, dict):
+            errors.append(f"{path}: 应为对象")
+            return _INVALID
+        props = schema["properties"]
+        out = {}
+        for key, sub in props.items():
+            if key not in value:
+                errors.append(f"{path}.{key}: 缺失")
+                continue
+            v = _conform(value[key], sub, f"{path}.{key}", errors)
+            if v is not _INVALID:
+                out[key] = v
+        extra = [k for k in value if k not in props]
+        if extra:
+            errors.append(f"{path}: 多余字段 {','.join(map(str, extra))}")
+        return out
+    if "array" in types:
+        item_schema = schema["items"]
+        if isinstance(value, str) and set(_types(item_schema)) & {"integer", "number"}:
+            # "500-900元" 这类价格区间
+            value = _numbers(value)
+        elif not isinstance(value, list):
+            value = [value]
+        items = []
+        for i, v in enumerate(value):
+            v = _conform(v, item_schema, f"{path}[{i}]", errors)
+            if v is not _INVALID:
+                items.append(v)
+        return items
+    if "integer" in types or "number" in types:
+        if isinstance(value, bool):
+            errors.append(f"{path}: 应为数字")
+            return _INVALID
+        if isinstance(value, str):
+            nums = _numbers(value)
+            if not nums:
+                if "null" in types:
+                    return None
+                errors.append(f"{path}: 应为数字")
+                return _INVALID
+            value = nums[0]
+        if not isinstance(value, (int, float)):
+            errors.append(f"{path}: 应为数字")
+            return _INVALID
+        if "integer" in types or float(value).is_integer():
+            return int(round(value))
+        return value
+    if "string" in types:
+        if isinstance(value, str):
+            return value
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            return str(value)
+        if isinstance(value, list) and all(isinstance(v, str) for v in value):
+            return "；".join(value)
+        errors.append(f"{path}: 应为字符串")
+        return _INVALID
+    return value
+
+
+def conform(data: Any, schema: Dict, errors: Optional[List[str]] = None) -> Any:
+    """按 schema 就地纠正模型输出：去掉多余字段，把 "120元"、"免费"、"500-900" 等转成数字，
+    单个值包成数组；无法纠正的字段直接丢弃，由调用方补默认值。errors 传入列表时追加问题描述。
+    """
+    out = _conform(data, schema, "$", errors if errors is not None else [])
+    if out is _INVALID:
+        return {} if "object" in _types(schema) else []
+    return out
+
+
+# ---------- JSON 修复 ----------
+# 值以外出现的全角标点与 Python 字面量
+_FULLWIDTH = {"，": ",", "：": ":", "“": '"', "”": '"'}
+_LITERALS = {"True": "true", "False": "false", "None": "null", "NaN": "null", "undefined": "null"}
+_TOKEN = re.compile(r"[A-Za-z0-9_.+\-]+")
+_CONTROL = {"\n": "\\n", "\r": "\\r", "\t": "\\t"}
+
+
+def repair_json(text: str) -> Optional[Any]:
+    """修复模型返回中常见的小问题后解析，无法修复时返回 None。
+
+    处理：前后的说明文字与代码块标记、注释、尾逗号、缺逗号、单引号、未加引号的键、
+    字符串内的换行、Python 字面量、全角标点、括号不匹配，以及输出被截断
+    （回退到最后一个完整的值并补齐括号，被截断的字符串值保留已有部分）。
+    """
+    if not text:
+        return None
+    start = next((i for i, ch in enumerate(text) if ch in "{["), None)
+    if start is None:
+        return None
+    out: List[str] = []
+    stack: List[str] = []
+    key_mode: List[bool] = []  # 每层对象当前是否在等待键
+    quote = None  # 当前字符串的引号字符；None 表示不在字符串内
+    string_is_key = escape = need_comma = False
+    pending_key: Optional[int] = None  # 已写出但还没有值的键在 out 中的起点
+    safe = (0, ())  # (out 长度, 栈)：截断时回退到的最近一个完整值之后
+    i, n = start, len(text)
+    while i < n:
+        ch = text[i]
+        if quote:
+            if escape:
+                escape = False
+                out.append(ch)
+            elif ch == "\\":
+                escape = True
+                out.append(ch)
+            elif ch == quote:
+                quote = None
+                out.append('"')
+                if not string_is_key:
+                    need_comma = True
+                    safe = (len(out), tuple(stack))
+            elif ch == '"':
+                out.append('\\"')
+            elif ch in _CONTROL:
+                out.append(_CONTROL[ch])
+            elif ch >= " ":
+                out.append(ch)
+            i += 1
+            continue
+        raw = ch
+        ch = _FULLWIDTH.get(ch, ch)
+        if ch.isspace():
+            i += 1
+            continue
+        if text.startswith("//", i):
+            j = text.find("\n", i)
+            i = n if j < 0 else j
+            continue
+        if text.startswith("/*", i):
+            j = text.find("*/", i + 2)
+            i = n if j < 0 else j + 2
+            continue
+        if ch in "}]":
+            want = "{" if ch == "}" else "["
+            if want not in stack:
+                i += 1
+                continue
+            if pending_key is not None:
+                del out[pending_key:]
+                pending_key = None
+            while out and out[-1] == ",":
+                out.pop()
+            opener = stack.pop()
+            key_mode.pop()
+            out.append("}" if opener == "{" else "]")
+            need_comma = True
+            if not stack:
+                break
+            safe = (len(out), tuple(stack))
+            if opener == want:
+                i += 1
+            # 不匹配时先补上内层的右括号，当前字符留到下一轮再处理
+            continue
+        if ch == ",":
+            if out and out[-1] not in ",{[":
+                out.append(",")
+            need_comma = False
+            if stack[-1] == "{":
+                key_mode[-1] = True
+            i += 1
+            continue
+        if ch == ":":
+            if stack[-1] == "{" and pending_key is not None and out[-1] != ":":
+                out.append(":")
+                key_mode[-1] = False
+            i += 1
+            continue
+        if need_comma:
+            out.append(",")
+            need_comma = False
+            if stack[-1] == "{":
+                key_mode[-1] = True
+        is_key = bool(stack) and stack[-1] == "{" and key_mode[-1]
+        if ch in "\"'":
+            quote = "”" if raw == "“" else ch
+            string_is_key = is_key
+            pending_key = len(out) if is_key else None
+            out.append('"')
+            i += 1
+            continue
+        if ch in "{[":
+            if is_key:
+                i += 1
+                continue
+            stack.append(ch)
+            key_mode.append(ch == "{")
+            out.append(ch)
+            pending_key = None
+            safe = (len(out), tuple(stack))
+            i += 1
+            continue
+        m = _TOKEN.match(text, i)
+        if m is None:
+            # 值以外无法识别的字符（如夹在字段间的说明文字）直接丢弃
+            i += 1
+            continue
+        tok = m.group()
+        i = m.end()
+        if is_key:
+            pending_key = len(out)
+            out.append(json.dumps(tok))
+            continue
+        out.append(_LITERALS.get(tok, tok))
+        pending_key = None
+        need_comma = True
+        if i < n:
+            # 位于文本末尾的数字可能被截断，不作为回退点
+            safe = (len(out), tuple(stack))
+
+    candidates = []
+    if stack:
+        if quote and not string_is_key:
+            if escape:
+                out.pop()
+            candidates.append(out + ['"'] + [("}" if o == "{" else "]") for o in reversed(stack)])
+        cut, opened = safe
+        candidates.append(out[:cut] + [("}" if o == "{" else "]") for o in reversed(opened)])
+    else:
+        candidates.append(out)
+    for parts in candidates:
+        try:
+            return json.loads("".join(parts))
+        except ValueError:
+            continue
+    return None
+
+
+def loads_json(content: Optional[str]) -> Optional[Any]:
+    """先按标准 JSON 解析，失败时本地修复；修复次数与耗时计入 llm.json_repair 指标。"""
+    if not content:
+        return None
+    try:
+        return json.loads(content)
+    except (TypeError, ValueError):
+        pass
+    with span("llm.json_repair"):
+        return repair_json(content)
@@ -0,0 +1,114 @@
+import re
+import json
+from typing import Dict, List, Optional, Tuple
+
+
+# SQLite 自带的 unicode61 分词器会把连续的汉字当成一个词，
+# 这里在写入与查询时把汉字拆成单字，查询时按短语匹配相邻单字。
+# 单字之间插入 U+2063（不可见分隔符）而不是空格：分词器同样把它当作分隔，
+# 且正文中不会出现，desegment 删除它即可还原原文，原有的空格保持不变。
+SEG = "\u2063"
+_CJK = "\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff"
+_CJK_RE = re.compile(f"([{_CJK}])")
+_WORD_RE = re.compile(r"\w+")
+
+# highlight() 使用的标记，取私有区字符，避免与正文冲突
+HL_START = "\ue000"
+HL_END = "\ue001"
+
+# 同一列中多个值（如各天景点）之间的分隔符，高亮结果中相邻的值不会连成一个词（如“浅草寺东京晴空塔”）
+VALUE_SEPARATOR = " / "
+
+# 索引列（顺序与 plans_fts 一致）及打分权重：标题 > 目的地 > 景点 > 餐厅/酒店
+SEARCH_COLUMNS = ("title", "destination", "places", "restaurants", "hotel")
+SEARCH_WEIGHTS = (10.0, 5.0, 2.0, 1.0, 1.0)
+
+
+def segment(text: Optional[str]) -> str:
+    if not text:
+        return ""
+    return _CJK_RE.sub(SEG + r"\1" + SEG, str(text).replace(SEG, ""))
+
+
+def desegment(text: str) -> str:
+    """去掉 segment 插入的分隔符，还原原文。"""
+    return (text or "").replace(SEG, "")
+
+
+def _uniq(items) -> List[str]:
+    seen, out = set(), []
+    for x in items:
+        if x and isinstance(x, str) and x not in seen:
+            seen.add(x)
+            out.append(x)
+    return out
+
+
+def extract_search_fields(title: str, data_json: str, summary: Optional[Dict] = None) -> Dict[str, str]:
+    """从保存的结果中取出可检索的文本：标题、目的地、景点、餐厅、酒店（均已分字）。"""
+    try:
+        data = json.loads(data_json) if data_json else {}
+    except Exception:
+        data = {}
+    if not isinstance(data, dict):
+        data = {}
+    overview = data.get("行程概览") or {}
+    summary = summary or {}
+    places, restaurants = [], []
+    for day in data.get("详细日程") or []:
+        for item in (day or {}).get("安排") or []:
+            if not isinstance(item, dict):
+                continue
+            places.append(item.get("地点"))
+            restaurants.append(item.get("餐厅"))
+    hotel = data.get("住宿推荐") or {}
+    hotel_text = VALUE_SEPARATOR.join(_uniq([hotel.get("name"), hotel.get("area")])) if isinstance(hotel, dict) else str(hotel)
+    destination = VALUE_SEPARATOR.join(_uniq([
+        overview.get("目的地") or summary.get("destination"),
+        overview.get("城市") or summary.get("city"),
+    ]))
+    return {
+        "title": segment(title),
+        "destination": segment(destination),
+        "places": segment(VALUE_SEPARATOR.join(_uniq(places))),
+        "restaurants": segment(VALUE_SEPARATOR.join(_uniq(restaurants))),
+        "hotel": segment(hotel_text),
+    }
+
+
+def score_highlights(texts) -> float:
+    """按列权重累计 highlight() 结果中的命中次数，作为相关度。"""
+    score = 0.0
+    for weight, text in zip(SEARCH_WEIGHTS, texts):
+        if text:
+            score += weight * text.count(HL_START)
+    return score
+
+
+def query_terms(q: str, max_terms: int = 8) -> List[str]:
+    """按空格拆分用户输入，每个词只保留字母数字与汉字（已分字）。"""
+    terms = []
+    for term in (q or "").split()[:max_terms]:
+        tokens = _WORD_RE.findall(segment(term))
+        if tokens:
+            terms.append(" ".join(tokens))
+    return terms
+
+
+def build_match_query(q: str) -> Optional[str]:
+    """把用户输入转换为 FTS5 查询：每个词作为一个短语，多个词之间为 AND。
+
+    用户输入中的引号、运算符不会进入 MATCH 语法。
+    """
+    phrases = ['"' + t + '"' for t in query_terms(q)]
+    return " AND ".join(phrases) if phrases else None
+
+
+def highlight_parts(text: str) -> List[Tuple[str, bool]]:
+    """把 highlight() 的结果拆成 [(文本, 是否命中)]，交给模板转义输出。"""
+    text = desegment(text or "")
+    parts: List[Tuple[str, bool]] = []
+    for i, chunk in enumerate(re.split(f"[{HL_START}{HL_END}]", text)):
+        if chunk:
+            parts.append((chunk, i % 2 == 1))
+    return parts
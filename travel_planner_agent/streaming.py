@@ -0,0 +1,122 @@
+import json
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+from .llm import ask_stream_async, _itinerary_messages, _normalize_itinerary
+from .schema import ITINERARY_SCHEMA, DAY_SCHEMA, HOTEL_SCHEMA, TRANSPORT_SCHEMA, conform, loads_json
+
+
+# 顶层字段中需要在完成后立即推送的对象/数组
+STREAM_FIELDS = ("hotel", "transport")
+
+# 推送前按 schema 纠正各片段，与最终结果保持一致
+_FRAGMENT_SCHEMAS = {"hotel": HOTEL_SCHEMA, "transport": TRANSPORT_SCHEMA, "day": DAY_SCHEMA}
+
+
+class PlanStreamParser:
+    """增量扫描 LLM 流式返回的行程 JSON。
+
+    每次 feed 一段文本，返回本段中新完成的片段：
+    - ("hotel", {...}) / ("transport", {...})：顶层字段的值闭合时
+    - ("day", {...})：plan 数组中的某一天闭合时
+    只跟踪括号深度与字符串转义，不做完整语法校验；最终结果仍以整体解析为准。
+    """
+
+    def __init__(self):
+        self.text = ""
+        self.pos = 0
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        self.expect_key = False
+        self.key_start: Optional[int] = None
+        self.current_key: Optional[str] = None
+        self.value_start: Optional[int] = None
+        self.item_start: Optional[int] = None
+
+    def feed(self, chunk: str) -> List[Tuple[str, Any]]:
+        self.text += chunk
+        text = self.text
+        events: List[Tuple[str, Any]] = []
+        for i in range(self.pos, len(text)):
+            ch = text[i]
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif ch == "\\":
+                    self.escape = True
+                elif ch == '"':
+                    self.in_string = False
+                    if self.key_start is not None:
+                        self.current_key = text[self.key_start + 1:i]
+                        self.key_start = None
+                continue
+            if ch == '"':
+                self.in_string = True
+                if self.depth == 1 and self.expect_key:
+                    self.key_start = i
+                    self.expect_key = False
+            elif ch in "{[":
+                self.depth += 1
+                if self.depth == 1:
+                    self.expect_key = True
+                elif self.depth == 2:
+                    self.value_start = i
+                elif self.depth == 3 and self.current_key == "plan" and ch == "{":
+                    self.item_start = i
+            elif ch in "}]":
+                if self.depth == 3 and self.item_start is not None:
+                    ev = self._load("day", text[self.item_start:i + 1])
+                    if ev:
+                        events.append(ev)
+                    self.item_start = None
+                elif self.depth == 2 and self.value_start is not None:
+                    if self.current_key in STREAM_FIELDS:
+                        ev = self._load(self.current_key, text[self.value_start:i + 1])
+                        if ev:
+                            events.append(ev)
+                    self.value_start = None
+                self.depth -= 1
+            elif ch == "," and self.depth == 1:
+                self.expect_key = True
+        self.pos = len(text)
+        return events
+
+    @staticmethod
+    def _load(kind: str, raw: str) -> Optional[Tuple[str, Any]]:
+        data = loads_json(raw)
+        if not isinstance(data, dict):
+            return None
+        return kind, conform(data, _FRAGMENT_SCHEMAS[kind])
+
+
+def sse(event: str, data: Any) -> str:
+    """编码一条 Server-Sent Events 消息。"""
+    payload = json.dumps(data, ensure_ascii=False)
+    return f"event: {event}\ndata: {payload}\n\n"
+
+
+def merge_partial(events: List[Tuple[str, Any]]) -> Dict[str, Any]:
+    """把已收到的片段合并为不完整的行程 dict，便于在流中断时兜底。"""
+    out: Dict[str, Any] = {"plan": []}
+    for kind, val in events:
+        if kind == "day":
+            out["plan"].append(val)
+        else:
+            out[kind] = val
+    return out
+
+
+async def stream_itinerary_llm(parsed: Dict) -> AsyncIterator[Tuple[str, Any]]:
+    """流式生成行程：边接收边产出 hotel/transport/day 片段，最后产出 ("itinerary", 完整行程)。"""
+    parser = PlanStreamParser()
+    seen: List[Tuple[str, Any]] = []
+    async for delta in ask_stream_async(_itinerary_messages(parsed), temperature=0.5, stage="itinerary",
+                                        schema=ITINERARY_SCHEMA):
+        for ev in parser.feed(delta):
+            seen.append(ev)
+            yield ev
+    content = parser.text
+    if not isinstance(loads_json(content), dict) and seen:
+        # 本地修复也失败时，用已完整收到的片段兜底，而不是返回空行程
+        content = json.dumps(merge_partial(seen), ensure_ascii=False)
+    yield "itinerary", _normalize_itinerary(parsed, content)
@@ -0,0 +1,246 @@
+import os
+import json
+import time
+import random
+import bisect
+import logging
+import asyncio
+import functools
+import threading
+import contextvars
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+
+# TRACING=0 关闭：span() 返回共享的空上下文，traced 装饰器原样返回函数，几乎没有额外开销
+ENABLED = os.environ.get("TRACING", "1") == "1"
+
+# 直方图桶上限（秒），覆盖数据库的毫秒级到 LLM 的分钟级
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+# 单条 trace 最多记录的 span 数，防止长任务无限增长
+MAX_SPANS = 256
+
+_log = logging.getLogger("travel_planner.trace")
+
+
+class _Histogram:
+    __slots__ = ("counts", "total", "count", "errors")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.total = 0.0
+        self.count = 0
+        self.errors = 0
+
+
+class MetricsRegistry:
+    """进程内的各阶段耗时直方图（按 span 名称），可导出为 Prometheus 文本格式。"""
+
+    def __init__(self):
+        self._hist: Dict[str, _Histogram] = {}
+        self._lock = threading.Lock()
+        self.slow_traces = 0
+
+    def observe(self, name: str, seconds: float, error: bool = False) -> None:
+        idx = bisect.bisect_left(BUCKETS, seconds)
+        with self._lock:
+            h = self._hist.get(name)
+            if h is None:
+                h = self._hist[name] = _Histogram()
+            h.counts[idx] += 1
+            h.total += seconds
+            h.count += 1
+            if error:
+                h.errors += 1
+
+    def count_slow(self) -> None:
+        with self._lock:
+            self.slow_traces += 1
+
+    def snapshot(self) -> Dict[str, Dict]:
+        with self._lock:
+            return {
+                name: {"count": h.count, "sum": h.total, "errors": h.errors, "buckets": list(h.counts)}
+                for name, h in self._hist.items()
+            }
+
+    def render_prometheus(self) -> str:
+        snap = self.snapshot()
+        lines = [
+            "# HELP travel_planner_span_seconds 各阶段耗时（秒）",
+            "# TYPE travel_planner_span_seconds histogram",
+        ]
+        for name in sorted(snap):
+            h = snap[name]
+            label = f'span="{_escape(name)}"'
+            acc = 0
+            for le, n in zip(BUCKETS, h["buckets"]):
+                acc += n
+                lines.append(f'travel_planner_span_seconds_bucket{{{label},le="{le}"}} {acc}')
+            lines.append(f'travel_planner_span_seconds_bucket{{{label},le="+Inf"}} {h["count"]}')
+            lines.append(f"travel_planner_span_seconds_sum{{{label}}} {h['sum']:.6f}")
+            lines.append(f"travel_planner_span_seconds_count{{{label}}} {h['count']}")
+        lines += [
+            "# HELP travel_planner_span_errors_total 以异常结束的 span 数",
+            "# TYPE travel_planner_span_errors_total counter",
+        ]
+        for name in sorted(snap):
+            lines.append(f'travel_planner_span_errors_total{{span="{_escape(name)}"}} {snap[name]["errors"]}')
+        lines += [
+            "# HELP travel_planner_slow_traces_total 超过慢请求阈值的请求数",
+            "# TYPE travel_planner_slow_traces_total counter",
+            f"travel_planner_slow_traces_total {self.slow_traces}",
+        ]
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+registry = MetricsRegistry()
+
+
+class Trace:
+    """一次请求（或后台任务）内的 span 记录：(名称, 相对开始毫秒, 耗时毫秒, 异常类型)。"""
+
+    __slots__ = ("name", "start", "spans")
+
+    def __init__(self, name: str):
+        self.name = name
+        self.start = time.perf_counter()
+        self.spans: List[tuple] = []
+
+
+_current: contextvars.ContextVar = contextvars.ContextVar("travel_planner_trace", default=None)
+
+
+class _Span:
+    __slots__ = ("name", "t0")
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        dt = time.perf_counter() - self.t0
+        registry.observe(self.name, dt, exc_type is not None)
+        tr = _current.get()
+        if tr is not None and len(tr.spans) < MAX_SPANS:
+            tr.spans.append((
+                self.name,
+                round((self.t0 - tr.start) * 1000, 1),
+                round(dt * 1000, 1),
+                exc_type.__name__ if exc_type else None,
+            ))
+        return False
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NOOP = _NoopSpan()
+
+
+def span(name: str):
+    """计时上下文：with span("llm.ask"): ...；耗时计入直方图，并附加到当前 trace。"""
+    return _Span(name) if ENABLED else _NOOP
+
+
+def traced(name: Optional[str] = None):
+    """函数装饰器版本的 span，默认名称为“模块名.函数名”，支持 async 函数。"""
+    def deco(fn):
+        if not ENABLED:
+            return fn
+        label = name or f"{fn.__module__.rsplit('.', 1)[-1]}.{fn.__name__}"
+        if asyncio.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with _Span(label):
+                    return await fn(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with _Span(label):
+                return fn(*args, **kwargs)
+        return wrapper
+    return deco
+
+
+def _slow_ms() -> float:
+    return float(os.environ.get("TRACE_SLOW_MS", "3000"))
+
+
+def _sample_rate() -> float:
+    return float(os.environ.get("TRACE_SAMPLE_RATE", "1"))
+
+
+_log_lock = threading.Lock()
+
+
+def _write_slow(tr: Trace, duration_ms: float, error: Optional[str]) -> None:
+    record = json.dumps({
+        "ts": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "trace": tr.name,
+        "duration_ms": round(duration_ms, 1),
+        "error": error,
+        "spans": [{"name": n, "start_ms": s, "ms": d, "error": e} for n, s, d, e in tr.spans],
+    }, ensure_ascii=False)
+    # TRACE_LOG_PATH 指定时按行追加 JSON，否则写入 travel_planner.trace 日志
+    path = os.environ.get("TRACE_LOG_PATH")
+    if path:
+        with _log_lock, open(path, "a", encoding="utf-8") as f:
+            f.write(record + "\n")
+    else:
+        _log.warning(record)
+
+
+@contextmanager
+def trace(name: str):
+    """根 span：在其中执行的 span 都记到同一条 trace 上。
+
+    耗时超过 TRACE_SLOW_MS（默认 3000）毫秒的 trace 按 TRACE_SAMPLE_RATE 抽样写入慢请求日志。
+    可在结束前修改 trace.name（例如路由匹配后改为路由模板）。
+    """
+    if not ENABLED:
+        yield None
+        return
+    tr = Trace(name)
+    token = _current.set(tr)
+    error = None
+    try:
+        yield tr
+    except BaseException as e:
+        error = type(e).__name__
+        raise
+    finally:
+        _current.reset(token)
+        dt = time.perf_counter() - tr.start
+        registry.observe(tr.name, dt, error is not None)
+        if dt * 1000 >= _slow_ms():
+            registry.count_slow()
+            if random.random() < _sample_rate():
+                try:
+                    _write_slow(tr, dt * 1000, error)
+                except Exception:
+                    pass
+
+
+def current_trace() -> Optional[Trace]:
+    return _current.get()
+
+
+def render_metrics() -> str:
+    return registry.render_prometheus()
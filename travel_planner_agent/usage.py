@@ -0,0 +1,277 @@
+import os
+import time
+import atexit
+import datetime
+import threading
+import contextvars
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+
+from . import db
+from . import db_async
+
+
+class QuotaExceeded(RuntimeError):
+    """用户当日 LLM token 用量已达上限。"""
+
+
+# 当前请求/任务所属用户，由 web 层设置；未设置时用量记在空串用户下，且不做配额检查
+current_user: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("llm_usage_user", default=None)
+
+
+@contextmanager
+def as_user(user_id: Optional[str]):
+    token = current_user.set(str(user_id) if user_id else None)
+    try:
+        yield
+    finally:
+        current_user.reset(token)
+
+
+def _today() -> str:
+    # 配额按服务器本地日期重置
+    return datetime.date.today().isoformat()
+
+
+def _tokens(usage: Any) -> tuple:
+    """兼容 OpenAI SDK 的 CompletionUsage 对象与普通 dict。"""
+    if usage is None:
+        return 0, 0
+    if isinstance(usage, dict):
+        return int(usage.get("prompt_tokens") or 0), int(usage.get("completion_tokens") or 0)
+    return int(getattr(usage, "prompt_tokens", 0) or 0), int(getattr(usage, "completion_tokens", 0) or 0)
+
+
+def _parse_overrides(text: str) -> Dict[str, int]:
+    # "用户ID=tokens,用户ID=tokens"；0 表示不限
+    out: Dict[str, int] = {}
+    for part in (text or "").split(","):
+        if "=" in part:
+            uid, _, n = part.partition("=")
+            try:
+                out[uid.strip()] = int(n)
+            except ValueError:
+                continue
+    return out
+
+
+class UsageRecorder:
+    """LLM 用量记录与每日配额。
+
+    record 只在内存中按 (日期, 用户, 阶段, 模型) 累加，由后台线程每 flush_interval 秒
+    （或待写条目超过 max_pending 时）批量 upsert 到 llm_usage 表，不占用请求路径。
+    配额检查读取“数据库已写入 + 内存待写入”的当日用量；数据库部分缓存 refresh_seconds 秒，
+    多进程部署时其它进程的用量最多延迟这么久可见。配额是软限制：已在途的调用不会被中断。
+    """
+
+    def __init__(self, daily_quota: int = 0, overrides: Optional[Dict[str, int]] = None,
+                 flush_interval: float = 5.0, max_pending: int = 500, refresh_seconds: float = 30.0,
+                 price_input_per_m: float = 2.0, price_output_per_m: float = 8.0):
+        self.daily_quota = daily_quota
+        self.overrides = overrides or {}
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.refresh_seconds = refresh_seconds
+        self.price_input_per_m = price_input_per_m
+        self.price_output_per_m = price_output_per_m
+        self._pending: Dict[tuple, List[int]] = {}
+        # 用户 -> (日期, 读取时间, 数据库中的当日用量)
+        self._db_used: Dict[str, tuple] = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.flushes = 0
+        self.flush_errors = 0
+
+    # ---------- 记录 ----------
+    def record(self, stage: str, model: str, usage: Any, user_id: Optional[str] = None) -> None:
+        prompt, completion = _tokens(usage)
+        if not (prompt or completion):
+            return
+        uid = str(user_id or current_user.get() or "")
+        key = (_today(), uid, stage, model)
+        with self._lock:
+            row = self._pending.get(key)
+            if row is None:
+                row = self._pending[key] = [0, 0, 0]
+            row[0] += 1
+            row[1] += prompt
+            row[2] += completion
+            full = len(self._pending) >= self.max_pending
+        self._ensure_thread()
+        if full:
+            self._wake.set()
+
+    def flush(self) -> int:
+        """把内存中的用量写入数据库，返回写入的条目数；失败时放回内存下次重试。"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+        rows = [k + tuple(v) for k, v in pending.items()]
+        try:
+            db.add_llm_usage(rows)
+        except Exception:
+            with self._lock:
+                self.flush_errors += 1
+                for k, v in pending.items():
+                    row = self._pending.setdefault(k, [0, 0, 0])
+                    for i in range(3):
+                        row[i] += v[i]
+            return 0
+        with self._lock:
+            self.flushes += 1
+            # 已写入的部分由数据库提供，丢弃缓存的数据库用量以免重复或遗漏
+            for _, uid, _, _ in pending:
+                self._db_used.pop(uid, None)
+        return len(rows)
+
+    def _ensure_thread(self) -> None:
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="llm-usage-flush", daemon=True)
+                    self._thread.start()
+                    atexit.register(self.flush)
+
+    def _run(self) -> None:
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self.flush()
+
+    # ---------- 配额 ----------
+    def quota_for(self, user_id: str) -> int:
+        return self.overrides.get(str(user_id), self.daily_quota)
+
+    def _cached_used(self, uid: str, day: str):
+        """返回 (缓存的数据库用量，过期时为 None；内存中尚未写入的用量)。"""
+        now = time.monotonic()
+        with self._lock:
+            cached = self._db_used.get(uid)
+            pending = sum(v[1] + v[2] for k, v in self._pending.items() if k[0] == day and k[1] == uid)
+        if cached is None or cached[0] != day or now - cached[1] > self.refresh_seconds:
+            return None, pending
+        return cached[2], pending
+
+    def _store_used(self, uid: str, day: str, used: int) -> None:
+        with self._lock:
+            self._db_used[uid] = (day, time.monotonic(), used)
+
+    def used_today(self, user_id: str) -> int:
+        uid = str(user_id)
+        day = _today()
+        used, pending = self._cached_used(uid, day)
+        if used is None:
+            used = db.get_user_tokens(uid, day)
+            self._store_used(uid, day, used)
+        return used + pending
+
+    async def used_today_async(self, user_id: str) -> int:
+        """used_today 的异步版本：缓存过期时在数据库线程池中查询，不阻塞事件循环。"""
+        uid = str(user_id)
+        day = _today()
+        used, pending = self._cached_used(uid, day)
+        if used is None:
+            used = await db_async.get_user_tokens(uid, day)
+            self._store_used(uid, day, used)
+        return used + pending
+
+    def _quota_user(self, user_id: Optional[str]) -> Optional[str]:
+        # 未登录或未设置配额时返回 None，不检查
+        uid = user_id or current_user.get()
+        if not uid or self.quota_for(uid) <= 0:
+            return None
+        return uid
+
+    def _raise_if_over(self, uid: str, used: int) -> None:
+        quota = self.quota_for(uid)
+        if used >= quota:
+            raise QuotaExceeded(f"今日 LLM 用量已达上限（{used}/{quota} tokens），请明天再试")
+
+    def check(self, user_id: Optional[str] = None) -> None:
+        """调用 LLM 前检查配额，超出时抛出 QuotaExceeded；未登录或未设置配额时不检查。"""
+        uid = self._quota_user(user_id)
+        if uid:
+            self._raise_if_over(uid, self.used_today(uid))
+
+    async def check_async(self, user_id: Optional[str] = None) -> None:
+        """check 的异步版本，供 ask_async 等在事件循环中调用。"""
+        uid = self._quota_user(user_id)
+        if uid:
+            self._raise_if_over(uid, await self.used_today_async(uid))
+
+    # ---------- 汇总 ----------
+    def cost(self, prompt_tokens: int, completion_tokens: int) -> float:
+        return round(prompt_tokens * self.price_input_per_m / 1e6 + completion_tokens * self.price_output_per_m / 1e6, 4)
+
+    def _totals(self, rows: List[Dict], key: str) -> List[Dict]:
+        agg: Dict[str, List[int]] = {}
+        for r in rows:
+            a = agg.setdefault(r[key], [0, 0, 0])
+            a[0] += r["calls"]
+            a[1] += r["prompt_tokens"]
+            a[2] += r["completion_tokens"]
+        out = [
+            {key: k, "calls": c, "prompt_tokens": p, "completion_tokens": o,
+             "total_tokens": p + o, "cost_cny": self.cost(p, o)}
+            for k, (c, p, o) in agg.items()
+        ]
+        out.sort(key=lambda x: -x["total_tokens"])
+        return out
+
+    def user_summary(self, user_id: str, days: int = 7) -> Dict:
+        """/account 展示用：今日用量与配额，近 days 天按日期、阶段汇总。"""
+        self.flush()
+        since = (datetime.date.today() - datetime.timedelta(days=days - 1)).isoformat()
+        rows = db.get_llm_usage(since, str(user_id))
+        used = self.used_today(user_id)
+        quota = self.quota_for(user_id)
+        return {
+            "today_tokens": used,
+            "quota": quota,
+            "remaining": max(quota - used, 0) if quota > 0 else None,
+            "days": days,
+            "by_day": sorted(self._totals(rows, "day"), key=lambda x: x["day"], reverse=True),
+            "by_stage": self._totals(rows, "stage"),
+            "total_tokens": sum(r["prompt_tokens"] + r["completion_tokens"] for r in rows),
+            "total_cost_cny": self.cost(sum(r["prompt_tokens"] for r in rows), sum(r["completion_tokens"] for r in rows)),
+        }
+
+    def admin_summary(self, days: int = 7, top: int = 50) -> Dict:
+        """管理接口：近 days 天按用户、阶段、模型、日期汇总，用户按 token 数降序取前 top 个。"""
+        self.flush()
+        since = (datetime.date.today() - datetime.timedelta(days=days - 1)).isoformat()
+        rows = db.get_llm_usage(since)
+        users = self._totals(rows, "user_id")
+        for u in users:
+            # 空串为未登录调用，不受配额约束
+            u["quota"] = self.quota_for(u["user_id"]) if u["user_id"] else None
+        return {
+            "since": since,
+            "price_cny_per_m": {"input": self.price_input_per_m, "output": self.price_output_per_m},
+            "users": users[:top],
+            "by_stage": self._totals(rows, "stage"),
+            "by_model": self._totals(rows, "model"),
+            "by_day": sorted(self._totals(rows, "day"), key=lambda x: x["day"]),
+            "recorder": {"flushes": self.flushes, "flush_errors": self.flush_errors},
+        }
+
+
+_recorder: Optional[UsageRecorder] = None
+_recorder_lock = threading.Lock()
+
+
+def get_usage_recorder() -> UsageRecorder:
+    global _recorder
+    if _recorder is None:
+        with _recorder_lock:
+            if _recorder is None:
+                _recorder = UsageRecorder(
+                    daily_quota=int(os.environ.get("LLM_USER_DAILY_TOKENS", "0")),
+                    overrides=_parse_overrides(os.environ.get("LLM_USER_QUOTAS", "")),
+                    flush_interval=float(os.environ.get("LLM_USAGE_FLUSH_SECONDS", "5")),
+                    price_input_per_m=float(os.environ.get("LLM_PRICE_INPUT_PER_M", "2")),
+                    price_output_per_m=float(os.environ.get("LLM_PRICE_OUTPUT_PER_M", "8")),
+                )
+    return _recorder
@@ -1,46 +1,176 @@
-from fastapi import FastAPI, Request, Form, UploadFile, File
-from fastapi.responses import FileResponse, RedirectResponse
+from fastapi import FastAPI, Request, Form, UploadFile, File, Query, WebSocket
+from fastapi.responses import RedirectResponse, StreamingResponse, PlainTextResponse, JSONResponse
 from fastapi.staticfiles import StaticFiles
 from starlette.templating import Jinja2Templates
 from starlette.middleware.sessions import SessionMiddleware
-from tempfile import NamedTemporaryFile
+from itsdangerous import URLSafeSerializer, BadSignature
 from typing import Optional, List
 from datetime import datetime
 import re
 import os
 import json
+import asyncio
+import jinja2
 
-from travel_planner_agent import plan_trip, export_json, export_csv
+from travel_planner_agent import plan_trip_async, plan_trip_form_async, plan_trip_form_stream, compose_form_text, iter_json, iter_csv
 from travel_planner_agent import config as tp_config
-from travel_planner_agent.providers import transcribe_wav16_xfyun_ws
+from travel_planner_agent.providers import transcribe_wav16_xfyun_ws_timed
+from travel_planner_agent.asr import ASRError, get_asr_manager
+from travel_planner_agent.streaming import sse
 from travel_planner_agent.db import (
     init_db,
-    create_user,
-    verify_user,
     get_user_by_id,
+    invalidate_user,
+    request_db_stats,
     # we will implement password update in db module
     # function name: update_user_password
     # for Supabase: use auth.update_user; for SQLite: update hash & salt
     # import here; will add implementation in db.py
     
     create_plan,
-    list_plans,
+    list_plans_page,
+    search_plans,
     get_plan,
     delete_plan,
+    get_job,
 )
+from travel_planner_agent import db_async
+from travel_planner_agent.jobs import JobQueue, JobQueueFull
+from travel_planner_agent.knowledge import get_knowledge_base
+from travel_planner_agent.passwords import PasswordHashBusy, get_hasher
+from travel_planner_agent.ratelimit import RateLimiter
+from travel_planner_agent.routing import attach_routes, routes_for
+from travel_planner_agent import tracing
+from travel_planner_agent.tracing import span, trace
+from travel_planner_agent.usage import QuotaExceeded, as_user, get_usage_recorder
 
 
 app = FastAPI(title="AI旅行规划师")
 app.mount("/static", StaticFiles(directory="static"), name="static")
 templates = Jinja2Templates(directory="templates")
 
+
+class _TracedTemplate(jinja2.Template):
+    # 模板渲染计入 render.<模板名> span
+    def render(self, *args, **kwargs):
+        with span(f"render.{self.name}"):
+            return super().render(*args, **kwargs)
+
+
+if tracing.ENABLED:
+    templates.env.template_class = _TracedTemplate
+
 # 会话中间件，用于登录状态
-app.add_middleware(SessionMiddleware, secret_key=os.environ.get("SESSION_SECRET", "change-me-please"))
+SESSION_SECRET = os.environ.get("SESSION_SECRET", "change-me-please")
+app.add_middleware(SessionMiddleware, secret_key=SESSION_SECRET)
+
+@app.middleware("http")
+async def _db_stats_middleware(request: Request, call_next):
+    # 统计本次请求因用户缓存命中而省去的数据库往返，写入响应头便于观测
+    stats = {"saved": 0}
+    token = request_db_stats.set(stats)
+    try:
+        response = await call_next(request)
+    finally:
+        request_db_stats.reset(token)
+    response.headers["X-DB-Roundtrips-Saved"] = str(stats["saved"])
+    return response
+
+
+@app.middleware("http")
+async def _trace_middleware(request: Request, call_next):
+    # 每个请求一条 trace，名称为“方法 路由模板”（避免按计划 ID 等路径参数分裂指标）；
+    # 流式响应只统计到响应头发出为止
+    if request.url.path.startswith("/static/"):
+        return await call_next(request)
+    with trace(f"http {request.method}") as tr:
+        response = await call_next(request)
+        if tr is not None:
+            route = request.scope.get("route")
+            tr.name = f"http {request.method} {getattr(route, 'path', 'unmatched')}"
+    return response
+
+
+# 导出令牌：对生成结果签名，导出时直接使用令牌中的结果，无需重新调用LLM
+_export_signer = URLSafeSerializer(SESSION_SECRET, salt="plan-export")
+
+
+# =============== 规划参数 ===============
+def _compute_days(days: Optional[int], start_date: str, end_date: str) -> Optional[int]:
+    # 计算天数（若提供了日期范围）
+    if days or not (start_date and end_date):
+        return days
+    try:
+        delta = (datetime.fromisoformat(end_date) - datetime.fromisoformat(start_date)).days + 1
+        return delta if delta > 0 else days
+    except Exception:
+        return days
+
+
+def _opt_int(v) -> Optional[int]:
+    try:
+        return int(v) if v not in (None, "") else None
+    except (TypeError, ValueError):
+        return None
+
+
+def _plan_fields(destination, start_date, end_date, days, budget_cny, adults, children, preferences, cities_text, extra_info) -> dict:
+    # 城市列表（可多个）
+    cities_list = [c for c in re.split(r"[，,\s]+", (cities_text or "").strip()) if c]
+    return {
+        "destination": destination,
+        "start_date": start_date,
+        "end_date": end_date,
+        "days": days,
+        "budget_cny": budget_cny,
+        "adults": adults,
+        "children": children,
+        "preferences": preferences,
+        "cities": cities_list,
+        "extra_info": extra_info,
+    }
+
+
+async def _run_plan(text: str, fields: dict, user_id: Optional[str] = None):
+    # PLAN_MODE=form（默认）：表单字段直接作为参数，仅一次 LLM 调用
+    # PLAN_MODE=text：拼接为自然语言，先由 LLM 解析再生成行程
+    # LLM 用量记在 user_id 名下；当日配额已用尽时直接报错，而不是静默回退为静态行程
+    await get_usage_recorder().check_async(user_id)
+    with as_user(user_id):
+        if os.environ.get("PLAN_MODE", "form") == "text":
+            return await plan_trip_async(text)
+        return await plan_trip_form_async(**fields)
+
+
+async def _run_job(job_params: dict):
+    with trace("job plan"), as_user(job_params.get("user_id")):
+        return await plan_trip_form_async(**job_params["fields"])
+
+
+# 后台规划任务：PLAN_JOB_WORKERS 个工作协程，全局/单用户排队上限用于背压
+job_queue = JobQueue(
+    _run_job,
+    workers=int(os.environ.get("PLAN_JOB_WORKERS", "4")),
+    max_pending=int(os.environ.get("PLAN_JOB_MAX_PENDING", "200")),
+    max_per_user=int(os.environ.get("PLAN_JOB_MAX_PER_USER", "3")),
+    stale_seconds=float(os.environ.get("PLAN_JOB_STALE_SECONDS", "900")),
+    retention_seconds=float(os.environ.get("PLAN_JOB_RETENTION_HOURS", "168")) * 3600,
+)
 
 
 @app.on_event("startup")
-def _startup():
+async def _startup():
     init_db()
+    # 预加载静态城市知识库，避免首个回退请求承担加载耗时
+    get_knowledge_base()
+    await job_queue.start()
+
+
+@app.on_event("shutdown")
+async def _shutdown():
+    await job_queue.stop()
+    get_hasher().shutdown()
+    get_usage_recorder().flush()
 
 
 @app.get("/")
@@ -83,7 +213,7 @@ def index(request: Request):
 
 
 @app.post("/plan")
-def plan(
+async def plan(
     request: Request,
     title: str = Form(""),
     destination: str = Form("") ,
@@ -102,46 +232,12 @@ def plan(
     redirect = _require_login(request, "/")
     if redirect:
         return redirect
-    # 计算天数（若提供了日期范围）
-    computed_days = days
-    if not computed_days and start_date and end_date:
-        try:
-            d1 = datetime.fromisoformat(start_date)
-            d2 = datetime.fromisoformat(end_date)
-            delta = (d2 - d1).days + 1
-            if delta > 0:
-                computed_days = delta
-        except Exception:
-            computed_days = days
-
-    # 组合自然语言文本供解析/规划
-    parts = []
-    if destination:
-        parts.append(f"我想去{destination}")
-    if start_date and end_date and computed_days:
-        parts.append(f"从{start_date}到{end_date}共{computed_days}天")
-    elif computed_days:
-        parts.append(f"{computed_days}天")
-    if budget_cny:
-        parts.append(f"预算{budget_cny}元")
-    if adults is not None or children is not None:
-        parts.append(f"成人{adults}，儿童{children}")
-    if preferences:
-        parts.append("喜欢" + ",".join(preferences))
-    # 城市列表（可多个）
-    cities_list: List[str] = []
-    if cities_text:
-        for raw in re.split(r"[，,\s]+", cities_text.strip()):
-            if raw:
-                cities_list.append(raw)
-    if cities_list:
-        parts.append("城市包括" + "、".join(cities_list))
-    if extra_info:
-        parts.append("补充信息：" + extra_info)
-    text = "，".join(parts) if parts else ""
+    computed_days = _compute_days(days, start_date, end_date)
+    fields = _plan_fields(destination, start_date, end_date, computed_days, budget_cny, adults, children, preferences, cities_text, extra_info)
+    text = compose_form_text(**fields)
 
     try:
-        data = plan_trip(text)
+        data = await _run_plan(text, fields, request.session.get("user_id"))
         uid = request.session.get("user_id")
         email = request.session.get("user_email")
         user = {"id": uid, "username": email} if uid else None
@@ -169,6 +265,7 @@ def plan(
                 "amap_key": amap_key,
                 "travel_mode": travel_mode,
                 "render_for_plan": True,
+                "result_token": _export_signer.dumps(data),
                 "result_json_str": json.dumps(data, ensure_ascii=False),
                 "params_json_str": json.dumps(
                     {
@@ -217,8 +314,151 @@ def plan(
         )
 
 
+@app.get("/plan/stream")
+def plan_stream_page(
+    request: Request,
+    title: str = Query(""),
+    travel_mode: str = Query("driving"),
+):
+    """流式结果页：页面先返回，行程通过 /api/plan/stream 逐天推送渲染。"""
+    redirect = _require_login(request, "/")
+    if redirect:
+        return redirect
+    uid = request.session.get("user_id")
+    email = request.session.get("user_email")
+    return templates.TemplateResponse(
+        "result.html",
+        {
+            "request": request,
+            "result": None,
+            "stream_url": "/api/plan/stream?" + request.url.query,
+            "title": title,
+            "user": {"id": uid, "username": email},
+            "travel_mode": travel_mode,
+            "error": None,
+        },
+    )
+
+
+@app.get("/api/plan/stream")
+async def api_plan_stream(
+    request: Request,
+    title: str = Query(""),
+    destination: str = Query(""),
+    start_date: str = Query(""),
+    end_date: str = Query(""),
+    days: str = Query(""),
+    budget_cny: str = Query(""),
+    adults: str = Query("1"),
+    children: str = Query("0"),
+    preferences: List[str] = Query(default=[]),
+    cities_text: str = Query(""),
+    extra_info: str = Query(""),
+    travel_mode: str = Query("driving"),
+):
+    """Server-Sent Events：hotel / transport / day 完成即推送，最后推送 result 或 error。"""
+    if not request.session.get("user_id"):
+        return PlainTextResponse("请先登录", status_code=401)
+    # 查询参数中的空数字按未填写处理
+    budget_cny = _opt_int(budget_cny)
+    adults = _opt_int(adults) or 1
+    children = _opt_int(children) or 0
+    computed_days = _compute_days(_opt_int(days), start_date, end_date)
+    fields = _plan_fields(destination, start_date, end_date, computed_days, budget_cny, adults, children, preferences, cities_text, extra_info)
+    params = {
+        "title": title,
+        "destination": destination,
+        "start_date": start_date,
+        "end_date": end_date,
+        "days": computed_days,
+        "budget_cny": budget_cny,
+        "adults": adults,
+        "children": children,
+        "preferences": preferences,
+        "cities_text": cities_text,
+        "extra_info": extra_info,
+        "travel_mode": travel_mode,
+    }
+
+    uid = request.session.get("user_id")
+
+    async def events():
+        try:
+            await get_usage_recorder().check_async(uid)
+            with as_user(uid):
+                async for kind, data in plan_trip_form_stream(**fields):
+                    if kind == "result":
+                        data = {"result": data, "params": params, "token": _export_signer.dumps(data)}
+                    yield sse(kind, data)
+        except Exception as e:
+            yield sse("error", {"error": f"无法调用LLM：{e}"})
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+# =============== 导出 ===============
+_EXPORT_FILENAMES = {"json": "trip_plan.json", "csv": "budget.csv"}
+
+
+def _iter_text(text: str, chunk_size: int = 65536):
+    for i in range(0, len(text), chunk_size):
+        yield text[i:i + chunk_size]
+
+
+def _export_response(data, fmt: str):
+    """直接基于已有结果流式导出，不调用LLM、不写临时文件。data 为结果 dict 或已保存的 JSON 文本。"""
+    headers = {"Content-Disposition": f'attachment; filename="{_EXPORT_FILENAMES[fmt]}"'}
+    if fmt == "json":
+        # 已保存的 JSON 文本原样输出，避免重复解析与序列化
+        body = _iter_text(data) if isinstance(data, str) else iter_json(data)
+        return StreamingResponse(body, media_type="application/json; charset=utf-8", headers=headers)
+    if isinstance(data, str):
+        data = json.loads(data)
+    return StreamingResponse(iter_csv(data), media_type="text/csv; charset=utf-8", headers=headers)
+
+
+@app.get("/plans/{plan_id}/export/{fmt}")
+def export_saved_plan(request: Request, plan_id: str, fmt: str):
+    redirect = _require_login(request, f"/plans/{plan_id}")
+    if redirect:
+        return redirect
+    if fmt not in _EXPORT_FILENAMES:
+        return PlainTextResponse("不支持的导出格式", status_code=404)
+    p = get_plan(plan_id, request.session.get("user_id"))
+    if not p or not p.get("data_json"):
+        return PlainTextResponse("未找到该计划", status_code=404)
+    return _export_response(p["data_json"], fmt)
+
+
+@app.get("/api/plan/jobs/{job_id}/export/{fmt}")
+def export_job_result(request: Request, job_id: str, fmt: str):
+    uid = request.session.get("user_id")
+    if not uid:
+        return PlainTextResponse("请先登录", status_code=401)
+    if fmt not in _EXPORT_FILENAMES:
+        return PlainTextResponse("不支持的导出格式", status_code=404)
+    job = get_job(job_id, uid)
+    if not job or job["status"] != "done":
+        return PlainTextResponse("任务不存在或尚未完成", status_code=404)
+    return _export_response(job["result_json"], fmt)
+
+
+def _export_from_token(token: str, fmt: str):
+    try:
+        data = _export_signer.loads(token)
+    except BadSignature:
+        return PlainTextResponse("导出令牌无效", status_code=400)
+    return _export_response(data, fmt)
+
+
 @app.post("/export/json")
-def export_json_route(
+async def export_json_route(
+    request: Request,
+    token: str = Form(""),
     destination: str = Form("") ,
     start_date: str = Form("") ,
     end_date: str = Form("") ,
@@ -230,49 +470,24 @@ def export_json_route(
     cities_text: str = Form(""),
     extra_info: str = Form(""),
 ):
-    # 与/plan保持一致的文本拼接
-    computed_days = days
-    if not computed_days and start_date and end_date:
-        try:
-            d1 = datetime.fromisoformat(start_date)
-            d2 = datetime.fromisoformat(end_date)
-            delta = (d2 - d1).days + 1
-            if delta > 0:
-                computed_days = delta
-        except Exception:
-            computed_days = days
-    parts = []
-    if destination:
-        parts.append(f"我想去{destination}")
-    if start_date and end_date and computed_days:
-        parts.append(f"从{start_date}到{end_date}共{computed_days}天")
-    elif computed_days:
-        parts.append(f"{computed_days}天")
-    if budget_cny:
-        parts.append(f"预算{budget_cny}元")
-    parts.append(f"成人{adults}，儿童{children}")
-    if preferences:
-        parts.append("喜欢" + ",".join(preferences))
-    if cities_text:
-        cities_list = [c for c in re.split(r"[，,\s]+", cities_text.strip()) if c]
-        if cities_list:
-            parts.append("城市包括" + "、".join(cities_list))
-    if extra_info:
-        parts.append("补充信息：" + extra_info)
-    text = "，".join(parts) if parts else ""
+    # 优先使用结果页携带的签名令牌，直接导出当前展示的计划
+    if token:
+        return _export_from_token(token, "json")
+    computed_days = _compute_days(days, start_date, end_date)
+    fields = _plan_fields(destination, start_date, end_date, computed_days, budget_cny, adults, children, preferences, cities_text, extra_info)
+    text = compose_form_text(**fields)
     try:
-        data = plan_trip(text)
+        data = await _run_plan(text, fields, request.session.get("user_id"))
     except Exception as e:
         # 返回简单文本错误
-        from fastapi.responses import PlainTextResponse
         return PlainTextResponse(f"无法调用LLM：{e}", status_code=400)
-    with NamedTemporaryFile(delete=False, suffix=".json") as tmp:
-        export_json(data, tmp.name)
-        return FileResponse(tmp.name, media_type="application/json", filename="trip_plan.json")
+    return _export_response(data, "json")
 
 
 @app.post("/export/csv")
-def export_csv_route(
+async def export_csv_route(
+    request: Request,
+    token: str = Form(""),
     destination: str = Form("") ,
     start_date: str = Form("") ,
     end_date: str = Form("") ,
@@ -284,68 +499,145 @@ def export_csv_route(
     cities_text: str = Form(""),
     extra_info: str = Form(""),
 ):
-    # 与/plan保持一致的文本拼接
-    computed_days = days
-    if not computed_days and start_date and end_date:
-        try:
-            d1 = datetime.fromisoformat(start_date)
-            d2 = datetime.fromisoformat(end_date)
-            delta = (d2 - d1).days + 1
-            if delta > 0:
-                computed_days = delta
-        except Exception:
-            computed_days = days
-    parts = []
-    if destination:
-        parts.append(f"我想去{destination}")
-    if start_date and end_date and computed_days:
-        parts.append(f"从{start_date}到{end_date}共{computed_days}天")
-    elif computed_days:
-        parts.append(f"{computed_days}天")
-    if budget_cny:
-        parts.append(f"预算{budget_cny}元")
-    parts.append(f"成人{adults}，儿童{children}")
-    if preferences:
-        parts.append("喜欢" + ",".join(preferences))
-    if cities_text:
-        cities_list = [c for c in re.split(r"[，,\s]+", cities_text.strip()) if c]
-        if cities_list:
-            parts.append("城市包括" + "、".join(cities_list))
-    if extra_info:
-        parts.append("补充信息：" + extra_info)
-    text = "，".join(parts) if parts else ""
+    if token:
+        return _export_from_token(token, "csv")
+    computed_days = _compute_days(days, start_date, end_date)
+    fields = _plan_fields(destination, start_date, end_date, computed_days, budget_cny, adults, children, preferences, cities_text, extra_info)
+    text = compose_form_text(**fields)
     try:
-        data = plan_trip(text)
+        data = await _run_plan(text, fields, request.session.get("user_id"))
     except Exception as e:
-        from fastapi.responses import PlainTextResponse
         return PlainTextResponse(f"无法调用LLM：{e}", status_code=400)
-    with NamedTemporaryFile(delete=False, suffix=".csv") as tmp:
-        export_csv(data, tmp.name)
-        return FileResponse(tmp.name, media_type="text/csv", filename="budget.csv")
+    return _export_response(data, "csv")
 
 
 @app.post("/api/asr")
 async def api_asr(file: UploadFile = File(...)):
-    """语音识别接口：接收 16k PCM WAV，返回 {text} 字段供前端填充。"""
+    """语音识别接口：接收 16k PCM WAV，返回 {text, timings} 字段供前端填充（timings 为各阶段耗时毫秒）。"""
     # 读取文件字节
     wav_bytes = await file.read()
     try:
-        text = await transcribe_wav16_xfyun_ws(wav_bytes)
-        return {"text": text}
+        text, timings = await transcribe_wav16_xfyun_ws_timed(wav_bytes)
+        return {"text": text, "timings": timings}
     except Exception as e:
         # 与前端约定：返回空文本并携带错误信息，避免打断交互
         return {"text": "", "error": f"ASR失败：{e}"}
 
 
+@app.get("/metrics")
+async def metrics(request: Request):
+    """Prometheus 文本格式的各阶段耗时直方图；设置 METRICS_TOKEN 时需携带 Authorization: Bearer <token>。"""
+    token = os.environ.get("METRICS_TOKEN")
+    if token and request.headers.get("authorization") != f"Bearer {token}":
+        return PlainTextResponse("unauthorized", status_code=401)
+    return PlainTextResponse(tracing.render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+@app.websocket("/ws/asr")
+async def ws_asr(websocket: WebSocket):
+    """流式语音识别：浏览器边录边发 16k 单声道 16bit PCM（二进制消息），说完发送文本 "end"。
+
+    音频实时转发给讯飞，服务端推送 {"type": "partial"|"final", "text": ...}，出错时推送 {"type": "error", "error": ...}。
+    单次会话最长 ASR_STREAM_MAX_SECONDS 秒（默认 60，与讯飞单次听写上限一致）。
+    """
+    await websocket.accept()
+    try:
+        rec = get_asr_manager().session()
+        await rec.open()
+    except ASRError as e:
+        await websocket.send_json({"type": "error", "error": f"ASR失败：{e}"})
+        await websocket.close()
+        return
+
+    async def pump_audio():
+        try:
+            while True:
+                msg = await websocket.receive()
+                if msg["type"] == "websocket.disconnect":
+                    break
+                if msg.get("bytes"):
+                    await rec.send_audio(msg["bytes"])
+                elif (msg.get("text") or "").strip() == "end":
+                    break
+        finally:
+            await rec.finish()
+
+    async def relay():
+        async for kind, text in rec.results():
+            await websocket.send_json({"type": kind, "text": text})
+
+    async def stream():
+        # 等待识别结束；转发音频出错时不再等待结果，把异常抛给下面的处理推送给客户端
+        relay_task = asyncio.create_task(relay())
+        try:
+            waiting = {relay_task, pump}
+            while not relay_task.done():
+                done, waiting = await asyncio.wait(waiting, return_when=asyncio.FIRST_COMPLETED)
+                if pump in done and not pump.cancelled() and pump.exception() is not None:
+                    raise pump.exception()
+            await relay_task
+        finally:
+            relay_task.cancel()
+            await asyncio.gather(relay_task, return_exceptions=True)
+
+    pump = asyncio.create_task(pump_audio())
+    try:
+        with span("asr.stream"):
+            await asyncio.wait_for(stream(), timeout=float(os.environ.get("ASR_STREAM_MAX_SECONDS", "60")))
+    except asyncio.TimeoutError:
+        await _ws_send_quietly(websocket, {"type": "final", "text": rec.assembler.text})
+    except Exception as e:
+        # 识别服务或音频转发出错（ASRError 等）
+        await _ws_send_quietly(websocket, {"type": "error", "error": f"ASR失败：{e}"})
+    finally:
+        # 等转发协程（含其中的 rec.finish）真正退出后再关闭会话
+        pump.cancel()
+        await asyncio.gather(pump, return_exceptions=True)
+        await rec.close()
+        try:
+            await websocket.close()
+        except Exception:
+            pass
+
+
+async def _ws_send_quietly(websocket: WebSocket, data: dict) -> None:
+    # 客户端可能已断开，发送失败不再抛出
+    try:
+        await websocket.send_json(data)
+    except Exception:
+        pass
+
+
 # =============== 用户注册登录 ===============
 @app.get("/register")
 def register_page(request: Request):
     return templates.TemplateResponse("register.html", {"request": request, "error": None})
 
 
+# 登录/注册按客户端 IP 限流：每分钟 AUTH_RATE_PER_MIN 次，允许短时突发 AUTH_RATE_BURST 次
+auth_limiter = RateLimiter(
+    rate_per_minute=float(os.environ.get("AUTH_RATE_PER_MIN", "10")),
+    burst=int(os.environ.get("AUTH_RATE_BURST", "5")),
+)
+
+
+def _auth_throttled(request: Request, template: str, ctx: dict):
+    wait = auth_limiter.hit(request.client.host if request.client else "unknown")
+    if not wait:
+        return None
+    ctx = {"request": request, **ctx, "error": f"尝试过于频繁，请 {int(wait) + 1} 秒后再试"}
+    return templates.TemplateResponse(template, ctx, status_code=429, headers={"Retry-After": str(int(wait) + 1)})
+
+
 @app.post("/register")
-def register_submit(request: Request, username: str = Form(...), password: str = Form(...)):
-    err = create_user(username, password)
+async def register_submit(request: Request, username: str = Form(...), password: str = Form(...)):
+    throttled = _auth_throttled(request, "register.html", {})
+    if throttled:
+        return throttled
+    try:
+        err = await db_async.create_user(username, password)
+    except PasswordHashBusy as e:
+        return templates.TemplateResponse("register.html", {"request": request, "error": str(e)}, status_code=503)
     if err:
         return templates.TemplateResponse("register.html", {"request": request, "error": err})
     # 注册成功后不自动登录，跳转至登录页
@@ -358,8 +650,14 @@ def login_page(request: Request, next: str = ""):
 
 
 @app.post("/login")
-def login_submit(request: Request, username: str = Form(...), password: str = Form(...), next: str = Form("")):
-    user = verify_user(username, password)
+async def login_submit(request: Request, username: str = Form(...), password: str = Form(...), next: str = Form("")):
+    throttled = _auth_throttled(request, "login.html", {"next": next})
+    if throttled:
+        return throttled
+    try:
+        user = await db_async.verify_user(username, password)
+    except PasswordHashBusy as e:
+        return templates.TemplateResponse("login.html", {"request": request, "error": str(e), "next": next}, status_code=503)
     if not user:
         return templates.TemplateResponse("login.html", {"request": request, "error": "用户名或密码错误", "next": next})
     request.session["user_id"] = user["id"]
@@ -369,6 +667,9 @@ def login_submit(request: Request, username: str = Form(...), password: str = Fo
 
 @app.get("/logout")
 def logout(request: Request):
+    uid = request.session.get("user_id")
+    if uid:
+        invalidate_user(uid)
     request.session.pop("user_id", None)
     request.session.pop("user_email", None)
     request.session.pop("access_token", None)
@@ -382,16 +683,75 @@ def _require_login(request: Request, next_path: str = "/"):
     return None
 
 
+# 计划列表每页条数
+PLANS_PAGE_SIZE = int(os.environ.get("PLANS_PAGE_SIZE", "20"))
+
+
+def _plans_page(uid: str, cursor: Optional[str] = None, limit: Optional[int] = None) -> dict:
+    limit = max(1, min(int(limit or PLANS_PAGE_SIZE), 100))
+    try:
+        return list_plans_page(uid, limit=limit, cursor=cursor or None)
+    except ValueError:
+        # 游标无效时回到第一页
+        return list_plans_page(uid, limit=limit)
+
+
 @app.get("/plans")
-def plans_page(request: Request):
+def plans_page(request: Request, cursor: Optional[str] = None):
+    redirect = _require_login(request, "/plans")
+    if redirect:
+        return redirect
+    uid = request.session.get("user_id")
+    email = request.session.get("user_email")
+    user = {"id": uid, "username": email} if email else get_user_by_id(uid)
+    page = _plans_page(uid, cursor)
+    return templates.TemplateResponse(
+        "plans.html",
+        {"request": request, "user": user, "plans": page["items"], "next_cursor": page["next_cursor"], "paged": bool(cursor)},
+    )
+
+
+@app.get("/plans/search")
+def plans_search_page(request: Request, q: str = ""):
     redirect = _require_login(request, "/plans")
     if redirect:
         return redirect
     uid = request.session.get("user_id")
     email = request.session.get("user_email")
     user = {"id": uid, "username": email} if email else get_user_by_id(uid)
-    plans = list_plans(uid)
-    return templates.TemplateResponse("plans.html", {"request": request, "user": user, "plans": plans})
+    results = search_plans(uid, q) if q.strip() else []
+    return templates.TemplateResponse(
+        "plans.html",
+        {"request": request, "user": user, "plans": [], "query": q, "results": results},
+    )
+
+
+@app.get("/api/plans/search")
+def api_plans_search(request: Request, q: str = "", limit: str = ""):
+    uid = request.session.get("user_id")
+    if not uid:
+        return JSONResponse({"error": "未登录"}, status_code=401)
+    limit_n = max(1, min(_opt_int(limit) or 20, 100))
+    return JSONResponse({"query": q, "results": search_plans(uid, q, limit=limit_n) if q.strip() else []})
+
+
+@app.get("/api/plans")
+def api_plans(request: Request, limit: str = "", cursor: Optional[str] = None):
+    uid = request.session.get("user_id")
+    if not uid:
+        return JSONResponse({"error": "未登录"}, status_code=401)
+    return JSONResponse(_plans_page(uid, cursor, _opt_int(limit)))
+
+
+def _with_routes(data_json: str, params_json: Optional[str]) -> str:
+    """保存前在服务端计算每日路线（经路线缓存），详情页地图直接绘制，不再逐段调用前端路线规划。"""
+    try:
+        data = json.loads(data_json)
+        mode = (json.loads(params_json) or {}).get("travel_mode") if params_json else None
+        attach_routes(data, mode)
+        return json.dumps(data, ensure_ascii=False)
+    except Exception:
+        return data_json
 
 
 @app.post("/plans/save")
@@ -400,7 +760,7 @@ def save_plan(request: Request, title: str = Form("我的旅行计划"), data_js
     if redirect:
         return redirect
     uid = request.session.get("user_id")
-    new_id = create_plan(uid, title, data_json, params_json)
+    new_id = create_plan(uid, title, _with_routes(data_json, params_json), params_json)
     return RedirectResponse(url=f"/plans/{new_id}", status_code=302)
 
 
@@ -414,7 +774,11 @@ def view_plan(request: Request, plan_id: str):
     user = {"id": uid, "username": email} if email else get_user_by_id(uid)
     p = get_plan(plan_id, uid)
     if not p:
-        return templates.TemplateResponse("plans.html", {"request": request, "user": user, "plans": list_plans(uid), "error": "未找到该计划"})
+        page = _plans_page(uid)
+        return templates.TemplateResponse(
+            "plans.html",
+            {"request": request, "user": user, "plans": page["items"], "next_cursor": page["next_cursor"], "error": "未找到该计划"},
+        )
     result = json.loads(p["data_json"]) if p.get("data_json") else None
     # 高德地图 Key（优先配置文件，回退环境变量）
     amap_key = getattr(tp_config, "AMAP_WEB_KEY", None) or os.getenv("AMAP_WEB_KEY") or ""
@@ -431,6 +795,14 @@ def view_plan(request: Request, plan_id: str):
                 travel_mode = tm
     except Exception:
         pass
+    # 路线已在保存时计算；旧计划或出行方式不一致时在服务端经缓存补算
+    # 计算失败时不传路线，页面改用浏览器端地理编码与路线规划
+    routes = None
+    if result:
+        try:
+            routes = routes_for(result, travel_mode)
+        except Exception:
+            routes = None
     return templates.TemplateResponse(
         "result.html",
         {
@@ -438,8 +810,10 @@ def view_plan(request: Request, plan_id: str):
             "result": result,
             "user": user,
             "saved_title": p["title"],
+            "plan_id": p["id"],
             "text": None,
             "result_json_str": p["data_json"],
+            "routes_json_str": json.dumps(routes, ensure_ascii=False) if routes else "",
             "params_json_str": p.get("params_json"),
             "amap_key": amap_key,
             "amap_js_sec_code": amap_js_sec_code,
@@ -448,6 +822,22 @@ def view_plan(request: Request, plan_id: str):
     )
 
 
+@app.get("/api/plans/{plan_id}/routes")
+def api_plan_routes(request: Request, plan_id: str, mode: str = "driving"):
+    """已保存计划的每日路线（折线、距离、耗时），地图切换出行方式时调用。"""
+    uid = request.session.get("user_id")
+    if not uid:
+        return JSONResponse({"error": "请先登录"}, status_code=401)
+    p = get_plan(plan_id, uid)
+    if not p:
+        return JSONResponse({"error": "未找到该计划"}, status_code=404)
+    try:
+        result = json.loads(p["data_json"]) if p.get("data_json") else {}
+        return routes_for(result, mode)
+    except Exception as e:
+        return JSONResponse({"error": f"路线计算失败：{e}"}, status_code=500)
+
+
 @app.post("/plans/{plan_id}/delete")
 def delete_plan_route(request: Request, plan_id: str):
     redirect = _require_login(request, f"/plans/{plan_id}")
@@ -467,17 +857,49 @@ def account_page(request: Request):
     uid = request.session.get("user_id")
     email = request.session.get("user_email")
     user = {"id": uid, "username": email} if email else get_user_by_id(uid)
-    return templates.TemplateResponse("account.html", {"request": request, "user": user, "message": None, "error": None})
+    return templates.TemplateResponse(
+        "account.html",
+        {"request": request, "user": user, "message": None, "error": None, "usage": _usage_summary(uid)},
+    )
+
+
+def _usage_summary(uid) -> Optional[dict]:
+    # 用量读取失败不影响账号页的其它功能
+    try:
+        return get_usage_recorder().user_summary(uid, days=int(os.environ.get("LLM_USAGE_DAYS", "7")))
+    except Exception:
+        return None
+
+
+def _is_admin(request: Request) -> bool:
+    # ADMIN_TOKEN：Authorization: Bearer <token>；ADMIN_USERS：逗号分隔的用户名或用户ID（需登录）
+    token = os.environ.get("ADMIN_TOKEN")
+    if token and request.headers.get("authorization") == f"Bearer {token}":
+        return True
+    admins = {a.strip() for a in os.environ.get("ADMIN_USERS", "").split(",") if a.strip()}
+    uid = request.session.get("user_id")
+    if not admins or not uid:
+        return False
+    name = request.session.get("user_email") or (get_user_by_id(uid) or {}).get("username")
+    return str(uid) in admins or (name in admins)
+
+
+@app.get("/api/admin/usage")
+def api_admin_usage(request: Request, days: int = Query(7, ge=1, le=90), top: int = Query(50, ge=1, le=1000)):
+    """LLM 用量汇总（按用户 / 阶段 / 模型 / 日期），仅管理员可访问。"""
+    if not _is_admin(request):
+        return JSONResponse({"error": "无权访问"}, status_code=403)
+    return get_usage_recorder().admin_summary(days=days, top=top)
 
 
 @app.post("/account/password")
-def account_change_password(request: Request, old_password: str = Form(...), new_password: str = Form(...), confirm_password: str = Form(...)):
+async def account_change_password(request: Request, old_password: str = Form(...), new_password: str = Form(...), confirm_password: str = Form(...)):
     redirect = _require_login(request, "/account")
     if redirect:
         return redirect
     uid = request.session.get("user_id")
     email = request.session.get("user_email")
-    user = {"id": uid, "username": email} if email else get_user_by_id(uid)
+    user = {"id": uid, "username": email} if email else await db_async.get_user_by_id(uid)
     if new_password != confirm_password:
         return templates.TemplateResponse("account.html", {"request": request, "user": user, "message": None, "error": "两次输入的新密码不一致"})
 
@@ -485,14 +907,19 @@ def account_change_password(request: Request, old_password: str = Form(...), new
     uname = email or (user and user.get("username"))
     if not uname:
         return templates.TemplateResponse("account.html", {"request": request, "user": user, "message": None, "error": "无法获取用户名，请重新登录后重试"})
-    v = verify_user(uname, old_password)
+    throttled = _auth_throttled(request, "account.html", {"user": user, "message": None})
+    if throttled:
+        return throttled
+    try:
+        v = await db_async.verify_user(uname, old_password)
+    except PasswordHashBusy as e:
+        return templates.TemplateResponse("account.html", {"request": request, "user": user, "message": None, "error": str(e)}, status_code=503)
     if not v:
         return templates.TemplateResponse("account.html", {"request": request, "user": user, "message": None, "error": "当前密码错误"})
 
     # 更新密码
     try:
-        from travel_planner_agent.db import update_user_password
-        ok = update_user_password(uid, new_password)
+        ok = await db_async.update_user_password(uid, new_password)
         if not ok:
             return templates.TemplateResponse("account.html", {"request": request, "user": user, "message": None, "error": "修改密码失败"})
     except Exception as e:
@@ -502,7 +929,8 @@ def account_change_password(request: Request, old_password: str = Form(...), new
 
 
 @app.post("/api/plan")
-def api_plan(
+async def api_plan(
+    request: Request,
     destination: str = Form("") ,
     start_date: str = Form("") ,
     end_date: str = Form("") ,
@@ -514,37 +942,93 @@ def api_plan(
     cities_text: str = Form(""),
     extra_info: str = Form(""),
 ):
-    # 组合文本，与/plan一致
-    computed_days = days
-    if not computed_days and start_date and end_date:
-        try:
-            d1 = datetime.fromisoformat(start_date)
-            d2 = datetime.fromisoformat(end_date)
-            delta = (d2 - d1).days + 1
-            if delta > 0:
-                computed_days = delta
-        except Exception:
-            computed_days = days
-    parts = []
-    if destination:
-        parts.append(f"我想去{destination}")
-    if start_date and end_date and computed_days:
-        parts.append(f"从{start_date}到{end_date}共{computed_days}天")
-    elif computed_days:
-        parts.append(f"{computed_days}天")
-    if budget_cny:
-        parts.append(f"预算{budget_cny}元")
-    parts.append(f"成人{adults}，儿童{children}")
-    if preferences:
-        parts.append("喜欢" + ",".join(preferences))
-    if cities_text:
-        cities_list = [c for c in re.split(r"[，,\s]+", cities_text.strip()) if c]
-        if cities_list:
-            parts.append("城市包括" + "、".join(cities_list))
-    if extra_info:
-        parts.append("补充信息：" + extra_info)
-    text = "，".join(parts) if parts else ""
+    computed_days = _compute_days(days, start_date, end_date)
+    fields = _plan_fields(destination, start_date, end_date, computed_days, budget_cny, adults, children, preferences, cities_text, extra_info)
+    text = compose_form_text(**fields)
     try:
-        return plan_trip(text)
+        return await _run_plan(text, fields, request.session.get("user_id"))
     except Exception as e:
-        return {"error": f"无法调用LLM：{e}"}
\ No newline at end of file
+        return {"error": f"无法调用LLM：{e}"}
+
+
+# =============== 后台规划任务 ===============
+@app.post("/api/plan/jobs")
+async def api_plan_job_submit(
+    request: Request,
+    title: str = Form(""),
+    destination: str = Form("") ,
+    start_date: str = Form("") ,
+    end_date: str = Form("") ,
+    days: Optional[int] = Form(None),
+    budget_cny: Optional[int] = Form(None),
+    adults: int = Form(1),
+    children: int = Form(0),
+    preferences: List[str] = Form(default=[]),
+    cities_text: str = Form(""),
+    extra_info: str = Form(""),
+    travel_mode: str = Form("driving"),
+):
+    """提交规划任务并立即返回 job_id；结果通过 GET /api/plan/jobs/{job_id} 轮询。"""
+    uid = request.session.get("user_id")
+    if not uid:
+        return JSONResponse({"error": "请先登录"}, status_code=401)
+    computed_days = _compute_days(days, start_date, end_date)
+    fields = _plan_fields(destination, start_date, end_date, computed_days, budget_cny, adults, children, preferences, cities_text, extra_info)
+    params = {
+        "title": title,
+        "destination": destination,
+        "start_date": start_date,
+        "end_date": end_date,
+        "days": computed_days,
+        "budget_cny": budget_cny,
+        "adults": adults,
+        "children": children,
+        "preferences": preferences,
+        "cities_text": cities_text,
+        "extra_info": extra_info,
+        "travel_mode": travel_mode,
+    }
+    try:
+        await get_usage_recorder().check_async(uid)
+        job_id = await job_queue.submit(uid, {"fields": fields, "params": params, "user_id": uid})
+    except (JobQueueFull, QuotaExceeded) as e:
+        return JSONResponse({"error": str(e)}, status_code=429)
+    return JSONResponse({"job_id": job_id, "status": "queued"}, status_code=202)
+
+
+@app.get("/api/plan/jobs/{job_id}")
+def api_plan_job_status(request: Request, job_id: str):
+    uid = request.session.get("user_id")
+    if not uid:
+        return JSONResponse({"error": "请先登录"}, status_code=401)
+    job = get_job(job_id, uid)
+    if not job:
+        return JSONResponse({"error": "未找到该任务"}, status_code=404)
+    out = {"job_id": job["id"], "status": job["status"], "created_at": job["created_at"], "updated_at": job["updated_at"]}
+    if job["status"] == "done":
+        out["result"] = json.loads(job["result_json"])
+    elif job["status"] == "failed":
+        out["error"] = job["error"]
+    return out
+
+
+@app.post("/api/plan/jobs/{job_id}/save")
+def api_plan_job_save(request: Request, job_id: str, title: str = Form("")):
+    """把已完成任务的结果直接保存为计划，无需前端回传 data_json。"""
+    uid = request.session.get("user_id")
+    if not uid:
+        return JSONResponse({"error": "请先登录"}, status_code=401)
+    job = get_job(job_id, uid)
+    if not job:
+        return JSONResponse({"error": "未找到该任务"}, status_code=404)
+    if job["status"] != "done":
+        return JSONResponse({"error": "任务尚未完成"}, status_code=409)
+    params = json.loads(job["params_json"]).get("params") or {}
+    params_json = json.dumps(params, ensure_ascii=False)
+    new_id = create_plan(
+        uid,
+        title or params.get("title") or "我的旅行计划",
+        _with_routes(job["result_json"], params_json),
+        params_json,
+    )
+    return {"plan_id": new_id}